@@ -64,6 +64,50 @@ class GameApiService {
     }
   }
 
+  /// Room events from the server (Server-Sent Events on /events).
+  /// Each item is {'id': ..., 'event': ..., 'data': {...}}; the stream ends
+  /// when the connection drops, reconnecting is up to the caller.
+  Stream<Map<String, dynamic>> roomEvents(String code, {String? lastEventId}) async* {
+    final client = http.Client();
+    try {
+      final request = http.Request(
+          'GET', Uri.parse('$baseUrl/events?code=${Uri.encodeComponent(code)}'));
+      request.headers['Accept'] = 'text/event-stream';
+      if (lastEventId != null) {
+        request.headers['Last-Event-ID'] = lastEventId;
+      }
+      final response = await client.send(request);
+      if (response.statusCode != 200) {
+        throw Exception('Failed to open room events: ${response.statusCode}');
+      }
+
+      String? id;
+      String event = 'message';
+      final data = StringBuffer();
+      final lines = response.stream
+          .transform(utf8.decoder)
+          .transform(const LineSplitter());
+      await for (final line in lines) {
+        if (line.isEmpty) {
+          if (data.isNotEmpty) {
+            yield {'id': id, 'event': event, 'data': jsonDecode(data.toString())};
+          }
+          event = 'message';
+          data.clear();
+        } else if (line.startsWith('id:')) {
+          id = line.substring(3).trim();
+        } else if (line.startsWith('event:')) {
+          event = line.substring(6).trim();
+        } else if (line.startsWith('data:')) {
+          if (data.isNotEmpty) data.write('\n');
+          data.write(line.substring(5).trim());
+        }
+      }
+    } finally {
+      client.close();
+    }
+  }
+
   Future<GameState> startGame(String code) async {
     try {
       final uri = Uri.parse('$baseUrl/startgame?code=${Uri.encodeComponent(code)}');
@@ -1,3 +1,4 @@
+import 'package:flutter/foundation.dart';
 import 'package:flutter/material.dart';
 import 'package:flutter/services.dart';
 import 'dart:async';
@@ -25,6 +26,8 @@ class GameBoardPage extends StatefulWidget {
 class _GameBoardPageState extends State<GameBoardPage> {
   final GameApiService _apiService = GameApiService();
   Timer? _pollTimer;
+  StreamSubscription<Map<String, dynamic>>? _eventSub;
+  String? _lastEventId;
   GameState? _currentState;
   bool _isRollingDice = false;
   int? _diceResult;
@@ -41,22 +44,54 @@ class _GameBoardPageState extends State<GameBoardPage> {
       DeviceOrientation.landscapeLeft,
       DeviceOrientation.landscapeRight,
     ]);
+    _listenRoomEvents();
     _startPolling();
   }
 
   @override
   void dispose() {
     _pollTimer?.cancel();
+    _eventSub?.cancel();
     super.dispose();
   }
 
   void _startPolling() {
-    _pollTimer = Timer.periodic(const Duration(seconds: 1), (timer) async {
+    _pollTimer?.cancel();
+    // With room events connected the timer is only a safety net
+    final interval = _eventSub != null
+        ? const Duration(seconds: 10)
+        : const Duration(seconds: 1);
+    _pollTimer = Timer.periodic(interval, (timer) async {
       await _refreshGameState();
     });
     _refreshGameState();
   }
 
+  void _listenRoomEvents() {
+    // Browsers buffer streamed http responses, so web keeps polling
+    if (kIsWeb || _eventSub != null || _gameEndDialogShown) return;
+    _eventSub = _apiService
+        .roomEvents(widget.gameCode, lastEventId: _lastEventId)
+        .listen((event) {
+      _lastEventId = event['id'] ?? _lastEventId;
+      // Polling is paused while a question is open, so are events
+      if (_pollTimer?.isActive == true) {
+        _refreshGameState();
+      }
+    }, onError: (_) => _roomEventsClosed(), onDone: _roomEventsClosed, cancelOnError: true);
+  }
+
+  void _roomEventsClosed() {
+    _eventSub = null;
+    if (!mounted) return;
+    if (_pollTimer?.isActive == true) {
+      _startPolling();
+    }
+    Timer(const Duration(seconds: 5), () {
+      if (mounted) _listenRoomEvents();
+    });
+  }
+
   Future<void> _refreshGameState() async {
     try {
       final state = await _apiService.getState(widget.gameCode);
@@ -0,0 +1,107 @@
+#benchmarks/bench_eventbus.py
+# Cross-process check of the events table bus: several subscriber processes
+# follow one room channel while several publisher processes write to it.
+# Every subscriber must see every event exactly once and in id order.
+# Exits non-zero when a subscriber misses, repeats or reorders an event.
+#
+#   python -m sampleapi.benchmarks.bench_eventbus --subscribers 4 --publishers 3 --events 200
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import multiprocessing
+from .benchutil import percentile, writejson
+
+def subscriber(path, name, expected, ready, results):
+    from ..utils import event_helper
+    event_helper.af_eventsinit(path)
+    event_helper.af_channel(name)
+    ready.wait()  # parent releases publishers once every subscriber is listening
+    ids = []
+    latencies = []
+    cursor = 0
+    deadline = time.time() + 60
+    while len(ids) < expected and time.time() < deadline:
+        events, complete = event_helper.af_waitevents(name, cursor, timeout=1)
+        now = time.time()
+        for event in events:
+            ids.append(event["id"])
+            latencies.append(now - event["time"])
+            cursor = event["id"]
+    results.put({"pid": os.getpid(), "ids": ids, "latencies": latencies})
+
+def publisher(path, name, count, interval, start):
+    from ..utils import event_helper
+    event_helper.af_eventsinit(path)
+    start.wait()
+    for i in range(count):
+        event_helper.af_publish(name, "roll", {"pid": os.getpid(), "n": i})
+        if interval:
+            time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-process events bus check")
+    parser.add_argument("--subscribers", type=int, default=4)
+    parser.add_argument("--publishers", type=int, default=3)
+    parser.add_argument("--events", type=int, default=200, help="events per publisher")
+    parser.add_argument("--interval", type=float, default=0.002, help="seconds between publishes")
+    parser.add_argument("--json", dest="jsonpath", default=None)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="ularbus"), "events.db")
+    sqlite3.connect(path).close()
+    from ..utils import event_helper
+    event_helper.af_eventsinit(path)
+
+    name = "room:BUS"
+    expected = args.publishers * args.events
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(args.subscribers + 1)
+    start = ctx.Event()
+    results = ctx.Queue()
+
+    subs = [ctx.Process(target=subscriber, args=(path, name, expected, ready, results)) for _ in range(args.subscribers)]
+    for p in subs:
+        p.start()
+    ready.wait()
+    pubs = [ctx.Process(target=publisher, args=(path, name, args.events, args.interval, start)) for _ in range(args.publishers)]
+    for p in pubs:
+        p.start()
+    began = time.time()
+    start.set()
+    for p in pubs:
+        p.join()
+    published = time.time() - began
+
+    received = [results.get(timeout=90) for _ in subs]
+    for p in subs:
+        p.join()
+
+    ok = True
+    latencies = []
+    for r in received:
+        if len(r["ids"]) != expected or len(set(r["ids"])) != expected or r["ids"] != sorted(r["ids"]):
+            ok = False
+            print(f"subscriber {r['pid']}: got {len(r['ids'])} of {expected} events (unique {len(set(r['ids']))}, ordered {r['ids'] == sorted(r['ids'])})")
+        latencies += r["latencies"]
+
+    summary = {
+        "ok": ok,
+        "subscribers": args.subscribers,
+        "publishers": args.publishers,
+        "events": expected,
+        "publish_seconds": round(published, 3),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2) if latencies else 0.0
+        }
+    }
+    writejson(summary, args.jsonpath)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#benchmarks/bench_load.py
+# End-to-end load: N rooms play whole games through the HTTP API at once.
+# Each room is one client thread that creates the room, lets the other
+# players join, starts the game, then plays it the way the web client does:
+# every player polls /state, the turn player rolls, and when a question is up
+# selects and submits an answer (right with --accuracy chance).
+#
+# In-process (default) it drives a fresh Flask app through test_client on a
+# temp database; with --url it talks to a running server over HTTP instead
+# (DB counters then come from /api/admin/dbstats on that server).
+#
+# Reports per endpoint latency (p50/p95/p99) and requests/s, DB queries and
+# commits per request, and game errors: lost turns (the turn player's move
+# was turned away) and stuck rooms (no end after --maxsteps moves).
+#
+#   python -m sampleapi.benchmarks.bench_load --rooms 16 --players 3
+#   python -m sampleapi.benchmarks.bench_load --url http://127.0.0.1:5000 --rooms 32 --json load.json
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+import urllib.parse
+# read by the utils at import: no reaper thread and no metrics files in the
+# cwd for the in-process app (a --url server keeps its own settings)
+os.environ.setdefault("AF_REAPER_INTERVAL", "0")
+os.environ.setdefault("AF_METRICS_DIR", "")
+from .benchutil import percentile, writejson
+
+def makeapp(shards=1):
+    """Flask app with the ular blueprints on a fresh temp database"""
+    from flask import Flask
+    from ..controllers.ular import ular_blueprint
+    from ..controllers.ularquestions import ularq_blueprint
+    from .benchutil import makeulardb
+    makeulardb(shards=shards)
+    app = Flask(__name__)
+    app.register_blueprint(ular_blueprint)
+    app.register_blueprint(ularq_blueprint)
+    return app
+
+class LocalClient:
+    """One test_client per thread against the in-process app"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path, params):
+        response = self.client.get(path, query_string=params)
+        return response.status_code, response.get_json(silent=True)
+
+class HttpClient:
+    """One keep-alive connection per thread against a running server"""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.conn = None
+
+    def get(self, path, params):
+        target = f"{self.prefix}{path}?{urllib.parse.urlencode(params)}"
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, timeout=30)
+                self.conn.request("GET", target)
+                response = self.conn.getresponse()
+                body = response.read()
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    data = None
+                return response.status, data
+            except (OSError, http.client.HTTPException):
+                # server closed the keep-alive connection, reconnect once
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+class LoadStats:
+    """Latencies and errors shared by every room thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.samples = []
+        self.lostturns = 0
+        self.stuck = 0
+        self.games = 0
+
+    def call(self, client, path, params):
+        start = time.perf_counter()
+        try:
+            status, data = client.get(path, params)
+        except Exception as e:
+            status, data = 0, {"status": "error", "message": str(e)}
+        elapsed = (time.perf_counter() - start) * 1000
+        endpoint = path.rsplit("/", 1)[-1]
+        failed = status != 200 or not isinstance(data, dict) or data.get("status") != "ok"
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if failed:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+                if len(self.samples) < 20:
+                    self.samples.append({"endpoint": endpoint, "http": status, "response": data})
+        return data if isinstance(data, dict) else {}
+
+    def add(self, key, n=1):
+        with self.lock:
+            setattr(self, key, getattr(self, key) + n)
+
+def playroom(index, newclient, stats, args, rng):
+    """Create, fill, start and play one room to the end"""
+    client = newclient()
+    players = [f"r{index}p{j}" for j in range(args.players)]
+    data = stats.call(client, "/api/ular/createroom", {"player": players[0], "color": "red", "topic": args.topic})
+    code = data.get("code")
+    if not code:
+        return
+    for player in players[1:]:
+        stats.call(client, "/api/ular/joinroom", {"code": code, "player": player, "color": "blue"})
+    stats.call(client, "/api/ular/startgame", {"code": code})
+
+    for step in range(args.maxsteps):
+        state = {}
+        for player in players:
+            state = stats.call(client, "/api/ular/state", {"code": code, "player": player})
+        if state.get("state") == "ended":
+            stats.add("games")
+            return
+        turn = state.get("turn")
+        if state.get("questionid"):
+            question = state.get("question") or [{}]
+            right = question[0].get("answer", "a1")
+            wrong = [a for a in ("a1", "a2", "a3", "a4") if a != right]
+            answer = right if rng.random() < args.accuracy else rng.choice(wrong)
+            stats.call(client, "/api/ular/selectanswer", {"code": code, "player": turn, "answer": answer})
+            result = stats.call(client, "/api/ular/submitanswer", {"code": code, "player": turn, "answer": answer})
+        else:
+            result = stats.call(client, "/api/ular/rolldice", {"code": code, "player": turn})
+        if result.get("status") != "ok":
+            stats.add("lostturns")
+        if args.think:
+            time.sleep(args.think)
+    stats.add("stuck")
+
+def dbcounters(newclient, local):
+    """Queries/commits/checkouts so far, from this process or the server"""
+    if local:
+        from ..utils.db_helper import af_txstats, af_poolstats
+        tx, pools = af_txstats(), af_poolstats()
+    else:
+        status, data = newclient().get("/api/admin/dbstats", {})
+        if status != 200 or not isinstance(data, dict):
+            return {}
+        tx, pools = data.get("tx", {}), data.get("pools", {})
+    counters = {key: tx.get(key, 0) for key in ("queries", "transactions", "commits", "rollbacks", "busyretries")}
+    counters["checkouts"] = sum(p.get("checkouts", 0) for p in pools.values() if isinstance(p, dict))
+    return counters
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end load on the ular API")
+    parser.add_argument("--rooms", type=int, default=16, help="rooms played at once, one thread each")
+    parser.add_argument("--players", type=int, default=3)
+    parser.add_argument("--accuracy", type=float, default=0.5, help="chance a question is answered right")
+    parser.add_argument("--topic", default="fizik")
+    parser.add_argument("--think", type=float, default=0, help="seconds between moves")
+    parser.add_argument("--maxsteps", type=int, default=2000, help="moves before a room counts as stuck")
+    parser.add_argument("--shards", type=int, default=1, help="ULAR_SHARDS for the in-process app")
+    parser.add_argument("--url", default=None, help="drive a running server instead of an in-process app")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="jsonpath", default=None)
+    args = parser.parse_args()
+
+    local = args.url is None
+    if local:
+        app = makeapp(args.shards)
+        newclient = lambda: LocalClient(app)
+    else:
+        newclient = lambda: HttpClient(args.url)
+
+    stats = LoadStats()
+    seeds = random.Random(args.seed)
+    threads = [threading.Thread(target=playroom, args=(i, newclient, stats, args, random.Random(seeds.random())))
+               for i in range(args.rooms)]
+    before = dbcounters(newclient, local)
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    after = dbcounters(newclient, local)
+
+    endpoints = {}
+    for endpoint, samples in sorted(stats.latencies.items()):
+        endpoints[endpoint] = {
+            "count": len(samples),
+            "errors": stats.errors.get(endpoint, 0),
+            "rps": round(len(samples) / wall, 1),
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3)
+        }
+    requests = sum(e["count"] for e in endpoints.values())
+    db = {key: after[key] - before.get(key, 0) for key in after}
+    # the dbstats call itself sits between the two snapshots when remote
+    db["per_request"] = {key: round(n / max(requests, 1), 2) for key, n in db.items()}
+
+    results = {
+        "config": {"rooms": args.rooms, "players": args.players, "accuracy": args.accuracy, "think": args.think,
+                   "target": args.url or "in-process", "shards": args.shards if local else None},
+        "wall_s": round(wall, 3),
+        "requests": requests,
+        "rps": round(requests / wall, 1),
+        "games": stats.games,
+        "lostturns": stats.lostturns,
+        "stuck": stats.stuck,
+        "errors": sum(stats.errors.values()),
+        "endpoints": endpoints,
+        "db": db,
+        "errorsamples": stats.samples
+    }
+    writejson(results, args.jsonpath)
+    sys.exit(1 if stats.lostturns or stats.stuck or stats.games < args.rooms else 0)
+
+if __name__ == "__main__":
+    main()
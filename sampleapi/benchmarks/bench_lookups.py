@@ -0,0 +1,44 @@
+#benchmarks/bench_lookups.py
+# Per-request latency of the keyed lookups in models/ular.py as historical
+# (ended) rooms pile up. With the indexes from ular_migration_1 the numbers
+# should stay flat from 100 to 1M rooms.
+#
+#   python -m sampleapi.benchmarks.bench_lookups --sizes 100,10000,100000,1000000
+import argparse
+from ..models import ular
+from .benchutil import makeulardb, addliveroom, timecalls, writejson
+
+def benchsize(rooms, repeat):
+    makeulardb(rooms=rooms, playersperroom=3)
+    code = addliveroom("LIVE", players=4)
+    qid = ular.getquestionstopic("fizik")[0]["id"]
+    calls = {
+        "roomdata": lambda: ular.roomdata(code),
+        "roomstatus": lambda: ular.roomstatus(code),
+        "roomavailable": lambda: ular.roomavailable(code),
+        "modelgetcsvplayers": lambda: ular.modelgetcsvplayers(code),
+        "playerdata": lambda: ular.playerdata(code, "p2"),
+        "getquestion": lambda: ular.getquestion(qid),
+        "submitanswer": lambda: ular.submitanswer(qid, "a1"),
+        "getendbystartladdersnake": lambda: ular.getendbystartladdersnake(12),
+        "getladdersnakeinfo": lambda: ular.getladdersnakeinfo(18),
+    }
+    return {name: timecalls(fn, repeat) for name, fn in calls.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="keyed lookup latency vs historical rooms")
+    parser.add_argument("--sizes", default="100,10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--json", dest="jsonpath", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for rooms in [int(x) for x in args.sizes.split(",")]:
+        results[rooms] = benchsize(rooms, args.repeat)
+        print(f"{rooms:>9} rooms  " + "  ".join(f"{k}={v['median_us']}us" for k, v in results[rooms].items()))
+
+    if args.jsonpath:
+        writejson(results, args.jsonpath)
+
+if __name__ == "__main__":
+    main()
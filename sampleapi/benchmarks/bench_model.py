@@ -0,0 +1,125 @@
+#benchmarks/bench_model.py
+# Micro-benchmarks for the per-turn model functions at several data sizes.
+# A size is rooms x players-per-room x questions-per-topic; every size gets a
+# fresh database with that many historical rooms and questions, plus one live
+# room with that many players, and each function is timed against it.
+#
+# Results can be saved as a baseline and later runs compared to it: a
+# function whose median got slower than the baseline by more than
+# --threshold (and by more than --slackus, to ride out timer noise on the
+# very fast ones) fails the run. --maxgrowth also fails a run on its own when
+# a function at the largest size is that many times slower than at the
+# smallest, which is what an O(n) scan in the hot path looks like.
+#
+#   python -m sampleapi.benchmarks.bench_model --save-baseline
+#   python -m sampleapi.benchmarks.bench_model --threshold 0.25
+#   python -m sampleapi.benchmarks.bench_model --sizes 100x3x10,100000x8x5000 --baseline /tmp/base.json
+import os
+import sys
+import json
+import argparse
+# read by the utils at import: no reaper thread and no metrics files in the
+# cwd for an in-process run
+os.environ.setdefault("AF_REAPER_INTERVAL", "0")
+os.environ.setdefault("AF_METRICS_DIR", "")
+from ..models import ular
+from ..controllers import ularular
+from .benchutil import makeulardb, addliveroom, timecalls, writejson
+
+defaultbaseline = os.path.join(os.path.dirname(__file__), "baselines", "bench_model.json")
+
+def parsesize(text=""):
+    rooms, players, questions = (int(n) for n in text.split("x"))
+    return {"rooms": rooms, "players": players, "questions": questions}
+
+def benchsize(size, repeat, rounds):
+    makeulardb(rooms=size["rooms"], playersperroom=3, questionspertopic=size["questions"])
+    code = addliveroom("LIVE", players=size["players"])
+    players = [f"p{j}" for j in range(size["players"])]
+    qid = ular.getquestionstopic("fizik")[0]["id"]
+    ular.getrandomquestiontopic("fizik")  # load the question bank before timing
+    turn = {"i": 0}
+
+    def nextturn():
+        ular.modelnextturn(code, players[turn["i"] % len(players)])
+        turn["i"] += 1
+
+    calls = {
+        "getstepsdice": lambda: ular.getstepsdice(25, 6, ular.maxbox),
+        "getendbystartladdersnake": lambda: ular.getendbystartladdersnake(12),
+        "getrandomquestiontopic": lambda: ular.getrandomquestiontopic("fizik"),
+        "modelnextturn": nextturn,
+        "roomdata": lambda: ular.roomdata(code),
+        "submitanswer": lambda: ular.submitanswer(qid, "a1"),
+        "ularular.apply_dice": lambda: ularular.apply_dice(45, 4)
+    }
+    results = {}
+    for name, fn in calls.items():
+        # best of a few rounds, a single round picks up whatever else the box was doing
+        runs = [timecalls(fn, repeat) for _ in range(rounds)]
+        results[name] = min(runs, key=lambda r: r["median_us"])
+    return results
+
+def compare(results, baseline, threshold, slackus):
+    """Medians that got slower than the baseline, per size and function"""
+    regressions = []
+    for size, calls in results.items():
+        for name, r in calls.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            now, before = r["median_us"], base["median_us"]
+            if now > before * (1 + threshold) and now - before > slackus:
+                regressions.append({"size": size, "function": name, "baseline_us": before,
+                                    "median_us": now, "ratio": round(now / max(before, 1e-9), 2)})
+    return regressions
+
+def growth(results):
+    """Median at the largest size over the median at the smallest, per function"""
+    sizes = list(results)
+    if len(sizes) < 2:
+        return {}
+    first, last = results[sizes[0]], results[sizes[-1]]
+    return {name: round(last[name]["median_us"] / max(first[name]["median_us"], 1e-9), 2)
+            for name in first if name in last}
+
+def main():
+    parser = argparse.ArgumentParser(description="per-turn model function latency vs data size")
+    parser.add_argument("--sizes", default="100x2x10,10000x4x1000,100000x8x10000",
+                        help="rooms x players per room x questions per topic, comma separated")
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--baseline", default=defaultbaseline)
+    parser.add_argument("--save-baseline", dest="savebaseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown vs baseline, 0.25 = 25%%")
+    parser.add_argument("--slackus", type=float, default=5.0, help="slowdowns under this many us never count")
+    parser.add_argument("--maxgrowth", type=float, default=0, help="fail when largest/smallest size exceeds this, 0 = off")
+    parser.add_argument("--json", dest="jsonpath", default=None)
+    args = parser.parse_args()
+
+    results = {}
+    for text in args.sizes.split(","):
+        results[text] = benchsize(parsesize(text), args.repeat, args.rounds)
+        print(f"{text:>18}  " + "  ".join(f"{k}={v['median_us']}us" for k, v in results[text].items()), file=sys.stderr)
+
+    report = {"sizes": results, "growth": growth(results)}
+    failures = []
+    if args.savebaseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        writejson(results, args.baseline)
+        report["baseline"] = f"saved to {args.baseline}"
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(results, baseline, args.threshold, args.slackus)
+        failures += [f"{r['function']} at {r['size']}: {r['baseline_us']}us -> {r['median_us']}us" for r in report["regressions"]]
+    else:
+        report["baseline"] = f"none at {args.baseline}, run with --save-baseline first"
+    if args.maxgrowth:
+        failures += [f"{name} is {g}x slower at {list(results)[-1]}" for name, g in report["growth"].items() if g > args.maxgrowth]
+    report["failures"] = failures
+    writejson(report, args.jsonpath)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
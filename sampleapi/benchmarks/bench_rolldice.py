@@ -0,0 +1,115 @@
+#benchmarks/bench_rolldice.py
+# Throughput and race check for rollturn. Every player of one room gets a few
+# client threads that keep tapping "roll" (a double tap is two of them at
+# once); only the player whose turn it is may move, once per turn.
+# Board is huge and has no snakes/ladders, so no question ever stops a turn.
+# Exits non-zero when a turn was rolled twice, skipped, or a position drifted.
+#
+#   python -m sampleapi.benchmarks.bench_rolldice --players 4 --taps 2 --rolls 2000
+import sys
+import json
+import time
+import argparse
+import threading
+from ..models import ular
+from ..utils.db_helper import af_getdb, af_txstats
+from .benchutil import makeulardb, addliveroom, timecalls, writejson
+
+def legacyroll(code="", player=""):
+    """The old request path: several reads, then clear/roll/end-check in one tx"""
+    rdata = ular.roomdata(code)
+    pdata = ular.playerdata(code, player)
+    with ular.af_transaction(ular.dbloc):
+        ular.roomclearanswer(code)
+        rdice = ular.rolldice(code, player, int(pdata[0]["pos"]), int(rdata["maxbox"]))
+        ular.checkgameended(rdice["pos"], code, int(rdata["maxbox"]))
+    return rdice
+
+def main():
+    parser = argparse.ArgumentParser(description="rollturn throughput and race check")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--taps", type=int, default=2, help="client threads per player")
+    parser.add_argument("--rolls", type=int, default=2000, help="successful rolls to reach")
+    parser.add_argument("--pause", type=float, default=0.0005, help="seconds a client waits after being turned away")
+    parser.add_argument("--json", dest="jsonpath", default=None)
+    args = parser.parse_args()
+
+    makeulardb()
+    af_getdb(ular.dbloc, "DELETE FROM conf;", ())
+    boardsize = 10 ** 9
+    code = addliveroom("RACE", players=args.players)
+    af_getdb(ular.dbloc, "UPDATE room SET maxbox = ? WHERE code = ?;", (boardsize, code))
+    players = [f"p{j}" for j in range(args.players)]
+
+    # single client, old path vs new one
+    addliveroom("SOLO", players=1)
+    af_getdb(ular.dbloc, "UPDATE room SET maxbox = ?, turn = 'p0' WHERE code = 'SOLO';", (boardsize,))
+    results = {
+        "legacy": timecalls(lambda: legacyroll("SOLO", "p0"), 300),
+        "rollturn": timecalls(lambda: ular.rollturn("SOLO", "p0"), 300)
+    }
+
+    lock = threading.Lock()
+    counts = {"ok": 0, "rejected": 0, "errors": 0}
+    dice = {p: 0 for p in players}
+    stop = threading.Event()
+
+    def tapper(player):
+        while not stop.is_set():
+            rejected = False
+            result = ular.rollturn(code, player)
+            with lock:
+                if result["status"] == "ok":
+                    counts["ok"] += 1
+                    dice[player] += result["dice"]
+                    if counts["ok"] >= args.rolls:
+                        stop.set()
+                elif result["message"] == "It is not your turn!":
+                    counts["rejected"] += 1
+                    rejected = True
+                else:
+                    counts["errors"] += 1
+                    print(f"Unexpected: {result}")
+            if rejected and args.pause:
+                time.sleep(args.pause)
+
+    before = af_txstats()
+    threads = [threading.Thread(target=tapper, args=(p,)) for p in players for _ in range(args.taps)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    after = af_txstats()
+
+    # roll events must follow the turn order exactly, and positions the dice
+    events = af_getdb(ular.dbloc, "SELECT data FROM events WHERE channel = ? AND type = 'roll' ORDER BY id;", (ular.roomchannel(code),))
+    order = [json.loads(e["data"])["player"] for e in events]
+    failures = []
+    for i, player in enumerate(order):
+        if player != players[i % len(players)]:
+            failures.append(f"roll {i} by {player}, expected {players[i % len(players)]}")
+            break
+    if len(order) != counts["ok"]:
+        failures.append(f"{counts['ok']} rolls accepted but {len(order)} roll events")
+    for p in ular.modelgetcsvplayers(code):
+        if int(p["pos"]) != dice[p["player"]]:
+            failures.append(f"{p['player']} at {p['pos']}, dice add up to {dice[p['player']]}")
+    if counts["errors"]:
+        failures.append(f"{counts['errors']} unexpected errors")
+
+    results["concurrent"] = {
+        "threads": len(threads),
+        "rolls": counts["ok"],
+        "rejected": counts["rejected"],
+        "rolls_per_s": round(counts["ok"] / elapsed, 1),
+        "busyretries": after["busyretries"] - before["busyretries"],
+        "rollbacks": after["rollbacks"] - before["rollbacks"],
+        "failures": failures
+    }
+    writejson(results, args.jsonpath)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
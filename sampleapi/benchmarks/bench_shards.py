@@ -0,0 +1,111 @@
+#benchmarks/bench_shards.py
+# Write throughput against ULAR_SHARDS. For each shard count, several worker
+# processes roll dice in their own rooms as fast as they can; every roll is a
+# real rollturn transaction (room + players + events) on the room's shard.
+# With one shard every commit queues on the same writer lock; with more,
+# rooms on different shards commit side by side.
+#
+# Commits only wait on the disk with synchronous=FULL, so that is the default
+# here; with NORMAL the lock is held so briefly that CPU is the limit instead.
+# On a machine with a fast disk and few cores rolls are CPU bound and shards
+# can't help; --holdms keeps each roll's write lock that much longer (as a
+# slow disk would) to see how the lock itself scales.
+#
+#   python -m sampleapi.benchmarks.bench_shards --shards 1,2,4,8 --workers 8 --seconds 5
+#   python -m sampleapi.benchmarks.bench_shards --holdms 2
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+# read by the utils at import, here and in the workers
+os.environ.setdefault("AF_REAPER_INTERVAL", "0")
+os.environ.setdefault("AF_METRICS_DIR", "")
+from .benchutil import writejson
+
+def worker(path, shards, codes, seconds, hold, start, results):
+    from ..models import ular
+    from ..utils.db_helper import af_txstats, af_transaction
+    from .benchutil import useulardb
+    useulardb(path, shards)
+    turns = {code: "p0" for code in codes}
+    rolls = 0
+    errors = 0
+    start.wait()
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for code in codes:
+            if hold:
+                # rollturn joins this transaction, so the lock is held through the sleep
+                with af_transaction(ular.roomdb(code)):
+                    result = ular.rollturn(code, turns[code])
+                    time.sleep(hold)
+            else:
+                result = ular.rollturn(code, turns[code])
+            if result["status"] == "ok":
+                turns[code] = result["turn"]
+                rolls += 1
+            else:
+                errors += 1
+    stats = af_txstats()
+    results.put({"rolls": rolls, "errors": errors, "busyretries": stats["busyretries"], "busyfailures": stats["busyfailures"]})
+
+def run(shards, args):
+    from ..models import ular
+    from ..utils.db_helper import af_getdb, af_closepools
+    from .benchutil import makeulardb, addliveroom
+    path = makeulardb(shards=shards)
+    # no snakes/ladders so no questions: one conf cell on square 0, which no
+    # roll lands on (an empty conf would be re-seeded by init_ular_db in workers)
+    af_getdb(ular.dbloc, "DELETE FROM conf;", ())
+    af_getdb(ular.dbloc, "INSERT INTO conf (start, end, type) VALUES ('0', '0', 'ladder');", ())
+    codes = []
+    for i in range(args.rooms):
+        code = addliveroom(f"B{i:04d}", players=2)
+        af_getdb(ular.roomdb(code), "UPDATE room SET maxbox = ? WHERE code = ?;", (10 ** 9, code))
+        codes.append(code)
+    af_closepools()
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(path, shards, codes[i::args.workers], args.seconds, args.holdms / 1000, start, results))
+             for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    time.sleep(args.warmup)  # let every worker finish importing
+    start.set()
+    totals = {"rolls": 0, "errors": 0, "busyretries": 0, "busyfailures": 0}
+    for _ in procs:
+        for key, n in results.get(timeout=args.seconds + 120).items():
+            totals[key] += n
+    for p in procs:
+        p.join()
+    totals["shards"] = shards
+    totals["rolls_per_s"] = round(totals["rolls"] / args.seconds, 1)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="rolldice write throughput by shard count")
+    parser.add_argument("--shards", default="1,2,4,8")
+    parser.add_argument("--workers", type=int, default=8, help="writer processes")
+    parser.add_argument("--rooms", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--synchronous", default="FULL")
+    parser.add_argument("--holdms", type=float, default=0, help="extra ms each roll holds its write lock")
+    parser.add_argument("--json", dest="jsonpath", default=None)
+    args = parser.parse_args()
+
+    # read by db_helper at import, in this process and the spawned workers
+    os.environ["AF_DB_SYNCHRONOUS"] = args.synchronous
+
+    results = [run(int(n), args) for n in args.shards.split(",")]
+    base = results[0]["rolls_per_s"] or 1
+    for r in results:
+        r["speedup"] = round(r["rolls_per_s"] / base, 2)
+    writejson({"workers": args.workers, "synchronous": args.synchronous, "holdms": args.holdms,
+               "cpus": os.cpu_count(), "runs": results}, args.jsonpath)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#benchmarks/benchutil.py
+# Shared helpers for the benchmark scripts. Run benchmarks from the app root
+# (the directory that holds sampleapi/ and static/), e.g.
+#   python -m sampleapi.benchmarks.bench_lookups
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import statistics
+from ..models import ular
+from ..utils.db_helper import af_closepools
+
+def useulardb(path="", shards=1):
+    """Point models/ular.py at an existing bench database (e.g. in a worker process)"""
+    af_closepools()
+    ular.dbloc = path
+    ular.ularshards = shards
+    ular.init_ular_db()
+
+def makeulardb(rooms=0, playersperroom=3, questionspertopic=0, topics=("fizik", "biologi"), folder=None, shards=1):
+    """Create a fresh ular database in a temp folder and point models/ular.py at it.
+
+    rooms - number of historical (ended) rooms to pre-load
+    playersperroom - players per historical room
+    questionspertopic - extra questions per topic on top of the sample ones
+    shards - ULAR_SHARDS to use, historical rooms go to their own shard
+    """
+    folder = folder or tempfile.mkdtemp(prefix="ularbench")
+    path = os.path.join(folder, "ular.db")
+    sqlite3.connect(path).close()
+    useulardb(path, shards)
+
+    conns = {loc: sqlite3.connect(loc) for loc in ular.ulardbs()}
+    batch = 50000
+    for start in range(0, rooms, batch):
+        end = min(rooms, start + batch)
+        for loc, conn in conns.items():
+            codes = [f"H{i:07d}" for i in range(start, end) if ular.roomdb(f"H{i:07d}") == loc]
+            conn.executemany(
+                "INSERT INTO room (code,turn,state,questionid,maxbox,topic,dice) VALUES (?,?,?,?,?,?,?);",
+                ((code, "p0", "ended", "", ular.maxbox, topics[int(code[1:]) % len(topics)], 0) for code in codes))
+            conn.executemany(
+                "INSERT INTO players (code,player,pos,color,questionright,questionget) VALUES (?,?,?,?,?,?);",
+                ((code, f"p{j}", ular.maxbox if j == 0 else j, "red", "", "")
+                 for code in codes for j in range(playersperroom)))
+            conn.commit()
+    for conn in conns.values():
+        conn.close()
+    conn = sqlite3.connect(path)
+    for topic in topics:
+        conn.executemany(
+            "INSERT INTO questions (id, question, a1, a2, a3, a4, answer, topic) VALUES (?,?,?,?,?,?,?,?);",
+            ((f"{topic}-{i}", f"Question {i} about {topic}?", "one", "two", "three", "four", "a1", topic)
+             for i in range(questionspertopic)))
+    conn.commit()
+    conn.close()
+    return path
+
+def addliveroom(code="LIVE", players=4, topic="fizik", state="playing"):
+    ular.adddataroom(code, "p0", state, ular.maxbox, topic)
+    for j in range(players):
+        ular.adddataplayer(code, f"p{j}", 0, "red")
+    return code
+
+def timecalls(fn, repeat=1000):
+    """Call fn repeat times, return latency figures in microseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "calls": repeat,
+        "median_us": round(statistics.median(samples), 2),
+        "p95_us": round(samples[int(len(samples) * 0.95) - 1], 2),
+        "mean_us": round(statistics.fmean(samples), 2)
+    }
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[k]
+
+def writejson(results, path=None):
+    text = json.dumps(results, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -1,11 +1,39 @@
 #controllers/ular.py
-from flask import jsonify, request, Blueprint, render_template, render_template_string
+import sqlite3
+from flask import jsonify, request, Blueprint, render_template, render_template_string, Response
 from ..utils.html_helper import *
 # from ..utils.csv_helper import *
 from ..models.ular import *
+from ..utils.profile_helper import *
 
 ular_blueprint = Blueprint('ular', __name__)
 
+# commits and queries per request show up in af_txstats() and af_routestats()
+ular_blueprint.after_app_request(af_dbrequestend)
+
+# request latency per route for /metrics
+ular_blueprint.before_app_request(af_metricsrequeststart)
+ular_blueprint.after_app_request(af_metricsrequestend)
+
+# sampling profiler, see utils/profile_helper.py for AF_PROFILE_*
+ular_blueprint.before_app_request(af_profilerequeststart)
+ular_blueprint.teardown_app_request(af_profilerequestend)
+
+# a write that failed inside a transaction raises (and rolled back), answer
+# with the usual JSON error instead of a bare 500 page
+@ular_blueprint.errorhandler(sqlite3.Error)
+def ular_dberror(e):
+    print(f"❌ Database error on {request.path}: {e}")
+    return jsonify({
+        "status": "error",
+        "message": "Database error, nothing was saved"
+    }), 500
+
+# room reaper thread, (re)started lazily so forked workers get their own
+@ular_blueprint.before_app_request
+def ular_startreaper():
+    af_reaperstart()
+
 @ular_blueprint.route("/ular")
 def ular():
     html = "afwan"
@@ -166,7 +194,6 @@ def apiular_getconfig():
 
 @ular_blueprint.route("/api/ular/createroom")
 def apiular_createroom():
-    code = modelgenerateroomcode(4)
     player = af_requestget("player")
     color = af_requestget("color", "black")
     maxbox = af_requestget("maxbox", 28)
@@ -180,8 +207,11 @@ def apiular_createroom():
     state = "waiting"
     pos = 0
 
-    adddataroom(code, player, state, int(maxbox), topic)
-    adddataplayer(code, player, pos, color)
+    # the code comes from the shared allocator, the room goes to its shard
+    code = modelgenerateroomcode(4)
+    with af_transaction(roomdb(code)):
+        adddataroom(code, player, state, int(maxbox), topic)
+        adddataplayer(code, player, pos, color)
 
     return jsonify({
         "status": "ok",
@@ -276,21 +306,41 @@ def apiular_startgame():
     questions_per_game = af_requestget("questions_per_game")
     difficulty = af_requestget("difficulty")
     
+    fallback = af_requestget("fallback", ulardifficultyfallback)
+    
     if inputnotvalidated(code):
         return jsonifynotvalid("code")
+    # optional: how many questions the game deals, at which level, and what fills a short level
+    if inputnotvalidated(questions_per_game):
+        questions_per_game = None
+    elif not str(questions_per_game).isdigit() or not 1 <= int(questions_per_game) <= ulardeckmax:
+        return jsonifynotvalid("questions_per_game")
+    else:
+        questions_per_game = int(questions_per_game)
+    if inputnotvalidated(difficulty):
+        difficulty = None
+    elif difficultylevel(difficulty) is False:
+        return jsonifynotvalid("difficulty")
+    else:
+        difficulty = difficultylevel(difficulty)
+    if fallback not in ulardifficultyfallbacks:
+        return jsonifynotvalid("fallback")
     
     rstatus = roomstatus(code)
 
     if rstatus == "waiting":
 
-        startroom(code)
+        picked = startroom(code, questions_per_game, difficulty, fallback)
+        if picked["status"] != "ok":
+            return jsonify(picked)
         
         return jsonify({
             "status": "ok",
             "code": code,
             "players": modelgetcsvplayers(code),
             "message": f"Room {code} started!",
-            "state": "playing"
+            "state": "playing",
+            "questions": picked
         })
     elif rstatus == "playing" or rstatus == "ended":
         return jsonify({
@@ -336,16 +386,40 @@ def apiular_state():
     if inputnotvalidated(code):
         return jsonifynotvalid("code")
     
+    since = af_requestget("since", "")
+    delta = af_requestget("delta", "") in ("1", "true")
+
+    # cheap version check first: unchanged rooms never touch players/questions
+    rversion = getroomversion(code)
+    if rversion is not None:
+        etag = f"{code}-{rversion}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        if since.isdigit() and int(since) >= rversion:
+            return jsonify({
+                "status": "ok",
+                "code": code,
+                "version": rversion,
+                "notmodified": True
+            })
+
     rdata = roomdata(code)
     rstate = rdata["state"]
     rturn = rdata["turn"]
     rquestionid = rdata["questionid"]
     rmaxbox = int(rdata["maxbox"])
+    rversion = rdata.get("version") or 0
     rdice = int(rdata.get("dice", 0))  # Get last dice rolled
     rselectedanswer = rdata.get("selectedanswer", "")
     ranswercorrect = rdata.get("answercorrect", "")
+    # delta mode: only players/question changed after `since`
+    rsince = deltasince(since, rversion) if delta else None
+    sendquestion = rsince is None or (rdata.get("qversion") or 0) > rsince
     question = []
-    if rquestionid != "":
+    if rquestionid != "" and sendquestion:
         question = getquestion(rquestionid)
     
 
@@ -356,15 +430,15 @@ def apiular_state():
         elif rstate == "ended":
             message = f"The game already ended"
         else:
-            if question == []:
+            if rquestionid == "":
                 message = f"{rturn}'s turn"
             else:
                 message = f"{rturn}'s turn, Please answer question"
 
-        return jsonify({
+        payload = {
             "status": "ok",
             "code": code,
-            "players": modelgetcsvplayers(code),
+            "players": modelgetcsvplayers(code) if rsince is None else modelgetcsvplayerssince(code, rsince),
             "message": message,
             "turn": rturn,
             "question": question,
@@ -372,109 +446,216 @@ def apiular_state():
             "state": rstate,
             "dice": rdice,
             "selectedanswer": rselectedanswer,
-            "answercorrect": ranswercorrect
-        })
+            "answercorrect": ranswercorrect,
+            "version": rversion
+        }
+        if delta:
+            payload["delta"] = rsince is not None
+            if rsince is not None:
+                payload["since"] = rsince
+                if not sendquestion:
+                    del payload["question"]
+        response = jsonify(payload)
+        response.set_etag(f"{code}-{rversion}")
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     else:
         return jsonify({
             "status": "error",
             "message": "room is not available!"
         })
     
-@ular_blueprint.route("/api/ular/rolldice")
-def apiular_rolldice():
+@ular_blueprint.route("/api/ular/events")
+def apiular_events():
+    """Server-Sent Events stream of room events (see publishroomevent)"""
     code = af_requestget("code")
-    player = af_requestget("player")
     
     if inputnotvalidated(code):
         return jsonifynotvalid("code")
-    if inputnotvalidated(player):
-        return jsonifynotvalid("player")
-    
-    rdata = roomdata(code)
-    rstate = rdata["state"]
-    rturn = rdata["turn"]
-    rquestionid = rdata["questionid"]
-    rmaxbox = int(rdata["maxbox"])
-
-    pdata = playerdata(code, player)
-    if pdata == []:
+    if not roomavailable(code):
         return jsonify({
             "status": "error",
-            "message": f"Please insert correct player"
+            "message": "room is not available!"
         })
-    ppos = pdata[0]["pos"]
-    ppos = int(ppos)
 
-    if rquestionid != "":
-        #tengah menjawab soalan
+    lastid = request.headers.get("Last-Event-ID") or af_requestget("lastid", "")
+
+    return Response(roomeventstream(code, str(lastid)), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def roomeventstream(code="", lastid=""):
+    yield "retry: 3000\n\n"
+    if lastid.isdigit():
+        cursor = int(lastid)
+    else:
+        # fresh connection: client should load /api/ular/state once, then follow events
+        cursor = roomlasteventid(code)
+        yield af_ssemessage({"id": cursor, "type": "hello", "data": {"code": code}})
+
+    while True:
+        events, complete = waitroomevents(code, cursor)
+        if not complete:
+            # missed events (buffer overflow or server restart): client must resync
+            cursor = roomlasteventid(code)
+            yield af_ssemessage({"id": cursor, "type": "resync", "data": {"code": code}})
+            continue
+        if events == []:
+            yield af_ssemessage(comment="heartbeat")
+            continue
+        for event in events:
+            cursor = event["id"]
+            yield af_ssemessage(event)
+            if event["type"] == "end":
+                return
+
+@ular_blueprint.route("/api/admin/eventstats")
+def apiular_eventstats():
+    return jsonify({
+        "status": "ok",
+        "stats": af_eventstats()
+    })
+
+@ular_blueprint.route("/api/admin/dbstats")
+def apiular_dbstats():
+    return jsonify({
+        "status": "ok",
+        "tx": af_txstats(),
+        "pools": af_poolstats(),
+        "routes": af_routestats()
+    })
+
+@ular_blueprint.route("/metrics")
+def apiular_metrics():
+    # Prometheus text format, counters summed over every worker
+    return Response(af_metricstext(), mimetype="text/plain; version=0.0.4")
+
+@ular_blueprint.route("/api/admin/profile")
+def apiular_profile():
+    # format=collapsed (text), svg (flamegraph) or json; window=last, all or a window start
+    # refused outright while no AF_PROFILE_TOKEN is configured
+    if not af_profiletokenok(af_requestget("token", request.headers.get("X-Profile", ""))):
         return jsonify({
             "status": "error",
-            "message": f"Please answer question first!"
+            "message": "Invalid token"
+        }), 403
+    route = af_requestget("route") or None
+    window = af_requestget("window", "last")
+    fmt = af_requestget("format", "json")
+    try:
+        profile = af_profile(route, window)
+    except ValueError:
+        return jsonifynotvalid("window")
+
+    if fmt == "collapsed":
+        return Response(profile["collapsed"] + "\n", mimetype="text/plain")
+    if fmt == "svg":
+        return Response(af_flamegraph(profile["collapsed"], route or "all routes"), mimetype="image/svg+xml")
+    return jsonify({
+        "status": "ok",
+        "profiler": af_profilestats(),
+        "profile": profile
+    })
+
+@ular_blueprint.route("/api/admin/reaperstats")
+def apiular_reaperstats():
+    # run=1 does a pass right away instead of waiting for the thread
+    if af_requestget("run", "") in ("1", "true"):
+        af_reaperpass()
+    return jsonify({
+        "status": "ok",
+        "stats": af_reaperstats(),
+        "codes": af_codestats(dbloc, "room")
+    })
+
+@ular_blueprint.route("/api/admin/roomstats")
+def apiular_roomstats():
+    # fans out over every shard
+    return jsonify({
+        "status": "ok",
+        "shards": ularshards,
+        "rooms": modelroomcounts()
+    })
+
+@ular_blueprint.route("/api/admin/boardanalytics")
+def apiular_boardanalytics():
+    # games is capped (see modelboardanalytics), use the CLI for big runs
+    try:
+        maxbox = int(af_requestget("maxbox", 28))
+        accuracy = float(af_requestget("accuracy", 0.5))
+        games = af_requestget("games", "")
+        games = int(games) if games != "" else None
+        players = int(af_requestget("players", 1))
+    except ValueError:
+        return jsonifynotvalid("maxbox/accuracy/games/players")
+    if not 6 <= maxbox <= 1000 or not 0 <= accuracy <= 1 or (games is not None and games < 0) or not 1 <= players <= 8:
+        return jsonifynotvalid("maxbox/accuracy/games/players")
+
+    try:
+        analytics = modelboardanalytics(maxbox, accuracy, games, players)
+    except ImportError:
+        return jsonify({
+            "status": "error",
+            "message": "board analytics needs numpy installed"
         })
+    return jsonify({
+        "status": "ok",
+        "analytics": analytics
+    })
+
+@ular_blueprint.route("/api/ular/rolldice")
+def apiular_rolldice():
+    code = af_requestget("code")
+    player = af_requestget("player")
     
-    else:
+    if inputnotvalidated(code):
+        return jsonifynotvalid("code")
+    if inputnotvalidated(player):
+        return jsonifynotvalid("player")
+    
+    # read, move and write happen in one guarded transaction
+    rdice = rollturn(code, player)
+    if rdice["status"] != "ok":
+        return jsonify(rdice)
+    af_metricinc("ular_rolls_total", {"game": "ular"})
 
-        if rstate == "playing":
-
-            if rturn == player:
-                # Clear previous question state
-                query = "UPDATE room SET selectedanswer = ?, answercorrect = ? WHERE code = ?;"
-                params = ("", "", code)
-                af_getdb(dbloc, query, params)
-                
-                rdice = rolldice(code, player, ppos, rmaxbox)
-                rdata = roomdata(code)
-                rstate = rdata["state"]
-                rturn = rdata["turn"]
-                rquestionid = rdata["questionid"]
-                rmaxbox = int(rdata["maxbox"])
-
-                ended = checkgameended(rdice["pos"], code, rmaxbox)
-
-                if ended == True:
-                    message = f"The game already ended"
-
-                else:
-                    if rdice["question"] == []:
-                        message = f"Roll dice: {rdice['dice']}, Turn now: {rdice['turn']}"
-                    else:
-                        message = f"Roll dice: {rdice['dice']}, Turn now: {rdice['turn']}, Please answer question"
-
-                return jsonify({
-                    "status": "ok",
-                    "code": code,
-                    "beforepos": rdice["beforepos"],
-                    "pos": rdice["pos"],
-                    "players": modelgetcsvplayers(code),
-                    "message": message,
-                    "turn": rdice["turn"],
-                    "question": rdice["question"],
-                    "questionid": rdice["questionid"],
-                    "state": rstate,
-                    "steps": getstepsdice(int(rdice["beforepos"]), int(rdice["dice"]), rmaxbox),
-                    "dice": rdice["dice"],
-                    "ended": ended
-                })
-            else:
-                return jsonify({
-                    "status": "error",
-                    "message": f"It is not your turn!"
-                })
-        elif rstate == "waiting":
-            return jsonify({
-                "status": "error",
-                "message": "room is not started yet!"
-            })
-        elif rstate == "ended":
-            return jsonify({
-                "status": "error",
-                "message": "room is already ended!"
-            })
+    ended = rdice["ended"]
+    if ended == True:
+        message = f"The game already ended"
+
+    else:
+        if rdice["question"] == []:
+            message = f"Roll dice: {rdice['dice']}, Turn now: {rdice['turn']}"
         else:
-            return jsonify({
-                "status": "error",
-                "message": "room is not available!"
-            })
+            message = f"Roll dice: {rdice['dice']}, Turn now: {rdice['turn']}, Please answer question"
+
+    # delta mode: only players changed after the client's `since`
+    rversion = rdice["version"]
+    rsince = None
+    if af_requestget("delta", "") in ("1", "true"):
+        rsince = deltasince(af_requestget("since", ""), rversion)
+    players = rdice["players"]
+    if rsince is not None:
+        players = [p for p in players if (p.get("version") or 0) > rsince]
+
+    return jsonify({
+        "status": "ok",
+        "code": code,
+        "beforepos": rdice["beforepos"],
+        "pos": rdice["pos"],
+        "players": players,
+        "version": rversion,
+        "delta": rsince is not None,
+        "message": message,
+        "turn": rdice["turn"],
+        "question": rdice["question"],
+        "questionid": rdice["questionid"],
+        "state": rdice["state"],
+        "steps": rdice["steps"],
+        "dice": rdice["dice"],
+        "ended": ended
+    })
 
     
 @ular_blueprint.route("/api/ular/steps")
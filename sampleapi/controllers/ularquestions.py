@@ -1,11 +1,21 @@
 #controllers/ularquestions.py
-from flask import jsonify, request, Blueprint, render_template, render_template_string
+import sqlite3
+from flask import jsonify, request, Blueprint, render_template, render_template_string, Response, stream_with_context
 from ..utils.html_helper import *
 # from ..utils.csv_helper import *
 from ..models.ular import *
 
 ularq_blueprint = Blueprint('ularq', __name__)
 
+# failed writes inside a transaction raise and roll back, see controllers/ular.py
+@ularq_blueprint.errorhandler(sqlite3.Error)
+def ularq_dberror(e):
+    print(f"❌ Database error on {request.path}: {e}")
+    return jsonify({
+        "status": "error",
+        "message": "Database error, nothing was saved"
+    }), 500
+
 # Track selected answer before submission
 @ularq_blueprint.route("/api/ular/selectanswer")
 def apiular_selectanswer():
@@ -25,9 +35,7 @@ def apiular_selectanswer():
     
     # Only the current turn player can select
     if player == rturn:
-        query = "UPDATE room SET selectedanswer = ? WHERE code = ?;"
-        params = (answer, code)
-        af_getdb(dbloc, query, params)
+        roomselectanswer(code, answer)
         
         return jsonify({
             "status": "ok",
@@ -147,76 +155,89 @@ def apiular_submitanswer():
     if rquestionid != "":
 
         if player == rturn:
-            submitanswerd = submitanswer(rquestionid, answer)
-            
-            # Store answer correctness for 2 seconds so other players can see
-            answercorrect = "true" if submitanswerd["answer"] == True else "false"
-            query = "UPDATE room SET answercorrect = ?, selectedanswer = ? WHERE code = ?;"
-            params = (answercorrect, answer, code)
-            af_getdb(dbloc, query, params)
+            # answer, move and turn change commit together
+            with af_transaction(roomdb(code)):
+                submitanswerd = submitanswer(rquestionid, answer)
             
-            # Clear question after storing result
-            query = "UPDATE room SET questionid = ? WHERE code = ?;"
-            params = ("", code,)
-            data = af_getdb(dbloc,query,params)
-            # new_data = {"questionid": ""}
-            # af_replacecsv2(roomcsv, "code", code, new_data)
+                # Store answer correctness for 2 seconds so other players can see,
+                # and clear question after storing result
+                answercorrect = "true" if submitanswerd["answer"] == True else "false"
+                if not roomanswerresult(code, answercorrect, answer, rquestionid, player):
+                    # another submit for this question got in first
+                    return jsonify(
+                        {
+                            "status": "error",
+                            "message": f"No question available!"
+                        }
+                    )
+                af_oncommit(roomdb(code), lambda: af_metricinc("ular_answers_total", {"game": "ular", "correct": answercorrect}))
             
-            #kalau tangga, naik, kalau ular, turun
-            #get player data and ladder or snake info
-            pdata = playerdata(code, player)
-            ppos = pdata[0]['pos']
-            laddersnakeinfo = getladdersnakeinfo(ppos)
-            endpos = laddersnakeinfo['end']
-            ladderorsnake = laddersnakeinfo['ladderorsnake']
-            pos = int(pdata[0]['pos'])
-            additionalmessage = ""
+                #kalau tangga, naik, kalau ular, turun
+                #get player data and ladder or snake info
+                pdata = playerdata(code, player)
+                if submitanswerd["answer"] == True:
+                    playerrecordright(code, pdata[0], rquestionid)
+                ppos = pdata[0]['pos']
+                laddersnakeinfo = getladdersnakeinfo(ppos)
+                endpos = laddersnakeinfo['end']
+                ladderorsnake = laddersnakeinfo['ladderorsnake']
+                pos = int(pdata[0]['pos'])
+                additionalmessage = ""
             
-            modelnextturn(code, player)
+                if submitanswerd["answer"] == True:
+                    #kalau betul, kalau ladder, changepos
+                    additionalmessage = "You keep on your place"
+                    if ladderorsnake == "ladder":
+                        additionalmessage = "You got ladder!"
+                        pos = endpos
+                        playerchangepos(code, player, endpos)
+                else:
+                    #kalau betul, kalau snake, changepos
+                    additionalmessage = "You keep on your place"
+                    if ladderorsnake == "snake":
+                        additionalmessage = "You go down the snake"
+                        pos = endpos
+                        playerchangepos(code, player, endpos)
+
+                publishroomevent(code, "answer", {
+                    "player": player,
+                    "answer": answer,
+                    "correct": submitanswerd["answer"],
+                    "ladderorsnake": ladderorsnake,
+                    "pos": pos
+                })
+
+                modelnextturn(code, player)
             
-            if submitanswerd["answer"] == True:
-                #kalau betul, kalau ladder, changepos
-                additionalmessage = "You keep on your place"
-                if ladderorsnake == "ladder":
-                    additionalmessage = "You got ladder!"
-                    pos = endpos
-                    playerchangepos(code, player, endpos)
-                
-                #checker, if pos 100, endgame
-                ended = checkgameended(pos, code, rmaxbox)
-
-                return jsonify(
-                    {
-                        "status": "ok",
-                        "message": f"Congrats! Your answer is right! {additionalmessage}",
-                        "answer": submitanswerd["answer"],
-                        "pos": pos,
-                        "ladderorsnake": ladderorsnake,
-                        "players": modelgetcsvplayers(code),
-                        "state": rstate,
-                        "ended": ended
-                    }
-                )
+                if submitanswerd["answer"] == True:
+                    #checker, if pos 100, endgame
+                    ended = checkgameended(pos, code, rmaxbox)
+
+                    return jsonify(
+                        {
+                            "status": "ok",
+                            "message": f"Congrats! Your answer is right! {additionalmessage}",
+                            "answer": submitanswerd["answer"],
+                            "pos": pos,
+                            "ladderorsnake": ladderorsnake,
+                            "players": modelgetcsvplayers(code),
+                            "state": rstate,
+                            "ended": ended
+                        }
+                    )
             
-            else:
-                #kalau betul, kalau snake, changepos
-                additionalmessage = "You keep on your place"
-                if ladderorsnake == "snake":
-                    additionalmessage = "You go down the snake"
-                    pos = endpos
-                    playerchangepos(code, player, endpos)
-
-                return jsonify(
-                    {
-                        "status": "ok",
-                        "message": f"Awww, you got wrong answer :( {additionalmessage}",
-                        "answer": submitanswerd["answer"],
-                        "pos": pos,
-                        "ladderorsnake": ladderorsnake,
-                        "players": modelgetcsvplayers(code),
-                        "state": rstate,
-                    }
-                )
+                else:
+                    return jsonify(
+                        {
+                            "status": "ok",
+                            "message": f"Awww, you got wrong answer :( {additionalmessage}",
+                            "answer": submitanswerd["answer"],
+                            "pos": pos,
+                            "ladderorsnake": ladderorsnake,
+                            "players": modelgetcsvplayers(code),
+                            "state": rstate,
+                        }
+                    )
         else:
             return jsonify(
                 {
@@ -254,6 +275,28 @@ def admin_login():
 @ularq_blueprint.route('/api/admin/getquestionlist', methods=['GET'])
 def admin_getquestionlist():
     topic = af_requestget("topic")
+    limit = af_requestget("limit")
+    cursor = af_requestget("cursor")
+
+    # paged when limit or cursor is given, the whole list otherwise
+    if limit or cursor:
+        limit = limit or "50"
+        if not str(limit).isdigit() or not 0 < int(limit) <= 500:
+            return jsonifynotvalid("limit")
+        after = None
+        if cursor:
+            after = decodequestioncursor(cursor)
+            if after is None:
+                return jsonifynotvalid("cursor")
+        questions, nextcursor = modelgetquestionpage(topic or "", int(limit), after)
+        payload = {
+            "status": "ok",
+            "questions": questions,
+            "nextcursor": nextcursor
+        }
+        if af_requestget("count", "") in ("1", "true"):
+            payload["total"] = modelquestioncount(topic or "")
+        return jsonify(payload)
     
     if topic and topic != "":
         query = "SELECT * FROM questions WHERE topic = ? ORDER BY id;"
@@ -268,6 +311,42 @@ def admin_getquestionlist():
         "questions": dbdata
     })
 
+@ularq_blueprint.route('/api/admin/searchquestions', methods=['GET'])
+def admin_searchquestions():
+    # ranked prefix search, instead of shipping the whole list to the browser
+    text = af_requestget("q")
+    topic = af_requestget("topic", "")
+    limit = af_requestget("limit", "20")
+    offset = af_requestget("offset", "0")
+
+    if inputnotvalidated(text):
+        return jsonifynotvalid("q")
+    if not str(limit).isdigit() or not 0 < int(limit) <= 200:
+        return jsonifynotvalid("limit")
+    if not str(offset).isdigit():
+        return jsonifynotvalid("offset")
+
+    questions = modelsearchquestions(text, topic, int(limit), int(offset))
+    return jsonify({
+        "status": "ok",
+        "q": text,
+        "questions": questions,
+        "more": len(questions) == int(limit)
+    })
+
+@ularq_blueprint.route('/api/admin/rebuildsearch', methods=['GET'])
+def admin_rebuildsearch():
+    result = modelrebuildquestionsearch()
+    if af_rowcount(result) < 0:
+        return jsonify({
+            "status": "error",
+            "message": f"Rebuild failed: {result}"
+        })
+    return jsonify({
+        "status": "ok",
+        "message": "Search index rebuilt"
+    })
+
 @ularq_blueprint.route('/api/admin/getquestion', methods=['GET'])
 def admin_getquestion():
     questionid = af_requestget("id")
@@ -300,6 +379,8 @@ def admin_createquestion():
     a4 = af_requestget("a4")
     answer = af_requestget("answer")
     topic = af_requestget("topic")
+    difficulty = af_requestget("difficulty")
+    duplicates = af_requestget("duplicates", "flag")
     
     if inputnotvalidated(questionid):
         return jsonifynotvalid("id")
@@ -317,6 +398,10 @@ def admin_createquestion():
         return jsonifynotvalid("answer")
     if inputnotvalidated(topic):
         return jsonifynotvalid("topic")
+    if not inputnotvalidated(difficulty) and difficultylevel(difficulty) is False:
+        return jsonifynotvalid("difficulty")
+    if duplicates not in ("flag", "reject"):
+        return jsonifynotvalid("duplicates")
     
     # Check if question ID already exists
     query = "SELECT id FROM questions WHERE id = ?;"
@@ -329,18 +414,27 @@ def admin_createquestion():
             "message": "Question ID already exists"
         })
     
+    # Look for the same question under another id (duplicates=reject refuses it)
+    row = {"id": questionid, "question": question, "a1": a1, "a2": a2, "a3": a3, "a4": a4}
+    similar = modelfindduplicates([row]).get(questionid, [])
+    if similar and duplicates == "reject":
+        return jsonify({
+            "status": "error",
+            "message": "Question looks like a duplicate",
+            "duplicates": similar
+        })
+    
     # Insert new question
-    query = """INSERT INTO questions (id, question, a1, a2, a3, a4, answer, topic)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?);"""
-    params = (questionid, question, a1, a2, a3, a4, answer, topic)
-    result = af_getdb(dbloc, query, params)
+    level = difficultylevel(difficulty) if not inputnotvalidated(difficulty) else None
+    result = modelcreatequestion(questionid, question, a1, a2, a3, a4, answer, topic, level)
     
     # Check if insert was successful (af_getdb returns success message or error)
     if "successfully" in str(result).lower() or "rows affected" in str(result).lower():
         return jsonify({
             "status": "ok",
             "message": "Question created successfully",
-            "id": questionid
+            "id": questionid,
+            "duplicates": similar
         })
     else:
         return jsonify({
@@ -348,6 +442,75 @@ def admin_createquestion():
             "message": f"Question creation failed: {result}"
         })
 
+# Bulk import: POST the file as the body (or as multipart field "file").
+# The response streams one JSON object per line: an "error" line per bad row
+# (the first importerrorlimit of them), a "duplicate" line per row that looks
+# like a question already in the bank or earlier in the file (dedup=flag
+# imports it anyway, dedup=skip leaves it out, dedup=off doesn't check),
+# a "progress" line per batch, then "done".
+importerrorlimit = 1000
+
+@ularq_blueprint.route('/api/admin/importquestions', methods=['POST'])
+def admin_importquestions():
+    fmt = af_requestget("format", "csv")
+    mode = af_requestget("mode", "insert")
+    dedup = af_requestget("dedup", "flag")
+
+    if fmt not in ("csv", "jsonl"):
+        return jsonifynotvalid("format")
+    if mode not in ("insert", "upsert"):
+        return jsonifynotvalid("mode")
+    if dedup not in ("flag", "skip", "off"):
+        return jsonifynotvalid("dedup")
+
+    upload = request.files.get("file")
+    stream = upload.stream if upload is not None else request.stream
+    records = readquestioncsv(stream) if fmt == "csv" else readquestionjsonl(stream)
+
+    def generate():
+        reported = 0
+        for event in modelimportquestions(records, mode, dedup=dedup):
+            if event["type"] in ("error", "duplicate"):
+                reported += 1
+                if reported > importerrorlimit:
+                    continue
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@ularq_blueprint.route('/api/admin/exportquestions', methods=['GET'])
+def admin_exportquestions():
+    fmt = af_requestget("format", "csv")
+    topic = af_requestget("topic", "")
+
+    if fmt not in ("csv", "jsonl"):
+        return jsonifynotvalid("format")
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(modelexportquestions(fmt, topic)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=questions.{fmt}"
+    return response
+
+@ularq_blueprint.route('/api/admin/duplicatereport', methods=['GET'])
+def admin_duplicatereport():
+    threshold = af_requestget("threshold", "")
+    limit = af_requestget("limit", "100")
+    pairs = af_requestget("pairs", str(duplicatereportpairs))
+
+    try:
+        threshold = float(threshold) if threshold else None
+    except ValueError:
+        return jsonifynotvalid("threshold")
+    if threshold is not None and not 0 < threshold <= 1:
+        return jsonifynotvalid("threshold")
+    if not str(limit).isdigit():
+        return jsonifynotvalid("limit")
+    if not str(pairs).isdigit():
+        return jsonifynotvalid("pairs")
+
+    report = modelduplicatereport(threshold, int(limit), pairlimit=int(pairs))
+    return jsonify(dict(report, status="ok"))
+
 @ularq_blueprint.route('/api/admin/updatequestion', methods=['GET'])
 def admin_updatequestion():
     questionid = af_requestget("id")
@@ -358,6 +521,7 @@ def admin_updatequestion():
     a4 = af_requestget("a4")
     answer = af_requestget("answer")
     topic = af_requestget("topic")
+    difficulty = af_requestget("difficulty")
     
     if inputnotvalidated(questionid):
         return jsonifynotvalid("id")
@@ -375,13 +539,12 @@ def admin_updatequestion():
         return jsonifynotvalid("answer")
     if inputnotvalidated(topic):
         return jsonifynotvalid("topic")
+    if not inputnotvalidated(difficulty) and difficultylevel(difficulty) is False:
+        return jsonifynotvalid("difficulty")
     
-    # Update question
-    query = """UPDATE questions 
-               SET question = ?, a1 = ?, a2 = ?, a3 = ?, a4 = ?, answer = ?, topic = ?
-               WHERE id = ?;"""
-    params = (question, a1, a2, a3, a4, answer, topic, questionid)
-    af_getdb(dbloc, query, params)
+    # Update question (difficulty left out keeps the current one)
+    level = difficultylevel(difficulty) if not inputnotvalidated(difficulty) else None
+    modelupdatequestion(questionid, question, a1, a2, a3, a4, answer, topic, level)
     
     return jsonify({
         "status": "ok",
@@ -396,9 +559,7 @@ def admin_deletequestion():
         return jsonifynotvalid("id")
     
     # Delete question
-    query = "DELETE FROM questions WHERE id = ?;"
-    params = (questionid,)
-    af_getdb(dbloc, query, params)
+    modeldeletequestion(questionid)
     
     return jsonify({
         "status": "ok",
@@ -2,6 +2,12 @@ from flask import Blueprint, request, jsonify, g
 from datetime import datetime
 import sqlite3
 import random
+import json
+import time
+from ..utils.db_helper import af_getdb, af_transaction, af_rowcount, af_autovacuum, af_incrementalvacuum
+from ..utils.roomcode_helper import af_codesinit, af_allocatecode, af_releasecode
+from ..utils.reaper_helper import *
+from ..utils.metrics_helper import af_metricinc, af_metricgauge
 
 ularular_bp = Blueprint("ularular", __name__, url_prefix="/ularular")
 
@@ -62,13 +68,114 @@ def ularular_init_db():
             time TEXT
         );
         """)
+        # last change time, for the reaper
+        columns = [row[1] for row in db.execute("PRAGMA table_info(rooms);").fetchall()]
+        if "updated" not in columns:
+            db.execute("ALTER TABLE rooms ADD COLUMN updated REAL;")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_rooms_updated ON rooms (updated);")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_moves_room ON moves (room_code, id);")
         db.commit()
+        af_codesinit(DB_FILE, "rooms", 4,
+                     existing=lambda: [row[0] for row in db.execute("SELECT code FROM rooms;").fetchall()])
+        af_autovacuum(DB_FILE)
+        ularular_initarchive()
+        af_reaperadd("ularular", ularular_reap)
+        af_metricgauge("ular_rooms", "Rooms by state", ularular_metricrooms, "ularular")
+        af_metricgauge("ular_players_online", "Players in waiting or playing rooms", ularular_metricplayers, "ularular")
         print("✅ Ularular database tables initialized successfully")
         
     except Exception as e:
         print(f"❌ Error initializing ularular database: {e}")
         db.rollback()
 
+# ----------------------
+# Metrics
+# ----------------------
+def ularular_metricrooms():
+    data = af_getdb(DB_FILE, "SELECT state, COUNT(*) AS n FROM rooms GROUP BY state;", ())
+    if isinstance(data, str):
+        return {}
+    return {(("game", "ularular"), ("state", r["state"])): r["n"] for r in data}
+
+def ularular_metricplayers():
+    query = """SELECT r.state, COUNT(*) AS n FROM players p JOIN rooms r ON r.code = p.room_code
+               WHERE r.state != 'finished' GROUP BY r.state;"""
+    data = af_getdb(DB_FILE, query, ())
+    if isinstance(data, str):
+        return {}
+    return {(("game", "ularular"), ("state", r["state"])): r["n"] for r in data}
+
+# ----------------------
+# Reaper
+# ----------------------
+# Finished rooms idle for af_archiveafter, and any room idle for af_roomttl,
+# are copied with their players and moves to ularular_archive in af_archivedb
+# and deleted here. Deletes are guarded on rooms.updated.
+
+def ularular_initarchive():
+    af_getdb(af_archiveinit(), """CREATE TABLE IF NOT EXISTS ularular_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT,
+        updated REAL,
+        archived REAL,
+        room TEXT,
+        players TEXT,
+        moves TEXT,
+        UNIQUE (code, updated)
+    );""", ())
+
+def ularular_rows(table, column, codes):
+    query = f"SELECT * FROM {table} WHERE {column} IN ({','.join('?' * len(codes))}) ORDER BY rowid;"
+    rows = af_getdb(DB_FILE, query, tuple(codes))
+    bycode = {}
+    for row in rows if isinstance(rows, list) else []:
+        bycode.setdefault(row[column], []).append(row)
+    return bycode
+
+def ularular_reap():
+    """One reaper pass over the ularular tables, returns counters for af_reaperstats"""
+    now = time.time()
+    # rooms from before the updated column start their clock now
+    af_getdb(DB_FILE, "UPDATE rooms SET updated = ? WHERE updated IS NULL;", (now,))
+    reaped = 0
+    archived = 0
+    while True:
+        query = """SELECT * FROM rooms WHERE (state = 'finished' AND updated < ?) OR updated < ?
+                   ORDER BY updated LIMIT ?;"""
+        rooms = af_getdb(DB_FILE, query, (now - af_archiveafter, now - af_roomttl, af_reapbatch))
+        if isinstance(rooms, str) or rooms == []:
+            break
+        codes = [r["code"] for r in rooms]
+        players = ularular_rows("players", "room_code", codes)
+        moves = ularular_rows("moves", "room_code", codes)
+
+        with af_transaction(af_archivedb):
+            for r in rooms:
+                query = "INSERT OR REPLACE INTO ularular_archive (code, updated, archived, room, players, moves) VALUES (?,?,?,?,?,?);"
+                params = (r["code"], r["updated"], now, json.dumps(r),
+                          json.dumps(players.get(r["code"], [])), json.dumps(moves.get(r["code"], [])))
+                af_getdb(af_archivedb, query, params)
+
+        done = 0
+        with af_transaction(DB_FILE):
+            for r in rooms:
+                result = af_getdb(DB_FILE, "DELETE FROM rooms WHERE code = ? AND updated = ?;", (r["code"], r["updated"]))
+                if af_rowcount(result) == 1:
+                    af_getdb(DB_FILE, "DELETE FROM players WHERE room_code = ?;", (r["code"],))
+                    af_getdb(DB_FILE, "DELETE FROM moves WHERE room_code = ?;", (r["code"],))
+                    af_releasecode(DB_FILE, "rooms", r["code"])
+                    done += 1
+                    if r["state"] != "finished":
+                        reaped += 1
+        archived += done
+        if len(rooms) < af_reapbatch or done == 0:
+            break
+    return {
+        "reaped": reaped,
+        "archived": archived,
+        "bytesreclaimed": af_incrementalvacuum(DB_FILE, af_vacuumpages) if archived else 0
+    }
+
 # ----------------------
 # Game Logic
 # ----------------------
@@ -82,12 +189,9 @@ def apply_dice(pos, dice):
         new_pos = ladders[new_pos]
     return new_pos
 
-import string
-import random
-
 def generate_room_code(length=4):
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+    # unique across rooms, from the shared room code allocator
+    return af_allocatecode(DB_FILE, "rooms", length)
 
 # ----------------------
 # Endpoints
@@ -96,12 +200,12 @@ def generate_room_code(length=4):
 def create_room():
     data = request.json
     #code = data.get("code")
-    code = generate_room_code()
     player = data.get("player")
 
     db = ularular_get_db()
-    db.execute("INSERT INTO rooms (code, turn, state) VALUES (?, ?, ?)",
-               (code, player, "waiting"))
+    code = generate_room_code()
+    db.execute("INSERT INTO rooms (code, turn, state, updated) VALUES (?, ?, ?, ?)",
+               (code, player, "waiting", time.time()))
     db.execute("INSERT INTO players (room_code, player, pos) VALUES (?, ?, ?)",
                (code, player, 0))
     db.commit()
@@ -121,6 +225,7 @@ def join_room():
 
     db.execute("INSERT OR IGNORE INTO players (room_code, player, pos) VALUES (?, ?, ?)",
                (code, player, 0))
+    db.execute("UPDATE rooms SET updated=? WHERE code=?", (time.time(), code))
     db.commit()
 
     players = db.execute("SELECT player FROM players WHERE room_code=?", (code,)).fetchall()
@@ -162,12 +267,13 @@ def roll_dice():
     idx = player_list.index(player)
     next_turn = player_list[(idx + 1) % len(player_list)]
 
-    db.execute("UPDATE rooms SET turn=? WHERE code=?", (next_turn, code))
+    db.execute("UPDATE rooms SET turn=?, updated=? WHERE code=?", (next_turn, time.time(), code))
     db.execute(
         "INSERT INTO moves (room_code, player, dice, pos, time) VALUES (?, ?, ?, ?, ?)",
         (code, player, dice, new_pos, datetime.now().isoformat())
     )
     db.commit()
+    af_metricinc("ular_rolls_total", {"game": "ularular"})
 
     return jsonify({
         "dice": dice,
@@ -3,8 +3,22 @@ from flask import jsonify
 # from ..utils.csv_helper import *
 from ..utils.html_helper import *
 from ..utils.db_helper import *
+from ..utils.event_helper import *
+from ..utils.roomcode_helper import *
+from ..utils.reaper_helper import *
+from ..utils.metrics_helper import *
+from ..utils.dedup_helper import *
+import os
+import io
+import re
+import csv
+import base64
+import json
+import sqlite3
+import time
 import random
 import string
+import threading
 
 confcsv = "static/db/ular/conf.csv"
 roomcsv = "static/db/ular/room.csv"
@@ -12,56 +26,82 @@ playerscsv = "static/db/ular/players.csv"
 dbloc = "static/db/ular.db"
 maxbox = 28
 
+# Sharding
+# room/players rows (and room events) live in one of ULAR_SHARDS files picked
+# by the room code, so rooms on different shards commit in parallel. Shard 0 is
+# dbloc itself, which also keeps the shared read-mostly tables: questions,
+# conf, meta and the room code allocator. Every shard gets the full schema so
+# migrations stay the same everywhere. Changing ULAR_SHARDS moves where
+# existing rooms are looked up, so only change it with no games running.
+ularshards = max(1, int(os.environ.get("ULAR_SHARDS", "1")))
+
+def ulardbs():
+    """Every ular database file, dbloc (shard 0) first"""
+    return af_shardlocs(dbloc, ularshards)
+
+def roomdb(code=""):
+    """Database holding room `code` and its players and events"""
+    return af_shardloc(dbloc, code, ularshards)
+
+def roomchanneldb(name=""):
+    if name.startswith("room:"):
+        return roomdb(name[len("room:"):])
+    return dbloc
+
+def createulartables(loc=dbloc):
+    # Create conf table
+    query = """CREATE TABLE IF NOT EXISTS conf (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        start TEXT,
+        end TEXT,
+        type TEXT
+    );"""
+    af_getdb(loc, query, ())
+    
+    # Create room table
+    query = """CREATE TABLE IF NOT EXISTS room (
+        code TEXT PRIMARY KEY,
+        turn TEXT,
+        state TEXT,
+        questionid TEXT,
+        maxbox INTEGER,
+        topic TEXT,
+        selectedanswer TEXT,
+        answercorrect TEXT
+    );"""
+    af_getdb(loc, query, ())
+    
+    # Create players table
+    query = """CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT,
+        player TEXT,
+        pos INTEGER,
+        color TEXT,
+        questionright TEXT,
+        questionget TEXT
+    );"""
+    af_getdb(loc, query, ())
+    
+    # Create questions table
+    query = """CREATE TABLE IF NOT EXISTS questions (
+        id TEXT PRIMARY KEY,
+        question TEXT,
+        a1 TEXT,
+        a2 TEXT,
+        a3 TEXT,
+        a4 TEXT,
+        answer TEXT,
+        topic TEXT
+    );"""
+    af_getdb(loc, query, ())
+
 def init_ular_db():
     """Initialize the ular database tables if they don't exist"""
     try:
-        # Create conf table
-        query = """CREATE TABLE IF NOT EXISTS conf (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            start TEXT,
-            end TEXT,
-            type TEXT
-        );"""
-        af_getdb(dbloc, query, ())
-        
-        # Create room table
-        query = """CREATE TABLE IF NOT EXISTS room (
-            code TEXT PRIMARY KEY,
-            turn TEXT,
-            state TEXT,
-            questionid TEXT,
-            maxbox INTEGER,
-            topic TEXT,
-            selectedanswer TEXT,
-            answercorrect TEXT
-        );"""
-        af_getdb(dbloc, query, ())
-        
-        # Create players table
-        query = """CREATE TABLE IF NOT EXISTS players (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT,
-            player TEXT,
-            pos INTEGER,
-            color TEXT,
-            questionright TEXT,
-            questionget TEXT
-        );"""
-        af_getdb(dbloc, query, ())
-        
-        # Create questions table
-        query = """CREATE TABLE IF NOT EXISTS questions (
-            id TEXT PRIMARY KEY,
-            question TEXT,
-            a1 TEXT,
-            a2 TEXT,
-            a3 TEXT,
-            a4 TEXT,
-            answer TEXT,
-            topic TEXT
-        );"""
-        af_getdb(dbloc, query, ())
-        
+        for loc in ulardbs():
+            createulartables(af_ensuredb(loc))
+
         # Check if conf table is empty and add sample data
         query = "SELECT COUNT(*) as count FROM conf;"
         result = af_getdb(dbloc, query, ())
@@ -94,11 +134,224 @@ def init_ular_db():
             af_getdb(dbloc, query, ())
             print("✅ Added sample questions")
         
+        for loc in ulardbs():
+            migrate_ular_db(loc)
+        af_eventsinit(dbloc)
+        for loc in ulardbs()[1:]:
+            af_eventsinit(loc, default=False)
+        af_eventsroute(roomchanneldb if ularshards > 1 else None)
+        af_codesinit(dbloc, "room", 4, existing=modelgetroomcodes)
+        for loc in ulardbs():
+            if af_autovacuum(loc) and loc == dbloc:
+                # the search index points at questions rowids, which VACUUM may move
+                modelrebuildquestionsearch()
+        initularchive()
+        af_reaperadd("ular", reapularrooms)
+        af_metricgauge("ular_rooms", "Rooms by state", ularmetricrooms, "ular")
+        af_metricgauge("ular_players_online", "Players in waiting or playing rooms", ularmetricplayers, "ular")
+        af_metricgauge("ular_answer_correct_ratio", "Answers that were right, since the counters started", ularmetricaccuracy, "ular")
+
         print("✅ Ular database tables initialized successfully")
         
     except Exception as e:
         print(f"❌ Error initializing ular database: {e}")
 
+def ularaddcolumn(table="", column="", decl="TEXT", loc=dbloc):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column is already there"""
+    columns = af_getdb(loc, f"PRAGMA table_info({table});", ())
+    if isinstance(columns, list) and column not in [c["name"] for c in columns]:
+        af_getdb(loc, f"ALTER TABLE {table} ADD COLUMN {column} {decl};", ())
+
+def ular_migration_1(loc=dbloc):
+    """indexes for keyed lookups (and the dice column older tables miss)"""
+    ularaddcolumn("room", "dice", "INTEGER DEFAULT 0", loc)
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_players_code_player ON players (code, player);", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questions_topic ON questions (topic);", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_conf_start ON conf (start);", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_room_state ON room (state);", ())
+
+def ular_migration_2(loc=dbloc):
+    """meta version counters, bumped by triggers so every worker sees changes"""
+    af_getdb(loc, """CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER
+    );""", ())
+    af_getdb(loc, "INSERT OR IGNORE INTO meta (key, value) VALUES ('conf', 0);", ())
+    for event in ["INSERT", "UPDATE", "DELETE"]:
+        af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_conf_{event.lower()} AFTER {event} ON conf
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'conf';
+            END;""", ())
+
+def ular_migration_3(loc=dbloc):
+    """version counter for the question bank cache"""
+    af_getdb(loc, "INSERT OR IGNORE INTO meta (key, value) VALUES ('questions', 0);", ())
+    for event in ["INSERT", "UPDATE", "DELETE"]:
+        af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_questions_{event.lower()} AFTER {event} ON questions
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'questions';
+            END;""", ())
+
+def ular_migration_4(loc=dbloc):
+    """room version, bumped by every write that changes what /api/ular/state shows"""
+    ularaddcolumn("room", "version", "INTEGER DEFAULT 0", loc)
+
+def ular_migration_5(loc=dbloc):
+    """per-player and question versions for delta state responses"""
+    ularaddcolumn("players", "version", "INTEGER DEFAULT 0", loc)
+    ularaddcolumn("room", "qversion", "INTEGER DEFAULT 0", loc)
+
+ularnow = "((julianday('now') - 2440587.5) * 86400.0)"
+
+def ular_migration_6(loc=dbloc):
+    """room.updated (unix time of the last change) for the reaper, kept by triggers"""
+    ularaddcolumn("room", "updated", "REAL", loc)
+    af_getdb(loc, f"UPDATE room SET updated = {ularnow} WHERE updated IS NULL;", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_room_state_updated ON room (state, updated);", ())
+    af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_room_touch_insert AFTER INSERT ON room
+        WHEN NEW.updated IS NULL
+        BEGIN
+            UPDATE room SET updated = {ularnow} WHERE code = NEW.code;
+        END;""", ())
+    af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_room_touch_update AFTER UPDATE OF version ON room
+        WHEN NEW.version IS NOT OLD.version
+        BEGIN
+            UPDATE room SET updated = {ularnow} WHERE code = NEW.code;
+        END;""", ())
+
+def ular_migration_7(loc=dbloc):
+    """full-text search over questions: external content FTS5 table kept by triggers"""
+    af_getdb(loc, """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+        question, a1, a2, a3, a4,
+        content='questions', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );""", ())
+    columns = "question, a1, a2, a3, a4"
+    new = "NEW.question, NEW.a1, NEW.a2, NEW.a3, NEW.a4"
+    old = "OLD.question, OLD.a1, OLD.a2, OLD.a3, OLD.a4"
+    af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_questions_fts_insert AFTER INSERT ON questions
+        BEGIN
+            INSERT INTO questions_fts (rowid, {columns}) VALUES (NEW.rowid, {new});
+        END;""", ())
+    af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_questions_fts_delete AFTER DELETE ON questions
+        BEGIN
+            INSERT INTO questions_fts (questions_fts, rowid, {columns}) VALUES ('delete', OLD.rowid, {old});
+        END;""", ())
+    af_getdb(loc, f"""CREATE TRIGGER IF NOT EXISTS trg_questions_fts_update AFTER UPDATE ON questions
+        BEGIN
+            INSERT INTO questions_fts (questions_fts, rowid, {columns}) VALUES ('delete', OLD.rowid, {old});
+            INSERT INTO questions_fts (rowid, {columns}) VALUES (NEW.rowid, {new});
+        END;""", ())
+    af_getdb(loc, "INSERT INTO questions_fts (questions_fts) VALUES ('rebuild');", ())
+
+def ular_migration_8(loc=dbloc):
+    """natural-order indexes for paged question lists, and per-topic counts kept by triggers"""
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questions_natural ON questions (length(id), id);", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questions_topic_natural ON questions (topic, length(id), id);", ())
+    af_getdb(loc, """CREATE TABLE IF NOT EXISTS questioncounts (
+        topic TEXT PRIMARY KEY,
+        n INTEGER
+    );""", ())
+    af_getdb(loc, "DELETE FROM questioncounts;", ())
+    af_getdb(loc, "INSERT INTO questioncounts (topic, n) SELECT topic, COUNT(*) FROM questions GROUP BY topic;", ())
+    af_getdb(loc, """CREATE TRIGGER IF NOT EXISTS trg_questioncounts_insert AFTER INSERT ON questions
+        BEGIN
+            INSERT INTO questioncounts (topic, n) VALUES (NEW.topic, 1)
+                ON CONFLICT (topic) DO UPDATE SET n = n + 1;
+        END;""", ())
+    af_getdb(loc, """CREATE TRIGGER IF NOT EXISTS trg_questioncounts_delete AFTER DELETE ON questions
+        BEGIN
+            UPDATE questioncounts SET n = n - 1 WHERE topic IS OLD.topic;
+        END;""", ())
+    af_getdb(loc, """CREATE TRIGGER IF NOT EXISTS trg_questioncounts_update AFTER UPDATE OF topic ON questions
+        WHEN NEW.topic IS NOT OLD.topic
+        BEGIN
+            UPDATE questioncounts SET n = n - 1 WHERE topic IS OLD.topic;
+            INSERT INTO questioncounts (topic, n) VALUES (NEW.topic, 1)
+                ON CONFLICT (topic) DO UPDATE SET n = n + 1;
+        END;""", ())
+
+def ular_migration_9(loc=dbloc):
+    """content hash and LSH band keys per question for duplicate checks"""
+    af_getdb(loc, """CREATE TABLE IF NOT EXISTS questionsig (
+        id TEXT PRIMARY KEY,
+        contenthash TEXT
+    );""", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questionsig_hash ON questionsig (contenthash);", ())
+    af_getdb(loc, """CREATE TABLE IF NOT EXISTS questionlsh (
+        key INTEGER,
+        id TEXT,
+        PRIMARY KEY (key, id)
+    ) WITHOUT ROWID;""", ())
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questionlsh_id ON questionlsh (id);", ())
+    af_getdb(loc, """CREATE TRIGGER IF NOT EXISTS trg_questionsig_delete AFTER DELETE ON questions
+        BEGIN
+            DELETE FROM questionsig WHERE id = OLD.id;
+            DELETE FROM questionlsh WHERE id = OLD.id;
+        END;""", ())
+    af_getdb(loc, """CREATE TRIGGER IF NOT EXISTS trg_questionsig_update AFTER UPDATE OF id, question, a1, a2, a3, a4 ON questions
+        BEGIN
+            DELETE FROM questionsig WHERE id = OLD.id;
+            DELETE FROM questionlsh WHERE id = OLD.id;
+        END;""", ())
+    count = modelbackfillquestionindex(loc)
+    if count:
+        print(f"✅ Indexed {count} questions for duplicate checks")
+
+def ular_migration_10(loc=dbloc):
+    """per-room question deck (see Question decks)"""
+    ularaddcolumn("room", "deckid", "INTEGER DEFAULT 0", loc)
+    ularaddcolumn("room", "deckpos", "INTEGER DEFAULT 0", loc)
+
+def ular_migration_11(loc=dbloc):
+    """question difficulty (1 easy, 2 medium, 3 hard) and its per-topic index"""
+    ularaddcolumn("questions", "difficulty", "INTEGER DEFAULT 2", loc)
+    af_getdb(loc, "CREATE INDEX IF NOT EXISTS idx_questions_topic_difficulty ON questions (topic, difficulty);", ())
+
+def ular_migration_12(loc=dbloc):
+    """roomdeck holds the deck ids, off the room row that every state poll reads"""
+    af_getdb(loc, """CREATE TABLE IF NOT EXISTS roomdeck (
+        code TEXT PRIMARY KEY,
+        deckid INTEGER,
+        deck TEXT
+    );""", ())
+    columns = af_getdb(loc, "PRAGMA table_info(room);", ())
+    if isinstance(columns, list) and "deck" in [c["name"] for c in columns]:
+        af_getdb(loc, """INSERT OR REPLACE INTO roomdeck (code, deckid, deck)
+            SELECT code, deckid, deck FROM room WHERE deck IS NOT NULL AND deck != '';""", ())
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            af_getdb(loc, "ALTER TABLE room DROP COLUMN deck;", ())
+        else:
+            af_getdb(loc, "UPDATE room SET deck = NULL;", ())
+
+# schema migrations, applied in order and tracked with PRAGMA user_version
+ular_migrations = [
+    ular_migration_1,
+    ular_migration_2,
+    ular_migration_3,
+    ular_migration_4,
+    ular_migration_5,
+    ular_migration_6,
+    ular_migration_7,
+    ular_migration_8,
+    ular_migration_9,
+    ular_migration_10,
+    ular_migration_11,
+    ular_migration_12,
+]
+
+# delta state: clients further behind than this get a full snapshot
+ulardeltamax = int(os.environ.get("ULAR_DELTA_MAX", "100"))
+
+def migrate_ular_db(loc=dbloc):
+    result = af_getdb(loc, "PRAGMA user_version;", ())
+    version = result[0]["user_version"] if isinstance(result, list) and result else 0
+    for num in range(version + 1, len(ular_migrations) + 1):
+        with af_transaction(loc):
+            ular_migrations[num - 1](loc)
+            af_getdb(loc, f"PRAGMA user_version = {num};", ())
+        print(f"✅ Ular database {loc} migrated to version {num}")
+
 def modelgetcsvconf():
     query = "SELECT * FROM conf;"
     params = ()
@@ -112,7 +365,7 @@ def modelgetcsvconf():
 def modelgetcsvroom():
     query = "SELECT * FROM room;"
     params = ()
-    data = af_getdb(dbloc,query,params)
+    data = af_fanout(dbloc,ularshards,query,params)
     # data = af_getcsvdict(roomcsv)
     # Handle case where af_getdb returns a string (error message)
     if isinstance(data, str):
@@ -120,64 +373,140 @@ def modelgetcsvroom():
     return data
 
 def modelgetcsvplayers(code=""):
-    query = "SELECT * FROM players;"
-    params = ()
-    data = af_getdb(dbloc,query,params)
+    query = "SELECT * FROM players WHERE code = ? ORDER BY id;"
+    params = (code,)
+    data = af_getdb(roomdb(code),query,params)
     # data = af_getcsvdict(playerscsv)
     # Handle case where af_getdb returns a string (error message)
     if isinstance(data, str):
         return []
-    result = []
-    for d in data:
-        if d["code"] == code:
-            result.append(d)
-    return result
+    return data
+
+def modelgetcsvplayerssince(code="", since=0):
+    """Players of a room changed after room version `since`"""
+    query = "SELECT * FROM players WHERE code = ? AND version > ? ORDER BY id;"
+    params = (code, since,)
+    data = af_getdb(roomdb(code),query,params)
+    if isinstance(data, str):
+        return []
+    return data
+
+def deltasince(since="", version=0):
+    """since as an int when a delta from it is possible, otherwise None (send a snapshot)"""
+    if not str(since).isdigit():
+        return None
+    since = int(since)
+    if since <= 0 or since > version or version - since > ulardeltamax:
+        return None
+    return since
 
 def playerdata(code="", player=""):
-    query = "SELECT * FROM players;"
-    params = ()
-    data = af_getdb(dbloc,query,params)
+    query = "SELECT * FROM players WHERE code = ? AND player = ? ORDER BY id;"
+    params = (code, player,)
+    data = af_getdb(roomdb(code),query,params)
     # data = af_getcsvdict(playerscsv)
     # Handle case where af_getdb returns a string (error message)
     if isinstance(data, str):
         return []
-    result = []
-    for d in data:
-        if d["code"] == code and d["player"] == player:
-            result.append(d)
-    return result
+    return data
 
 def modelgenerateroomcode(length=4):
-    chars = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(chars) for _ in range(length))
+    """Unique room code (from the allocator in dbloc, whatever shard the room lands on)"""
+    return af_allocatecode(dbloc, "room", length)
 
-def startroom(code=""):
+def modelgetroomcodes():
+    data = af_fanout(dbloc, ularshards, "SELECT code FROM room;", ())
+    return [r["code"] for r in data]
+
+def modelroomcounts():
+    """Rooms per state, per shard and overall (admin)"""
+    query = "SELECT state, COUNT(*) AS n FROM room GROUP BY state;"
+    shards = {}
+    total = {}
+    for loc in ulardbs():
+        data = af_getdb(loc, query, ())
+        if isinstance(data, str):
+            continue
+        shards[loc] = {r["state"]: r["n"] for r in data}
+        for r in data:
+            total[r["state"]] = total.get(r["state"], 0) + r["n"]
+    return {"shards": shards, "total": total}
+
+def modelplayersonline():
+    """Players in waiting/playing rooms, per room state, over every shard"""
+    query = """SELECT r.state, COUNT(*) AS n FROM players p JOIN room r ON r.code = p.code
+        WHERE r.state IN ('waiting', 'playing') GROUP BY r.state;"""
+    total = {}
+    for r in af_fanout(dbloc, ularshards, query, ()):
+        total[r["state"]] = total.get(r["state"], 0) + r["n"]
+    return total
+
+# Metrics
+# rolls/answers are counted by the controllers; rooms and players are read
+# from the tables at scrape time
+af_metricdefine("ular_rolls_total", "counter", "Dice rolls accepted")
+af_metricdefine("ular_answers_total", "counter", "Answers submitted, by correctness")
+
+def ularmetricrooms():
+    return {(("game", "ular"), ("state", state)): n for state, n in modelroomcounts()["total"].items()}
+
+def ularmetricplayers():
+    return {(("game", "ular"), ("state", state)): n for state, n in modelplayersonline().items()}
+
+def ularmetricaccuracy():
+    """Share of answers that were right, from the summed counters"""
+    totals = af_metricsum()
+    right = totals.get(af_metrickey("ular_answers_total", {"game": "ular", "correct": "true"}), 0)
+    wrong = totals.get(af_metrickey("ular_answers_total", {"game": "ular", "correct": "false"}), 0)
+    if right + wrong == 0:
+        return {}
+    return {(("game", "ular"),): round(right / (right + wrong), 4)}
+
+def startroom(code="", count=None, difficulty=None, fallback=None):
+    """Start the game with a deck of count questions (see modelselectquestions); returns how it was picked"""
     # new_data = {"state":"playing"}
-    query = "UPDATE room SET state = ? WHERE code = ?;"
-    params = ("playing", code,)
-    data = af_getdb(dbloc,query,params)
+    # pick the questions before taking the write lock
+    deck, picked = modelselectquestions(roomdata(code)["topic"], count, difficulty, fallback)
+    if deck is None:
+        return picked
+    deckid = newdeckid()
+    with af_transaction(roomdb(code)):
+        # only a waiting room starts, so a second startgame can't re-deal mid-game
+        query = "UPDATE room SET state = ?, deckid = ?, deckpos = 0, version = version + 1 WHERE code = ? AND state = 'waiting';"
+        params = ("playing", deckid, code,)
+        data = af_getdb(roomdb(code),query,params)
+        if af_rowcount(data) != 1:
+            return {"status": "error", "message": "room already started"}
+        saveroomdeck(code, deck, deckid)
+        publishroomevent(code, "start", {})
+    return picked
     # af_replacecsv2(roomcsv, "code", code, new_data)
 
 
 
+# The room/player writers below run in a transaction (their own or the
+# caller's), so a failed write raises sqlite3.Error and rolls the whole unit
+# back; the controllers' errorhandler turns it into a JSON error.
+
 def adddataroom(code="", turn="", state="", maxbox=maxbox, topic="biologi"):
-    query = "INSERT INTO room (code,turn,state,questionid,maxbox,topic,dice) VALUES (?,?,?,?,?,?,?);"
-    params = (code, turn, state, "", maxbox, topic, 0)
-    data = af_getdb(dbloc,query,params)
-    # Check if there was an error
-    if isinstance(data, str) and ("error" in data.lower() or "Query executed" not in data):
-        print(f"Error adding room: {data}")
+    """Insert a room row; raises sqlite3.Error (e.g. the code is taken)"""
+    query = "INSERT INTO room (code,turn,state,questionid,maxbox,topic,dice,version) VALUES (?,?,?,?,?,?,?,?);"
+    params = (code, turn, state, "", maxbox, topic, 0, 1)
+    with af_transaction(roomdb(code)):
+        af_getdb(roomdb(code),query,params)
     # af_addcsv(roomcsv, [
     #     code, turn, state, "", maxbox, topic
     # ])
 
 def adddataplayer(code="", player="", pos=0, color="white"):
-    query = "INSERT INTO players (code,player,pos,color,questionright,questionget) VALUES (?,?,?,?,?,?);"
-    params = (code, player, pos, color, "", "")
-    data = af_getdb(dbloc,query,params)
-    # Check if there was an error
-    if isinstance(data, str) and ("error" in data.lower() or "Query executed" not in data):
-        print(f"Error adding player: {data}")
+    # player rows carry the room version they were last changed at
+    query = """INSERT INTO players (code,player,pos,color,questionright,questionget,version)
+               VALUES (?,?,?,?,?,?,(SELECT COALESCE(version, 0) + 1 FROM room WHERE code = ?));"""
+    params = (code, player, pos, color, "", "", code)
+    with af_transaction(roomdb(code)):
+        af_getdb(roomdb(code),query,params)
+        bumproomversion(code)
+        publishroomevent(code, "join", {"player": player, "color": color, "pos": pos})
     # af_addcsv(playerscsv, [
     #     code, player, pos, color, "", ""
     # ])
@@ -199,50 +528,102 @@ def jsonifynotvalid(input=""):
         "message": f"{input} is not valid"
     })
 
+def modelgetroom(code=""):
+    query = "SELECT * FROM room WHERE code = ?;"
+    params = (code,)
+    data = af_getdb(roomdb(code),query,params)
+    if isinstance(data, str) or data == []:
+        return None
+    return data[0]
+
+# Room events
+# Written to the events table inside the surrounding transaction, so they show
+# up (in every worker) exactly when the game write commits.
+# join, start, roll, question, select, answer, turn, end
+af_eventsheartbeat = int(os.environ.get("ULAR_EVENTS_HEARTBEAT", "15"))
+
+def roomchannel(code=""):
+    return f"room:{code}"
+
+def publishroomevent(code="", type="", data={}):
+    data = dict(data)
+    data["code"] = code
+    af_publish(roomchannel(code), type, data)
+
+def roomlasteventid(code=""):
+    return af_lasteventid(roomchannel(code))
+
+def waitroomevents(code="", lastid=0, timeout=af_eventsheartbeat):
+    return af_waitevents(roomchannel(code), lastid, timeout)
+
+def getroomversion(code=""):
+    """Current room version, None when the room doesn't exist (room table only)"""
+    query = "SELECT version FROM room WHERE code = ?;"
+    params = (code,)
+    data = af_getdb(roomdb(code),query,params)
+    if isinstance(data, str) or data == []:
+        return None
+    return data[0]["version"] or 0
+
+def bumproomversion(code=""):
+    query = "UPDATE room SET version = version + 1 WHERE code = ?;"
+    params = (code,)
+    af_getdb(roomdb(code),query,params)
+
+def roomclearanswer(code=""):
+    query = "UPDATE room SET selectedanswer = ?, answercorrect = ?, version = version + 1 WHERE code = ?;"
+    params = ("", "", code)
+    af_getdb(roomdb(code),query,params)
+
+def roomselectanswer(code="", answer=""):
+    query = "UPDATE room SET selectedanswer = ?, version = version + 1 WHERE code = ?;"
+    params = (answer, code)
+    af_getdb(roomdb(code),query,params)
+    publishroomevent(code, "select", {"answer": answer})
+
+def roomanswerresult(code="", answercorrect="", answer="", questionid="", player=""):
+    """Store the answer result for other players to see and clear the question.
+
+    Guarded on the question and turn the caller read, like rollturn, so only
+    one of two concurrent submits gets through; returns whether this one did.
+    """
+    query = """UPDATE room SET answercorrect = ?, selectedanswer = ?, questionid = ?, version = version + 1, qversion = version + 1
+               WHERE code = ? AND questionid = ? AND turn = ?;"""
+    params = (answercorrect, answer, "", code, questionid, player)
+    data = af_getdb(roomdb(code),query,params)
+    return af_rowcount(data) == 1
+
 def roomavailable(code=""):
-    data = modelgetcsvroom()
-    for d in data:
-        if (d["code"] == code):
-            return True
-    
-    return False
+    return modelgetroom(code) is not None
 
 def roomstatus(code=""):
-    data = modelgetcsvroom()
-    for d in data:
-        if (d["code"] == code):
-            if (d["state"] == "waiting"):
-                return "waiting"
-            elif (d["state"] == "playing"):
-                return "playing"
-            else:
-                return "finished"
-    
-    return "not exist"
+    query = "SELECT state FROM room WHERE code = ?;"
+    params = (code,)
+    data = af_getdb(roomdb(code),query,params)
+    if isinstance(data, str) or data == []:
+        return "not exist"
 
-def roomdata(code=""):
-    maxbox = 0
-    data = modelgetcsvroom()
-    for d in data:
-        maxbox = d["maxbox"]
-        if maxbox == "" or maxbox == None:
-            maxbox = 0
-        else:
-            maxbox = int(maxbox)
+    if (data[0]["state"] == "waiting"):
+        return "waiting"
+    elif (data[0]["state"] == "playing"):
+        return "playing"
+    else:
+        return "finished"
 
-        if (d["code"] == code):
-            return d
+def roomdata(code=""):
+    d = modelgetroom(code)
+    if d is not None:
+        return d
     
     return {
         "state": "",
         "turn": "",
         "questionid": "",
-        "maxbox": maxbox,
+        "maxbox": 0,
         "topic": ""
     }
 
-def modelnextturn(code="", currentplayer=""):
-    players = modelgetcsvplayers(code)
+def nextplayer(players=[], currentplayer=""):
     lengtharray = len(players)
     turn = ""
     pnum = 0
@@ -253,17 +634,26 @@ def modelnextturn(code="", currentplayer=""):
             else:
                 turn = players[pnum+1]['player'] 
         pnum += 1
-    query = "UPDATE room SET turn = ? WHERE code = ?;"
+    return turn
+
+def modelnextturn(code="", currentplayer=""):
+    players = modelgetcsvplayers(code)
+    turn = nextplayer(players, currentplayer)
+    query = "UPDATE room SET turn = ?, version = version + 1 WHERE code = ?;"
     params = (turn, code,)
-    data = af_getdb(dbloc,query,params)
+    data = af_getdb(roomdb(code),query,params)
+    publishroomevent(code, "turn", {"turn": turn})
     # new_data = {"turn":turn}
     # af_replacecsv2(roomcsv, "code", code, new_data)
     return turn
 
 def playerchangepos(code="", player="", newpos=""):
-    query = "UPDATE players SET pos = ? WHERE code = ? AND player = ?;"
-    params = (newpos, code, player,)
-    data = af_getdb(dbloc,query,params)
+    query = """UPDATE players SET pos = ?, version = (SELECT COALESCE(version, 0) + 1 FROM room WHERE code = ?)
+               WHERE code = ? AND player = ?;"""
+    params = (newpos, code, code, player,)
+    with af_transaction(roomdb(code)):
+        data = af_getdb(roomdb(code),query,params)
+        bumproomversion(code)
     # new_data = {"pos":newpos}
     # af_replacecsvtwotarget(playerscsv, 
     #                        "player", player, "code", code, 
@@ -271,12 +661,10 @@ def playerchangepos(code="", player="", newpos=""):
 
 
 def update_room_dice(code="", dice=0):
-    """Update the dice value in the room table"""
-    query = "UPDATE room SET dice = ? WHERE code = ?;"
+    """Update the dice value in the room table (inside rolldice's transaction, raises on failure)"""
+    query = "UPDATE room SET dice = ?, version = version + 1 WHERE code = ?;"
     params = (dice, code,)
-    data = af_getdb(dbloc, query, params)
-    if isinstance(data, str) and ("error" in data.lower() or "Query executed" not in data):
-        print(f"Error updating room dice: {data}")
+    af_getdb(roomdb(code), query, params)
 
 
 def checkgameended(pos="", code="", maxbox=maxbox):
@@ -287,6 +675,128 @@ def checkgameended(pos="", code="", maxbox=maxbox):
     
     return ended
 
+def rollerror(room=None, joined=False, player=""):
+    """Why player can't roll in room right now, None when they can"""
+    message = None
+    if room is None or not joined:
+        message = "Please insert correct player"
+    elif room["questionid"] != "":
+        #tengah menjawab soalan
+        message = "Please answer question first!"
+    elif room["state"] == "waiting":
+        message = "room is not started yet!"
+    elif room["state"] == "ended":
+        message = "room is already ended!"
+    elif room["state"] != "playing":
+        message = "room is not available!"
+    elif room["turn"] != player:
+        message = "It is not your turn!"
+    if message is None:
+        return None
+    return {"status": "error", "message": message}
+
+def rollturn(code="", player=""):
+    """Whole dice roll in one transaction.
+
+    Reads the room and its players once, works out the move, bounce, question
+    and next turn in memory, then writes them with an UPDATE guarded on the
+    turn/version it read, so a double tap can't roll twice.
+    """
+    # taps out of turn are turned away on one read, without the write lock
+    query = """SELECT r.turn, r.state, r.questionid,
+               EXISTS (SELECT 1 FROM players p WHERE p.code = r.code AND p.player = ?) AS joined
+               FROM room r WHERE r.code = ?;"""
+    data = af_getdb(roomdb(code), query, (player, code))
+    if isinstance(data, str) or data == []:
+        return rollerror(None, False, player)
+    error = rollerror(data[0], data[0]["joined"] == 1, player)
+    if error is not None:
+        return error
+
+    with af_transaction(roomdb(code)):
+        room = modelgetroom(code)
+        players = modelgetcsvplayers(code) if room is not None else []
+        pdata = [p for p in players if p["player"] == player]
+        error = rollerror(room, pdata != [], player)
+        if error is not None:
+            return error
+
+        rmaxbox = int(room["maxbox"])
+        currentpos = int(pdata[0]["pos"])
+        dicenum = random.randint(1,6)
+        newpos = currentpos + dicenum
+        if newpos > rmaxbox:
+            newpos = rmaxbox - (newpos - rmaxbox)
+
+        #if has question, get question (off the room's deck)
+        question = []
+        deck = {"deckid": room.get("deckid"), "deckpos": room.get("deckpos")}
+        if getendbystartladdersnake(newpos) != 0:
+            question, deck = drawroomquestion(room)
+        questionid = question[0]["id"] if question else ""
+        questionget = pdata[0]["questionget"]
+        if questionid != "":
+            questionget = appendquestionid(questionget, questionid)
+        turn = player if question else nextplayer(players, player)
+        ended = newpos == rmaxbox
+        state = "ended" if ended else "playing"
+        version = (room.get("version") or 0) + 1
+
+        query = """UPDATE room SET turn = ?, dice = ?, questionid = ?, selectedanswer = ?, answercorrect = ?,
+                   state = ?, version = ?, qversion = ?, deckid = ?, deckpos = ?
+                   WHERE code = ? AND turn = ? AND questionid = '' AND state = 'playing' AND version IS ?;"""
+        params = (turn, dicenum, questionid, "", "", state, version, version,
+                  deck["deckid"], deck["deckpos"], code, player, room.get("version"))
+        if af_rowcount(af_getdb(roomdb(code), query, params)) != 1:
+            return {"status": "error", "message": "It is not your turn!"}
+
+        query = "UPDATE players SET pos = ?, questionget = ?, version = ? WHERE code = ? AND player = ?;"
+        params = (newpos, questionget, version, code, player)
+        af_getdb(roomdb(code), query, params)
+
+        steps = getstepsdice(currentpos, dicenum, rmaxbox)
+        publishroomevent(code, "roll", {
+            "player": player,
+            "dice": dicenum,
+            "beforepos": currentpos,
+            "pos": newpos,
+            "steps": steps
+        })
+        if question != []:
+            publishroomevent(code, "question", {
+                "player": player,
+                "questionid": questionid,
+                "question": question
+            })
+        elif turn != player:
+            publishroomevent(code, "turn", {"turn": turn})
+        if ended:
+            publishroomevent(code, "end", {})
+
+    for p in players:
+        if p["player"] == player:
+            p["pos"] = newpos
+            p["questionget"] = questionget
+            p["version"] = version
+
+    return {
+        "status": "ok",
+        "player": player,
+        "turn": turn,
+        "beforepos": currentpos,
+        "pos": newpos,
+        "code": code,
+        "dice": dicenum,
+        "question": question,
+        "questionid": questionid,
+        "steps": steps,
+        "state": state,
+        "ended": ended,
+        "maxbox": rmaxbox,
+        "version": version,
+        "players": players
+    }
+
 def rolldice(code="", player="", currentpos=0, maxbox=maxbox):
     dicenum = random.randint(1,6)
     turn = player
@@ -295,19 +805,35 @@ def rolldice(code="", player="", currentpos=0, maxbox=maxbox):
     if newpos > maxbox:
         newpos = maxbox - (newpos - maxbox)
 
-    #changepos
-    playerchangepos(code, player, newpos)
-    
-    # Update dice value in room
-    update_room_dice(code, dicenum)
-    
-    #if has question, get question
-    qqid = gquestion(newpos, code)
-    question = qqid["question"]
-    questionid = qqid["questionid"]
+    # one commit for the whole move (joins the caller's transaction if any)
+    with af_transaction(roomdb(code)):
+        #changepos
+        playerchangepos(code, player, newpos)
+        
+        # Update dice value in room
+        update_room_dice(code, dicenum)
+        
+        publishroomevent(code, "roll", {
+            "player": player,
+            "dice": dicenum,
+            "beforepos": currentpos,
+            "pos": newpos,
+            "steps": getstepsdice(currentpos, dicenum, maxbox)
+        })
+
+        #if has question, get question
+        qqid = gquestion(newpos, code)
+        question = qqid["question"]
+        questionid = qqid["questionid"]
 
-    if question == []:
-        turn = modelnextturn(code, player)
+        if question == []:
+            turn = modelnextturn(code, player)
+        else:
+            publishroomevent(code, "question", {
+                "player": player,
+                "questionid": questionid,
+                "question": question
+            })
 
     return {
         "player": player,
@@ -322,18 +848,17 @@ def rolldice(code="", player="", currentpos=0, maxbox=maxbox):
 
 def gquestion(newpos="", code=""):
     #endpos = getendbystartladdersnake(newpos)
-    rdata = roomdata(code)
-    topic = rdata["topic"]
-    if getendbystartladdersnake(newpos) == 0:
-        question = []
-        questionid = ""
-    else:
-        question = getrandomquestiontopic(topic)
-        questionid = question[0]["id"]
+    rdata = modelgetroom(code)
+    question = []
+    deck = {"deckid": None, "deckpos": None}
+    if rdata is not None and getendbystartladdersnake(newpos) != 0:
+        question, deck = drawroomquestion(rdata)
+    questionid = question[0]["id"] if question else ""
     
-    query = "UPDATE room SET questionid = ? WHERE code = ?;"
-    params = (questionid, code,)
-    data = af_getdb(dbloc,query,params)
+    query = """UPDATE room SET questionid = ?, deckid = COALESCE(?, deckid), deckpos = COALESCE(?, deckpos),
+               version = version + 1, qversion = version + 1 WHERE code = ?;"""
+    params = (questionid, deck["deckid"], deck["deckpos"], code,)
+    data = af_getdb(roomdb(code),query,params)
 
     # new_data = {
     #     "questionid": questionid
@@ -389,12 +914,7 @@ def getstepsdice(before=0, dice=3, maxbox=maxbox):
 
 
 def playeralreadyavailable(player="", code=""):
-    data = modelgetcsvplayers(code)
-    for d in data:
-        if (d["player"] == player):
-            return True
-    
-    return False
+    return playerdata(code, player) != []
 
 def modelgetcsvquestion():
     query = "SELECT * FROM questions;"
@@ -411,38 +931,738 @@ def getquestions():
     return data
 
 def getquestion(id=""):
-    data = modelgetcsvquestion()
-    result = []
-    for d in data:
-        if d["id"] == id:
-            result.append(d)
-    
-    return result
+    query = "SELECT * FROM questions WHERE id = ?;"
+    params = (id,)
+    data = af_getdb(dbloc,query,params)
+    if isinstance(data, str):
+        return []
+    return data
 
 def getquestionstopic(topic=""):
-    data = modelgetcsvquestion()
-    result = []
-    for d in data:
-        if d["topic"] == topic:
-            result.append(d)
-    
-    return result
+    query = "SELECT * FROM questions WHERE topic = ?;"
+    params = (topic,)
+    data = af_getdb(dbloc,query,params)
+    if isinstance(data, str):
+        return []
+    return data
 
-def getrandomquestiontopic(topic=""):
-    data = modelgetcsvquestion()
-    result = []
-    for d in data:
-        if d["topic"] == topic:
-            result.append(d)
+# Question bank cache
+# Per topic: parallel lists of ids and rows plus id -> index, so a random draw
+# is a single randrange. The "" entry holds every question (used as fallback).
+# Reloaded when meta 'questions' moves; the admin model functions below patch
+# it in place instead when they know theirs was the only change.
+questionbank = {"version": None, "dbloc": None, "topics": {}}
+questionbanklock = threading.Lock()
+
+def questionbankkeys(topic=""):
+    return [""] if topic == "" else ["", topic]
+
+def questionbankadd(bank, row):
+    for key in questionbankkeys(row["topic"]):
+        entry = bank["topics"].setdefault(key, {"ids": [], "rows": [], "pos": {}})
+        entry["pos"][row["id"]] = len(entry["ids"])
+        entry["ids"].append(row["id"])
+        entry["rows"].append(row)
 
-    return random.choices(result)
+def questionbankremove(bank, id=""):
+    allentry = bank["topics"].get("")
+    if allentry is None or id not in allentry["pos"]:
+        return
+    topic = allentry["rows"][allentry["pos"][id]]["topic"]
+    for key in questionbankkeys(topic):
+        entry = bank["topics"][key]
+        index = entry["pos"].pop(id)
+        lastid = entry["ids"].pop()
+        lastrow = entry["rows"].pop()
+        if lastid != id:
+            # swap the last question into the freed slot
+            entry["ids"][index] = lastid
+            entry["rows"][index] = lastrow
+            entry["pos"][lastid] = index
+        if key != "" and entry["ids"] == []:
+            del bank["topics"][key]
+
+def getquestionbank():
+    global questionbank
+    version = getmetaversion("questions")
+    bank = questionbank
+    if version is None or version != bank["version"] or bank["dbloc"] != dbloc:
+        with questionbanklock:
+            bank = questionbank
+            if version is None or version != bank["version"] or bank["dbloc"] != dbloc:
+                bank = {"version": version, "dbloc": dbloc, "topics": {"": {"ids": [], "rows": [], "pos": {}}}}
+                for row in modelgetcsvquestion():
+                    questionbankadd(bank, row)
+                questionbank = bank
+    return bank
+
+def questionbankchanged(before=None, after=None, ids=[]):
+    """Patch the cache after a write that moved meta 'questions' from before to after"""
+    with questionbanklock:
+        bank = questionbank
+        if bank["dbloc"] != dbloc or bank["version"] is None or bank["version"] != before:
+            # cache was already stale, the next read reloads it
+            return
+        for id in ids:
+            questionbankremove(bank, id)
+            row = getquestion(id)
+            if row != []:
+                questionbankadd(bank, row[0])
+        bank["version"] = after
+
+def getrandomquestiontopic(topic=""):
+    bank = getquestionbank()
+    with questionbanklock:
+        entry = bank["topics"].get(topic)
+        if entry is None or entry["rows"] == []:
+            # no questions for this topic, fall back to the whole bank
+            entry = bank["topics"].get("")
+            if entry is None or entry["rows"] == []:
+                return []
+            print(f"No questions for topic '{topic}', drawing from all topics")
+        return [dict(entry["rows"][random.randrange(len(entry["rows"]))])]
 
 def getrandomquestion():
-    data = modelgetcsvquestion()
-    return random.choices(data)
+    return getrandomquestiontopic("")
+
+def questionbankrow(bank, id=""):
+    """Copy of question id from a loaded bank, None when it is gone"""
+    with questionbanklock:
+        entry = bank["topics"].get("")
+        index = entry["pos"].get(id) if entry is not None else None
+        return dict(entry["rows"][index]) if index is not None else None
+
+# Question decks
+# Each room plays through its own shuffled deck of question ids, dealt when
+# the game starts, so nobody in the room sees a question twice until the deck
+# is used up; then it is reshuffled. The ids live in roomdeck, next to the
+# room but out of the room row that every state poll reads; the room only
+# carries deckid (a random id per deal) and deckpos, the next card, which
+# the same UPDATE that stores the drawn question moves on. Each worker keeps
+# a deal's question rows (from the bank, when it first sees the deal) cached
+# by deckid, so roomdeck and the bank version are read once per deal and
+# worker and a draw during play is a list index, no query. The game plays
+# the questions as they were then; ones already deleted are skipped.
+ulardecksize = int(os.environ.get("ULAR_DECK_SIZE", "200"))
+ulardeckmax = 1000
+roomdecks = {}
+roomdeckslimit = 1000
+roomdeckslock = threading.Lock()
+
+def shuffledeck(ids=[], last=""):
+    deck = random.sample(ids, len(ids))
+    if len(deck) > 1 and deck[0] == last:
+        # a reshuffle doesn't open with the question just played
+        deck[0], deck[-1] = deck[-1], deck[0]
+    return deck
+
+def dealdeck(topic="", last="", count=ulardecksize):
+    """Up to count shuffled ids of topic (every topic when it has none)"""
+    bank = getquestionbank()
+    with questionbanklock:
+        entry = bank["topics"].get(topic)
+        if entry is None or entry["ids"] == []:
+            entry = bank["topics"].get("", {"ids": []})
+        ids = random.sample(entry["ids"], min(len(entry["ids"]), count))
+    return shuffledeck(ids, last)
+
+def newdeckid():
+    return random.getrandbits(62)
+
+def cacheroomdeck(deckid=0, ids=[]):
+    """Cache a deal as its question rows, None for ids no longer in the bank; returns them"""
+    bank = getquestionbank()
+    cards = [questionbankrow(bank, id) for id in ids]
+    with roomdeckslock:
+        if len(roomdecks) >= roomdeckslimit:
+            del roomdecks[next(iter(roomdecks))]
+        roomdecks[deckid] = cards
+    return cards
+
+def saveroomdeck(code="", ids=[], deckid=None):
+    """Store a new deal for the room (joins the open transaction); returns its deckid"""
+    deckid = deckid or newdeckid()
+    query = "INSERT OR REPLACE INTO roomdeck (code, deckid, deck) VALUES (?, ?, ?);"
+    af_getdb(roomdb(code), query, (code, deckid, json.dumps(ids)))
+    cacheroomdeck(deckid, ids)
+    return deckid
+
+def roomdeck(code="", deckid=0):
+    """The room's deck as a list of question rows (None where deleted), read once per deal"""
+    if not deckid:
+        return []
+    with roomdeckslock:
+        cards = roomdecks.get(deckid)
+    if cards is None:
+        data = af_getdb(roomdb(code), "SELECT deck FROM roomdeck WHERE code = ? AND deckid = ?;", (code, deckid))
+        ids = json.loads(data[0]["deck"]) if isinstance(data, list) and data != [] else []
+        cards = cacheroomdeck(deckid, ids)
+    return cards
+
+def drawroomquestion(room={}):
+    """Next question off a room row's deck: ([question] or [], room columns to write)
+
+    The columns are deckid and deckpos; a reshuffle writes roomdeck itself,
+    so call it inside the transaction that writes the room.
+    """
+    deckid = room.get("deckid") or 0
+    cards = roomdeck(room["code"], deckid)
+    pos = room.get("deckpos") or 0
+    last = cards[pos - 1]["id"] if 0 < pos <= len(cards) and cards[pos - 1] is not None else ""
+    for dealt in (False, True):
+        while pos < len(cards):
+            card = cards[pos]
+            pos += 1
+            if card is not None:
+                return [dict(card)], {"deckid": deckid, "deckpos": pos}
+        if dealt:
+            break
+        # used up: the same questions again in a new order (a new deal when none are left)
+        ids = shuffledeck([card["id"] for card in cards if card is not None], last)
+        ids = ids or dealdeck(room.get("topic") or "", last)
+        deckid = saveroomdeck(room["code"], ids)
+        cards = roomdeck(room["code"], deckid)
+        pos = 0
+    return [], {"deckid": deckid, "deckpos": pos}
+
+# Difficulty
+# questions.difficulty is 1 (easy), 2 (medium) or 3 (hard). A game started
+# with a difficulty gets its deck from that level of its topic through
+# idx_questions_topic_difficulty; when the level has fewer questions than
+# the game wants, the fallback policy decides what fills the rest:
+#   nearest - the closest levels first (both neighbours of medium together)
+#   any     - the topic's other levels, all alike
+#   strict  - nothing, the game doesn't start
+# A topic without any questions draws from every topic, as before.
+questiondifficulties = {"easy": 1, "medium": 2, "hard": 3}
+questiondefaultdifficulty = 2
+ulardifficultyfallback = os.environ.get("ULAR_DIFFICULTY_FALLBACK", "nearest")
+ulardifficultyfallbacks = ("nearest", "any", "strict")
+
+def difficultylevel(value=""):
+    """1-3 from a level name or number, False when it is neither"""
+    value = str(value).strip().lower()
+    if value in questiondifficulties:
+        return questiondifficulties[value]
+    if value in ("1", "2", "3"):
+        return int(value)
+    return False
+
+def difficultyorder(difficulty=2, fallback="nearest"):
+    """Groups of levels to take questions from, in order"""
+    others = [l for l in questiondifficulties.values() if l != difficulty]
+    if fallback == "strict":
+        return [[difficulty]]
+    if fallback == "any":
+        return [[difficulty], others]
+    distances = sorted({abs(l - difficulty) for l in others})
+    return [[difficulty]] + [[l for l in others if abs(l - difficulty) == d] for d in distances]
+
+def modelselectquestions(topic="", count=None, difficulty=None, fallback=None):
+    """(shuffled ids, how they were picked) for one game; (None, error) when fallback is strict and short"""
+    count = ulardecksize if count is None else count
+    fallback = fallback or ulardifficultyfallback
+    picked = {"status": "ok", "requested": count, "difficulty": difficulty, "fallback": fallback}
+    counts = af_getdb(dbloc, "SELECT n FROM questioncounts WHERE topic = ?;", (topic,))
+    empty = not isinstance(counts, list) or counts == [] or counts[0]["n"] <= 0
+    if difficulty is not None and empty and fallback == "strict":
+        return None, {"status": "error", "message": f"No questions in {topic}, the game needs {count}"}
+    if difficulty is None or empty:
+        deck = dealdeck(topic, "", count)
+        picked.update(selected=len(deck), atlevel=None if difficulty is None else 0)
+        return deck, picked
+
+    ids = []
+    for n, levels in enumerate(difficultyorder(difficulty, fallback)):
+        query = f"SELECT id FROM questions WHERE topic = ? AND difficulty IN ({','.join('?' * len(levels))});"
+        data = af_getdb(dbloc, query, (topic,) + tuple(levels))
+        found = [r["id"] for r in data] if isinstance(data, list) else []
+        ids += random.sample(found, min(len(found), count - len(ids)))
+        if n == 0:
+            picked["atlevel"] = len(ids)
+        if len(ids) >= count:
+            break
+    picked["selected"] = len(ids)
+    if fallback == "strict" and len(ids) < count:
+        name = {v: k for k, v in questiondifficulties.items()}[difficulty]
+        return None, {"status": "error", "message": f"Only {len(ids)} {name} questions in {topic}, the game needs {count}"}
+    return shuffledeck(ids), picked
+
+def appendquestionid(ids="", id=""):
+    """JSON id list (players.questionget/questionright) with id added"""
+    try:
+        data = json.loads(ids) if ids else []
+    except ValueError:
+        data = []
+    return json.dumps(data + [id])
+
+def playerrecordright(code="", player={}, questionid=""):
+    """Add questionid to a player's questionright (player is its row, read in this transaction)"""
+    query = "UPDATE players SET questionright = ? WHERE code = ? AND player = ?;"
+    params = (appendquestionid(player.get("questionright"), questionid), code, player["player"])
+    af_getdb(roomdb(code), query, params)
+
+def modelwritequestion(id="", query="", params=()):
+    """Run a create/update/delete on questions and keep the bank cache in step"""
+    try:
+        with af_transaction(dbloc):
+            before = getmetaversion("questions")
+            result = af_getdb(dbloc, query, params)
+            after = getmetaversion("questions")
+    except sqlite3.Error as e:
+        # e.g. an id that is already taken; callers check af_rowcount
+        return f"An error occurred: {e.args[0]}"
+    if before is not None and after is not None and after != before:
+        questionbankchanged(before, after, [id])
+    return result
+
+def modelcreatequestion(id="", question="", a1="", a2="", a3="", a4="", answer="", topic="", difficulty=None):
+    query = f"""INSERT INTO questions (id, question, a1, a2, a3, a4, answer, topic, difficulty)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, {questiondefaultdifficulty}));"""
+    params = (id, question, a1, a2, a3, a4, answer, topic, difficulty)
+    result = modelwritequestion(id, query, params)
+    if af_rowcount(result) == 1:
+        modelindexquestions([dict(zip(questionfields, params))])
+    return result
+
+def modelupdatequestion(id="", question="", a1="", a2="", a3="", a4="", answer="", topic="", difficulty=None):
+    """difficulty None keeps the current one"""
+    query = """UPDATE questions 
+               SET question = ?, a1 = ?, a2 = ?, a3 = ?, a4 = ?, answer = ?, topic = ?,
+                   difficulty = COALESCE(?, difficulty)
+               WHERE id = ?;"""
+    params = (question, a1, a2, a3, a4, answer, topic, difficulty, id)
+    result = modelwritequestion(id, query, params)
+    if af_rowcount(result) == 1:
+        modelindexquestions([dict(zip(questionfields, params[-1:] + params[:-1]))])
+    return result
+
+def modeldeletequestion(id=""):
+    query = "DELETE FROM questions WHERE id = ?;"
+    params = (id,)
+    return modelwritequestion(id, query, params)
+
+# Bulk import/export
+# Rows are read from a stream one at a time, checked, and written in batches
+# of questionbatch with executemany, one transaction per batch so game writes
+# on dbloc only wait for a batch, not the whole file. Import yields progress
+# and per-row errors as it goes; export yields text chunks from af_iterdb.
+questionfields = ("id", "question", "a1", "a2", "a3", "a4", "answer", "topic", "difficulty")
+questionanswers = ("a1", "a2", "a3", "a4")
+questionbatch = 1000
+
+def readquestionlines(stream):
+    """Text lines from a binary (or text) stream, BOM dropped"""
+    first = True
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if first:
+            line = line.lstrip("\ufeff")
+            first = False
+        yield line
+
+def readquestioncsv(stream):
+    """(line number, row dict or error string) for each CSV record; the header names the columns"""
+    reader = csv.DictReader(readquestionlines(stream))
+    try:
+        for row in reader:
+            if None in row:
+                yield reader.line_num, "too many columns"
+                continue
+            yield reader.line_num, row
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num, f"unreadable CSV: {e}"
+
+def readquestionjsonl(stream):
+    """(line number, row dict or error string) for each non-empty JSONL line"""
+    for n, line in enumerate(readquestionlines(stream), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield n, f"invalid JSON: {e}"
+            continue
+        yield n, row if isinstance(row, dict) else "not a JSON object"
+
+def validatequestionrow(row={}):
+    """Row dict -> (params tuple in questionfields order, None) or (None, error)
+
+    difficulty may be missing (None: the default on insert, unchanged on update).
+    """
+    values = []
+    for field in questionfields:
+        value = row.get(field)
+        if field == "difficulty":
+            level = difficultylevel(value) if not inputnotvalidated(value) else None
+            if level is False:
+                return None, "difficulty must be easy, medium, hard or 1-3"
+            values.append(level)
+            continue
+        value = "" if value is None else str(value).strip()
+        if inputnotvalidated(value):
+            return None, f"{field} is not valid"
+        values.append(value)
+    answer = values[questionfields.index("answer")].lower()
+    if answer not in questionanswers:
+        return None, "answer must be one of a1, a2, a3, a4"
+    values[questionfields.index("answer")] = answer
+    return tuple(values), None
+
+def modelimportquestions(records=[], mode="insert", batch=questionbatch, dedup="flag"):
+    """Import (line, row) records; yields error, duplicate, progress and a final done event.
+
+    mode - insert: ids already in the table are errors; upsert: they are updated
+    dedup - flag: near duplicates are imported and reported; skip: they are left out; off
+    """
+    counts = {"read": 0, "inserted": 0, "updated": 0, "skipped": 0, "errors": 0}
+    pending = []
+
+    def flush():
+        ids = [params[0] for line, params in pending]
+        existing = set()
+        events = []
+        with af_transaction(dbloc):
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                data = af_getdb(dbloc, f"SELECT id FROM questions WHERE id IN ({marks});", tuple(chunk))
+                if isinstance(data, list):
+                    existing.update(r["id"] for r in data)
+            rows = pending
+            if mode != "upsert":
+                events += [{"type": "error", "line": line, "id": params[0], "message": "Question ID already exists"}
+                           for line, params in rows if params[0] in existing]
+                rows = [(line, params) for line, params in rows if params[0] not in existing]
+            if dedup != "off":
+                duplicates = modelfindduplicates([dict(zip(questionfields, params)) for line, params in rows])
+                events += [{"type": "duplicate", "line": line, "id": params[0], "of": duplicates[params[0]],
+                            "action": "skipped" if dedup == "skip" else "imported"}
+                           for line, params in rows if params[0] in duplicates]
+                if dedup == "skip":
+                    counts["skipped"] += len(duplicates)
+                    rows = [(line, params) for line, params in rows if params[0] not in duplicates]
+            inserts = [params for line, params in rows if params[0] not in existing]
+            updates = [params[1:] + params[:1] for line, params in rows if params[0] in existing]
+            if inserts:
+                query = f"""INSERT INTO questions (id, question, a1, a2, a3, a4, answer, topic, difficulty)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, {questiondefaultdifficulty}));"""
+                af_getdbmany(dbloc, query, inserts)
+            if updates:
+                query = """UPDATE questions SET question = ?, a1 = ?, a2 = ?, a3 = ?, a4 = ?, answer = ?, topic = ?,
+                           difficulty = COALESCE(?, difficulty) WHERE id = ?;"""
+                af_getdbmany(dbloc, query, updates)
+            modelindexquestions([dict(zip(questionfields, params)) for line, params in rows])
+        counts["inserted"] += len(inserts)
+        counts["updated"] += len(updates)
+        counts["errors"] += sum(1 for e in events if e["type"] == "error")
+        pending.clear()
+        return sorted(events, key=lambda e: e["line"])
+
+    seen = set()
+    try:
+        for line, row in records:
+            counts["read"] += 1
+            params, error = (None, row) if isinstance(row, str) else validatequestionrow(row)
+            if params is not None and params[0] in seen:
+                params, error = None, "duplicate id in this file"
+            if params is None:
+                counts["errors"] += 1
+                yield {"type": "error", "line": line, "id": row.get("id") if isinstance(row, dict) else None, "message": error}
+                continue
+            seen.add(params[0])
+            pending.append((line, params))
+            if len(pending) >= batch:
+                yield from flush()
+                yield dict(counts, type="progress")
+        if pending:
+            yield from flush()
+    except sqlite3.Error as e:
+        # this batch was rolled back, the ones before it stay
+        yield dict(counts, type="done", status="error", message=f"Import stopped: {e}")
+        return
+    yield dict(counts, type="done", status="ok")
+
+def modelexportquestions(fmt="csv", topic=""):
+    """The questions table as CSV or JSONL text chunks, streamed from the database"""
+    if topic:
+        rows = af_iterdb(dbloc, f"SELECT {', '.join(questionfields)} FROM questions WHERE topic = ? ORDER BY id;", (topic,))
+    else:
+        rows = af_iterdb(dbloc, f"SELECT {', '.join(questionfields)} FROM questions ORDER BY id;", ())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(questionfields)
+    for n, row in enumerate(rows, 1):
+        if fmt == "csv":
+            writer.writerow([row[f] for f in questionfields])
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+        if n % questionbatch == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+# Duplicate questions
+# questionsig keeps each question's content hash (normalized question and
+# answers), questionlsh its LSH band keys (utils/dedup_helper.py). A check
+# looks candidates up by hash and key through the indexes and confirms them
+# on the shingles, so it costs a few index lookups however big the bank is.
+# Triggers drop a question's rows when it is deleted or its text changes;
+# the model functions index new text, and the report backfills anything
+# written behind their back.
+# A band key shared by more than duplicatemaxbucket questions is boilerplate
+# (a template the bank uses a lot), not a sign of a duplicate, and is ignored.
+duplicatethreshold = float(os.environ.get("ULAR_DUPLICATE_THRESHOLD", "0.7"))
+duplicatemaxbucket = 50
+duplicatereportpairs = 20
+
+def questiontext(row={}):
+    """Normalized question followed by its answers in sorted order"""
+    answers = sorted(af_normalizetext(row.get(a, "")) for a in questionanswers)
+    return " ".join([af_normalizetext(row.get("question", ""))] + answers)
+
+def questionchunks(values=[], size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        chunk = values[start:start + size]
+        yield chunk, ",".join("?" * len(chunk))
+
+def modelindexquestions(rows=[], loc=None):
+    """(Re)write the hash and band keys of these question rows; joins the open transaction"""
+    loc = loc or dbloc
+    if not rows:
+        return
+    sigs = []
+    keys = []
+    for row in rows:
+        text = questiontext(row)
+        sigs.append((row["id"], af_contenthash([text])))
+        keys += [(key, row["id"]) for key in af_lshkeys(af_shingles(text))]
+    with af_transaction(loc):
+        af_getdbmany(loc, "DELETE FROM questionlsh WHERE id = ?;", [(row["id"],) for row in rows])
+        af_getdbmany(loc, "INSERT OR REPLACE INTO questionsig (id, contenthash) VALUES (?, ?);", sigs)
+        af_getdbmany(loc, "INSERT OR IGNORE INTO questionlsh (key, id) VALUES (?, ?);", keys)
+
+def modelfindduplicates(rows=[], threshold=None):
+    """{id: [{"id", "similarity", "exact"}]} for rows that look like a stored question or an earlier row"""
+    threshold = duplicatethreshold if threshold is None else threshold
+    prepared = []
+    for row in rows:
+        text = questiontext(row)
+        shingles = af_shingles(text)
+        prepared.append((row["id"], af_contenthash([text]), af_lshkeys(shingles), shingles))
+
+    # candidates from the table: same hash or any shared band key
+    byhash = {}
+    for chunk, marks in questionchunks({h for id, h, keys, sh in prepared}):
+        data = af_getdb(dbloc, f"SELECT id, contenthash FROM questionsig WHERE contenthash IN ({marks});", tuple(chunk))
+        for r in data if isinstance(data, list) else []:
+            byhash.setdefault(r["contenthash"], set()).add(r["id"])
+    bykey = {}
+    for chunk, marks in questionchunks({k for id, h, keys, sh in prepared for k in keys}):
+        query = f"""SELECT key, group_concat(id, char(31)) AS ids FROM questionlsh
+                    WHERE key IN ({marks}) GROUP BY key HAVING COUNT(*) <= ?;"""
+        data = af_getdb(dbloc, query, tuple(chunk) + (duplicatemaxbucket,))
+        for r in data if isinstance(data, list) else []:
+            bykey[r["key"]] = set(r["ids"].split("\x1f"))
+    stored = {}
+    wanted = {other for ids in list(byhash.values()) + list(bykey.values()) for other in ids}
+    for chunk, marks in questionchunks(wanted):
+        data = af_getdb(dbloc, f"SELECT * FROM questions WHERE id IN ({marks});", tuple(chunk))
+        for r in data if isinstance(data, list) else []:
+            text = questiontext(r)
+            stored[r["id"]] = (af_contenthash([text]), af_shingles(text))
+
+    # earlier rows of the same batch count as stored too
+    localhash = {}
+    localkey = {}
+    found = {}
+    for id, h, keys, shingles in prepared:
+        candidates = set(byhash.get(h, ())) | {o for k in keys for o in bykey.get(k, ())}
+        candidates |= set(localhash.get(h, ()))
+        candidates |= {o for k in keys if len(localkey.get(k, ())) <= duplicatemaxbucket for o in localkey.get(k, ())}
+        candidates.discard(id)
+        matches = []
+        for other in candidates:
+            if other not in stored:
+                continue
+            otherhash, othershingles = stored[other]
+            similarity = 1.0 if otherhash == h else af_jaccard(shingles, othershingles, threshold)
+            if similarity >= threshold:
+                matches.append({"id": other, "similarity": round(similarity, 3), "exact": otherhash == h})
+        if matches:
+            found[id] = sorted(matches, key=lambda m: -m["similarity"])[:5]
+        stored.setdefault(id, (h, shingles))
+        localhash.setdefault(h, set()).add(id)
+        for k in keys:
+            localkey.setdefault(k, set()).add(id)
+    return found
+
+def modelbackfillquestionindex(loc=None, batch=questionbatch):
+    """Index questions that have no questionsig row yet; returns how many"""
+    loc = loc or dbloc
+    query = "SELECT q.* FROM questions q LEFT JOIN questionsig s ON s.id = q.id WHERE s.id IS NULL;"
+    rows = list(af_iterdb(loc, query, ()))
+    for start in range(0, len(rows), batch):
+        modelindexquestions(rows[start:start + batch], loc)
+    return len(rows)
+
+def modelduplicatereport(threshold=None, limit=100, maxbucket=duplicatemaxbucket, pairlimit=duplicatereportpairs):
+    """Clusters of exact and near duplicate questions in the whole table
+
+    limit - groups listed; pairlimit - most similar pairs listed per group (paircount has them all)
+    """
+    threshold = duplicatethreshold if threshold is None else threshold
+    backfilled = modelbackfillquestionindex()
+
+    pairs = set()
+    query = "SELECT contenthash, group_concat(id, char(31)) AS ids FROM questionsig GROUP BY contenthash HAVING COUNT(*) > 1;"
+    for r in af_iterdb(dbloc, query, ()):
+        ids = sorted(r["ids"].split("\x1f"))
+        pairs.update((a, b) for n, a in enumerate(ids) for b in ids[n + 1:])
+    oversized = 0
+    query = "SELECT key, COUNT(*) AS n, group_concat(id, char(31)) AS ids FROM questionlsh GROUP BY key HAVING COUNT(*) > 1;"
+    for r in af_iterdb(dbloc, query, ()):
+        if r["n"] > maxbucket:
+            oversized += 1
+            continue
+        ids = sorted(r["ids"].split("\x1f"))
+        pairs.update((a, b) for n, a in enumerate(ids) for b in ids[n + 1:])
+
+    texts = {}
+    for chunk, marks in questionchunks({id for pair in pairs for id in pair}):
+        data = af_getdb(dbloc, f"SELECT * FROM questions WHERE id IN ({marks});", tuple(chunk))
+        for r in data if isinstance(data, list) else []:
+            text = questiontext(r)
+            texts[r["id"]] = (af_contenthash([text]), af_shingles(text), r["question"])
+
+    # union-find over the confirmed pairs
+    parent = {}
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+    confirmed = []
+    for a, b in pairs:
+        if a not in texts or b not in texts:
+            continue
+        exact = texts[a][0] == texts[b][0]
+        similarity = 1.0 if exact else af_jaccard(texts[a][1], texts[b][1], threshold)
+        if similarity >= threshold:
+            confirmed.append({"a": a, "b": b, "similarity": round(similarity, 3), "exact": exact})
+            parent[find(a)] = find(b)
+    clusters = {}
+    for pair in confirmed:
+        clusters.setdefault(find(pair["a"]), {"ids": set(), "pairs": []})
+        cluster = clusters[find(pair["a"])]
+        cluster["ids"].update((pair["a"], pair["b"]))
+        cluster["pairs"].append(pair)
+    ordered = sorted(clusters.values(), key=lambda c: (-len(c["ids"]), min(c["ids"])))
+    return {
+        "threshold": threshold,
+        "backfilled": backfilled,
+        "candidatepairs": len(pairs),
+        "duplicatepairs": len(confirmed),
+        "clusters": len(ordered),
+        "oversizedbuckets": oversized,
+        "groups": [{"ids": sorted(c["ids"]), "question": texts[min(c["ids"])][2], "paircount": len(c["pairs"]),
+                    "pairs": sorted(c["pairs"], key=lambda p: (-p["similarity"], p["a"], p["b"]))[:pairlimit]}
+                   for c in ordered[:limit]]
+    }
+
+# Question pages
+# Keyset pagination in natural id order (length, then id: "2" before "10"),
+# so every page is one index range scan however deep it is. The cursor is
+# the last row's key, base64 encoded; totals come from questioncounts.
+
+def encodequestioncursor(row={}):
+    key = json.dumps([len(row["id"]), row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decodequestioncursor(cursor=""):
+    """Cursor -> (length, id), None when it isn't one of ours"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        length, id = key
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(length, int) or not isinstance(id, str):
+        return None
+    return length, id
+
+def modelgetquestionpage(topic="", limit=50, after=None):
+    """One page of questions after the (length, id) key; returns (rows, next cursor or None)"""
+    topicwhere = "topic = ? AND " if topic else ""
+    topicparams = (topic,) if topic else ()
+    data = []
+    length = 0
+    if after is not None:
+        # sqlite won't bound an expression index with a row value, so the
+        # rest of the current length and the longer ids are two range scans
+        length, id = after
+        query = f"SELECT * FROM questions WHERE {topicwhere}length(id) = ? AND id > ? ORDER BY id LIMIT ?;"
+        data = af_getdb(dbloc, query, topicparams + (length, id, limit + 1))
+        if isinstance(data, str):
+            print(f"Question page failed: {data}")
+            return [], None
+    if len(data) <= limit:
+        query = f"SELECT * FROM questions WHERE {topicwhere}length(id) > ? ORDER BY length(id), id LIMIT ?;"
+        more = af_getdb(dbloc, query, topicparams + (length, limit + 1 - len(data)))
+        if isinstance(more, str):
+            print(f"Question page failed: {more}")
+            return [], None
+        data += more
+    if len(data) > limit:
+        return data[:limit], encodequestioncursor(data[limit - 1])
+    return data, None
+
+def modelquestioncount(topic=""):
+    if topic:
+        data = af_getdb(dbloc, "SELECT n FROM questioncounts WHERE topic = ?;", (topic,))
+    else:
+        data = af_getdb(dbloc, "SELECT COALESCE(SUM(n), 0) AS n FROM questioncounts;", ())
+    if isinstance(data, str) or data == []:
+        return 0
+    return data[0]["n"]
+
+# Question search
+# Every word of the search box is a prefix term ("newt" finds Newton), all
+# must match; bm25 ranks with the question text weighted over the answers.
+searchweights = "10.0, 2.0, 2.0, 2.0, 2.0"
+
+def searchmatch(text=""):
+    """Search box text -> FTS5 MATCH expression, None when there is nothing to search"""
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words[:16])
+
+def modelsearchquestions(text="", topic="", limit=20, offset=0):
+    match = searchmatch(text)
+    if match is None:
+        return []
+    query = f"""SELECT q.*, bm25(questions_fts, {searchweights}) AS rank,
+            snippet(questions_fts, -1, '[', ']', '…', 12) AS snippet
+        FROM questions_fts JOIN questions q ON q.rowid = questions_fts.rowid
+        WHERE questions_fts MATCH ?{" AND q.topic = ?" if topic else ""}
+        ORDER BY rank LIMIT ? OFFSET ?;"""
+    params = (match, topic, limit, offset) if topic else (match, limit, offset)
+    data = af_getdb(dbloc, query, params)
+    if isinstance(data, str):
+        print(f"Question search failed: {data}")
+        return []
+    return data
+
+def modelrebuildquestionsearch():
+    return af_getdb(dbloc, "INSERT INTO questions_fts (questions_fts) VALUES ('rebuild');", ())
 
 def submitanswer(id="", answer=""):
-    data = modelgetcsvquestion()
+    data = getquestion(id)
     
     for d in data:
         if d["id"] == id:
@@ -466,41 +1686,205 @@ def submitanswer(id="", answer=""):
         "message": "question not found"
     }
 
-def getendbystartladdersnake(start=0):
+def getmetaversion(key=""):
+    query = "SELECT value FROM meta WHERE key = ?;"
+    params = (key,)
+    data = af_getdb(dbloc,query,params)
+    if isinstance(data, str) or data == []:
+        return None
+    return data[0]["value"]
 
-    end = 0
-    data = modelgetcsvconf()
+# conf compiled into a list indexed by cell number: cells[start] = (end, "ladder"/"snake")
+# rebuilt only when meta 'conf' changes (conf triggers bump it, from any worker)
+conftable = {"version": None, "dbloc": None, "cells": []}
+conftablelock = threading.Lock()
+
+def buildconftable(data=[]):
+    starts = {}
     for d in data:
-        if d["start"] == str(start):
-            return int(d["end"])
-    return end
+        try:
+            start = int(d["start"])
+            end = int(d["end"])
+        except (TypeError, ValueError):
+            continue
+        if start < 0 or start in starts:
+            continue
+        starts[start] = (end, "snake" if start > end else "ladder")
 
-def getladdersnakeinfo(start=0):
+    cells = [None] * (max(starts) + 1 if starts else 0)
+    for start, info in starts.items():
+        cells[start] = info
+    return cells
 
-    ladderorsnake = ""
+def getconftable():
+    global conftable
+    version = getmetaversion("conf")
+    table = conftable
+    if version is None or version != table["version"] or table["dbloc"] != dbloc:
+        with conftablelock:
+            table = conftable
+            if version is None or version != table["version"] or table["dbloc"] != dbloc:
+                data = af_getdb(dbloc, "SELECT * FROM conf ORDER BY id;", ())
+                if isinstance(data, str):
+                    data = []
+                table = {"version": version, "dbloc": dbloc, "cells": buildconftable(data)}
+                conftable = table
+    return table["cells"]
 
-    end = 0
-    data = modelgetcsvconf()
-    for d in data:
-        if d["start"] == str(start):
-            end = int(d["end"])
-            if int(start) > int(end):
-                ladderorsnake = "snake"
-            else:
-                ladderorsnake = "ladder"
-            
-            return {
-                "end": end,
-                "ladderorsnake": ladderorsnake
-            }
+def getconfcell(start=0):
+    try:
+        start = int(start)
+    except (TypeError, ValueError):
+        return None
+    cells = getconftable()
+    if 0 <= start < len(cells):
+        return cells[start]
+    return None
+
+def getendbystartladdersnake(start=0):
+    cell = getconfcell(start)
+    if cell is None:
+        return 0
+    return cell[0]
+
+def getladdersnakeinfo(start=0):
+    cell = getconfcell(start)
+    if cell is None:
+        return {
+            "end": 0,
+            "ladderorsnake": ""
+        }
     return {
-        "end": end,
-        "ladderorsnake": ladderorsnake
+        "end": cell[0],
+        "ladderorsnake": cell[1]
     }
 
+# Board analytics (models/ularanalytics.py) for the admin endpoint.
+# The exact chain is cheap; the Monte Carlo part is capped at
+# boardanalyticsmaxgames simulated player-games per request (bigger runs go
+# through the CLI), runs one at a time, and its result is kept until meta
+# 'conf' moves, so asking again for the same board costs nothing.
+boardanalyticsmaxgames = int(os.environ.get("ULAR_ANALYTICS_MAXGAMES", "20000"))
+boardanalyticscachesize = 32
+boardanalyticscache = {"version": None, "dbloc": None, "results": {}}
+boardanalyticslock = threading.Lock()
+
+def modelboardanalytics(maxbox=28, accuracy=0.5, games=None, players=1):
+    """boardanalytics for the conf table, games capped to boardanalyticsmaxgames // players (ImportError without numpy)"""
+    global boardanalyticscache
+    from .ularanalytics import boardanalytics
+    cap = boardanalyticsmaxgames // players
+    games = cap if games is None else min(games, cap)
+    key = (maxbox, round(accuracy, 4), games, players)
+    with boardanalyticslock:
+        version = getmetaversion("conf")
+        cache = boardanalyticscache
+        if version is None or version != cache["version"] or cache["dbloc"] != dbloc:
+            cache = boardanalyticscache = {"version": version, "dbloc": dbloc, "results": {}}
+        result = cache["results"].get(key)
+        if result is None:
+            result = boardanalytics(modelgetcsvconf(), maxbox, accuracy, games, players)
+            if len(cache["results"]) >= boardanalyticscachesize:
+                cache["results"].pop(next(iter(cache["results"])))
+            cache["results"][key] = result
+    return result
+
 def endgame(code=""):
-    query = "UPDATE room SET state = ? WHERE code = ?;"
+    query = "UPDATE room SET state = ?, version = version + 1 WHERE code = ?;"
     params = ("ended", code,)
-    data = af_getdb(dbloc,query,params)
+    data = af_getdb(roomdb(code),query,params)
+    publishroomevent(code, "end", {})
     # new_data = {"state":"ended"}
-    # af_replacecsv2(roomcsv, "code", code, new_data)
\ No newline at end of file
+    # af_replacecsv2(roomcsv, "code", code, new_data)
+
+# Room reaper
+# Rooms nobody moved in for af_roomttl are ended through endgame (players get
+# the "end" event). Ended rooms older than af_archiveafter are copied, one row
+# per game with the players as JSON, to room_archive in af_archivedb, then
+# deleted from room/players; their codes are released once that delete
+# commits. Each step is guarded on room.updated, so a room that moved in
+# between is left alone.
+
+def initularchive():
+    archivedb = af_archiveinit()
+    af_getdb(archivedb, """CREATE TABLE IF NOT EXISTS room_archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        code TEXT,
+        topic TEXT,
+        updated REAL,
+        archived REAL,
+        room TEXT,
+        players TEXT,
+        UNIQUE (code, updated)
+    );""", ())
+
+def expireularrooms(cutoff=0.0, loc=None):
+    loc = loc or dbloc
+    query = "SELECT code, updated FROM room WHERE state IN ('waiting', 'playing') AND updated < ? LIMIT ?;"
+    data = af_getdb(loc, query, (cutoff, af_reapbatch))
+    if isinstance(data, str) or data == []:
+        return 0
+    reaped = 0
+    with af_transaction(loc):
+        for row in data:
+            room = modelgetroom(row["code"])
+            if room is not None and room["updated"] == row["updated"] and room["state"] != "ended":
+                endgame(row["code"])
+                reaped += 1
+    return reaped
+
+def archiveularrooms(cutoff=0.0, loc=None):
+    loc = loc or dbloc
+    query = "SELECT * FROM room WHERE state = 'ended' AND updated < ? ORDER BY updated LIMIT ?;"
+    rooms = af_getdb(loc, query, (cutoff, af_reapbatch))
+    if isinstance(rooms, str) or rooms == []:
+        return 0
+    codes = [r["code"] for r in rooms]
+    query = f"SELECT * FROM players WHERE code IN ({','.join('?' * len(codes))}) ORDER BY id;"
+    players = af_getdb(loc, query, tuple(codes))
+    if isinstance(players, str):
+        return 0
+    bycode = {}
+    for p in players:
+        bycode.setdefault(p["code"], []).append(p)
+
+    # archive first: if we die before the delete the next pass replaces the same rows
+    now = time.time()
+    with af_transaction(af_archivedb):
+        for r in rooms:
+            query = "INSERT OR REPLACE INTO room_archive (code, topic, updated, archived, room, players) VALUES (?,?,?,?,?,?);"
+            params = (r["code"], r["topic"], r["updated"], now, json.dumps(r), json.dumps(bycode.get(r["code"], [])))
+            af_getdb(af_archivedb, query, params)
+
+    archived = 0
+    with af_transaction(loc):
+        for r in rooms:
+            result = af_getdb(loc, "DELETE FROM room WHERE code = ? AND updated = ? AND state = 'ended';", (r["code"], r["updated"]))
+            if af_rowcount(result) == 1:
+                af_getdb(loc, "DELETE FROM players WHERE code = ?;", (r["code"],))
+                af_getdb(loc, "DELETE FROM roomdeck WHERE code = ?;", (r["code"],))
+                # the code is free only once the delete is committed
+                af_oncommit(loc, lambda code=r["code"]: af_releasecode(dbloc, "room", code))
+                archived += 1
+    return archived
+
+def reapularrooms():
+    """One reaper pass over the ular tables, returns counters for af_reaperstats"""
+    now = time.time()
+    counters = {"reaped": 0, "archived": 0, "bytesreclaimed": 0}
+    for loc in ulardbs():
+        while True:
+            n = expireularrooms(now - af_roomttl, loc)
+            counters["reaped"] += n
+            if n < af_reapbatch:
+                break
+        archived = 0
+        while True:
+            n = archiveularrooms(now - af_archiveafter, loc)
+            archived += n
+            if n < af_reapbatch:
+                break
+        counters["archived"] += archived
+        if archived:
+            counters["bytesreclaimed"] += af_incrementalvacuum(loc, af_vacuumpages)
+    return counters
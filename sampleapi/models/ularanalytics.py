@@ -0,0 +1,197 @@
+#models/ularanalytics.py
+# Board analytics: how long games on a given board (conf rows + maxbox) run.
+# Follows the real rules of rollturn/submitanswer:
+# - roll 1-6, overshooting maxbox bounces back (maxbox - (pos - maxbox))
+# - reaching maxbox exactly ends the game
+# - landing on a conf start asks a question; a ladder is climbed only on a
+#   right answer, a snake is slid only on a wrong one, then the turn passes
+# Players never interact, so one player's number of turns T says it all;
+# with k players the game ends at the first finisher (min of k copies of T).
+#
+# Needs NumPy (only this module and /api/admin/boardanalytics do).
+#
+#   python -m sampleapi.models.ularanalytics --accuracy 0.7 --games 1000000 --players 2
+#   python -m sampleapi.models.ularanalytics --conf "3:10,6:15,18:8" --maxbox 28
+import sys
+import json
+import argparse
+import numpy as np
+
+dicefaces = 6
+
+def boardcells(conf=[], maxbox=28):
+    """conf rows -> (kind, end) arrays indexed by square; kind 1 ladder, 2 snake"""
+    kind = np.zeros(maxbox + 1, dtype=np.int8)
+    end = np.arange(maxbox + 1, dtype=np.int64)
+    for row in conf:
+        try:
+            start, stop = int(row["start"]), int(row["end"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if not (0 < start < maxbox and 0 <= stop <= maxbox) or kind[start]:
+            continue  # same as getconftable: first row for a square wins
+        kind[start] = 2 if start > stop else 1  # like buildconftable, ignores the type column
+        end[start] = stop
+    return kind, end
+
+def bounce(pos, maxbox=28):
+    return np.where(pos > maxbox, 2 * maxbox - pos, pos)
+
+def transitionmatrix(conf=[], maxbox=28, accuracy=0.5):
+    """One turn's transition probabilities over squares 0..maxbox (maxbox absorbing)"""
+    kind, end = boardcells(conf, maxbox)
+    P = np.zeros((maxbox + 1, maxbox + 1))
+    for s in range(maxbox):
+        for d in range(1, dicefaces + 1):
+            n = int(bounce(np.int64(s + d), maxbox))
+            if n == maxbox or kind[n] == 0:
+                P[s, n] += 1 / dicefaces
+            else:
+                move = accuracy if kind[n] == 1 else 1 - accuracy
+                P[s, end[n]] += move / dicefaces
+                P[s, n] += (1 - move) / dicefaces
+    P[maxbox, maxbox] = 1.0
+    return P
+
+def exactturns(conf=[], maxbox=28, accuracy=0.5, players=1, tail=1e-9, maxturns=100000):
+    """Absorbing Markov chain: expected turns and the distribution of T from square 0"""
+    P = transitionmatrix(conf, maxbox, accuracy)
+    Q = P[:maxbox, :maxbox]
+    I = np.eye(maxbox)
+    try:
+        expected = np.linalg.solve(I - Q, np.ones(maxbox))
+    except np.linalg.LinAlgError:
+        return {"error": "the top square can't be reached on this board"}
+
+    # survival S(t) = P(T > t), stepped until the tail is negligible
+    dist = np.zeros(maxbox)
+    dist[0] = 1.0
+    survival = [1.0]
+    while survival[-1] > tail and len(survival) <= maxturns:
+        dist = dist @ Q
+        survival.append(dist.sum())
+    survival = np.array(survival)
+    pmf = -np.diff(survival)  # pmf[t-1] = P(T = t)
+    # E[T^2] = sum over t >= 0 of (2t + 1) P(T > t)
+    variance = float(((2 * np.arange(len(survival)) + 1) * survival).sum() - expected[0] ** 2)
+
+    result = {
+        "expected": round(float(expected[0]), 4),
+        "std": round(variance ** 0.5, 4) if variance > 0 else 0.0,
+        "percentiles": percentilesfromsurvival(survival),
+        "pmf": [round(float(p), 6) for p in pmf[:200]],
+        "expectedfrom": [round(float(e), 3) for e in expected]
+    }
+    if players > 1:
+        result["game"] = gamelength(survival, players)
+    return result
+
+def percentilesfromsurvival(survival, pcts=(50, 90, 95, 99)):
+    cdf = 1 - survival
+    return {f"p{p}": int(np.searchsorted(cdf, p / 100)) for p in pcts}
+
+def gamelength(survival, players=2):
+    """Rounds until the first of `players` finishes, and each seat's chance to win"""
+    s = np.append(survival, 0.0)
+    gamesurvival = s ** players
+    pmf = s[:-1] - s[1:]  # P(T = t) for t = 1..
+    # seat i wins in round t: T_i = t, earlier seats T > t, later seats T >= t
+    wins = [float((pmf * s[1:] ** i * s[:-1] ** (players - 1 - i)).sum()) for i in range(players)]
+    return {
+        "expectedrounds": round(float(gamesurvival[:-1].sum()), 4),
+        "percentiles": percentilesfromsurvival(gamesurvival[:-1]),
+        "seatwins": [round(w, 4) for w in wins]
+    }
+
+def simulate(conf=[], maxbox=28, accuracy=0.5, games=100000, players=1, seed=None, maxturns=10000, chunk=1000000):
+    """Monte Carlo: play `games` games of `players` players in NumPy batches"""
+    kind, end = boardcells(conf, maxbox)
+    rng = np.random.default_rng(seed)
+    total = games * players
+    turns = np.full(total, maxturns, dtype=np.int64)
+    for start in range(0, total, chunk):
+        size = min(chunk, total - start)
+        pos = np.zeros(size, dtype=np.int64)
+        done = np.full(size, -1, dtype=np.int64)
+        live = np.arange(size)
+        for turn in range(1, maxturns + 1):
+            p = bounce(pos[live] + rng.integers(1, dicefaces + 1, size=live.size), maxbox)
+            k = kind[p]
+            right = rng.random(live.size) < accuracy
+            jump = ((k == 1) & right) | ((k == 2) & ~right)
+            p = np.where(jump & (p != maxbox), end[p], p)
+            pos[live] = p
+            finished = p == maxbox
+            done[live[finished]] = turn
+            live = live[~finished]
+            if live.size == 0:
+                break
+        done[done < 0] = maxturns
+        turns[start:start + size] = done
+
+    result = summarize(turns)
+    if players > 1:
+        pergame = turns.reshape(games, players)
+        result["game"] = summarize(pergame.min(axis=1))
+        # argmin picks the earliest seat on a tie, and earlier seats move first
+        result["game"]["seatwins"] = [round(float(w), 4) for w in np.bincount(pergame.argmin(axis=1), minlength=players) / games]
+    result["games"] = games
+    result["unfinished"] = int((turns >= maxturns).sum())
+    return result
+
+def summarize(turns):
+    return {
+        "expected": round(float(turns.mean()), 4),
+        "std": round(float(turns.std()), 4),
+        "percentiles": {f"p{p}": int(np.percentile(turns, p, method="inverted_cdf")) for p in (50, 90, 95, 99)},
+        "histogram": np.bincount(turns, minlength=1)[1:201].tolist()
+    }
+
+def boardanalytics(conf=[], maxbox=28, accuracy=0.5, games=100000, players=1, seed=None):
+    """Exact chain plus Monte Carlo for one board, the payload of the CLI and admin endpoint"""
+    result = {
+        "maxbox": maxbox,
+        "accuracy": accuracy,
+        "players": players,
+        "exact": exactturns(conf, maxbox, accuracy, players)
+    }
+    if games > 0:
+        result["simulated"] = simulate(conf, maxbox, accuracy, games, players, seed)
+    return result
+
+def parseconf(text=""):
+    """Conf rows from "3:10,18:8" (end above start is a ladder)"""
+    rows = []
+    for pair in filter(None, text.split(",")):
+        start, end = pair.split(":")
+        rows.append({"start": start, "end": end, "type": "ladder" if int(end) > int(start) else "snake"})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="expected game length for a ular board")
+    parser.add_argument("--maxbox", type=int, default=28)
+    parser.add_argument("--accuracy", type=float, default=0.5, help="chance a question is answered right")
+    parser.add_argument("--games", type=int, default=100000, help="simulated games, 0 for exact only")
+    parser.add_argument("--players", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--conf", default=None, help="start:end pairs, default is the conf table")
+    parser.add_argument("--full", action="store_true", help="include pmf/histogram arrays")
+    args = parser.parse_args()
+
+    if args.conf is None:
+        from . import ular
+        conf = ular.modelgetcsvconf()
+    else:
+        conf = parseconf(args.conf)
+    if args.maxbox < dicefaces:
+        sys.exit(f"maxbox must be at least {dicefaces}")
+    result = boardanalytics(conf, args.maxbox, args.accuracy, args.games, args.players, args.seed)
+    if not args.full:
+        result["exact"].pop("pmf", None)
+        result["exact"].pop("expectedfrom", None)
+        result.get("simulated", {}).pop("histogram", None)
+        result.get("simulated", {}).get("game", {}).pop("histogram", None)
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
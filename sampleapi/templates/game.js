@@ -762,11 +762,50 @@ function reset() {
 }
 
 let refreshInterval = null;
+let roomEvents = null;
+
+// room events from /api/ular/events; any of them means the state changed
+const roomEventTypes = ["hello", "resync", "join", "start", "roll", "question", "select", "answer", "turn", "end"];
 
 function startAutoRefresh() {
-    if (refreshInterval === null) {
-        refreshInterval = setInterval(refreshgame, 1000);
+    if (window.EventSource) {
+        startRoomEvents();
+    }
+    else {
+        startPolling(1000);
+    }
+}
+
+function startPolling(interval) {
+    if (refreshInterval !== null) {
+        clearInterval(refreshInterval);
     }
+    refreshInterval = setInterval(refreshgame, interval);
+}
+
+function startRoomEvents() {
+    if (roomEvents !== null) return;
+    const code = document.getElementById("statecode").value;
+    roomEvents = new EventSource(`/api/ular/events?code=${encodeURIComponent(code)}`);
+    roomEventTypes.forEach(type => {
+        roomEvents.addEventListener(type, () => {
+            refreshgame();
+            if (type == "end") {
+                stopAutoRefresh();
+            }
+        });
+    });
+    roomEvents.onopen = () => {
+        // events drive the refresh now, keep a slow poll as a safety net
+        startPolling(10000);
+    };
+    roomEvents.onerror = () => {
+        // the browser reconnects with Last-Event-ID, poll meanwhile
+        startPolling(1000);
+        if (roomEvents !== null && roomEvents.readyState === EventSource.CLOSED) {
+            roomEvents = null;
+        }
+    };
 }
 
 function stopAutoRefresh() {
@@ -774,4 +813,8 @@ function stopAutoRefresh() {
         clearInterval(refreshInterval);
         refreshInterval = null;
     }
+    if (roomEvents !== null) {
+        roomEvents.close();
+        roomEvents = null;
+    }
 }
\ No newline at end of file
@@ -0,0 +1,34 @@
+#tests/conftest.py
+# Run from the app root (the directory that holds sampleapi/):
+#   python -m pytest sampleapi/tests -q
+import os
+import sys
+import pytest
+
+# no reaper thread and no shared metrics files while testing
+os.environ.setdefault("AF_REAPER_INTERVAL", "0")
+os.environ.setdefault("AF_METRICS_DIR", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+@pytest.fixture
+def ular(tmp_path, monkeypatch):
+    """models/ular.py pointed at a fresh database in tmp_path (sample conf and questions)"""
+    from sampleapi.benchmarks.benchutil import makeulardb
+    from sampleapi.models import ular
+    from sampleapi.utils import reaper_helper
+    archivedb = str(tmp_path / "archive.db")
+    monkeypatch.setattr(reaper_helper, "af_archivedb", archivedb)
+    monkeypatch.setattr(ular, "af_archivedb", archivedb)
+    makeulardb(folder=str(tmp_path))
+    return ular
+
+@pytest.fixture
+def client(ular):
+    """Flask test client with the ular blueprints on the ular fixture's database"""
+    from flask import Flask
+    from sampleapi.controllers.ular import ular_blueprint
+    from sampleapi.controllers.ularquestions import ularq_blueprint
+    app = Flask(__name__)
+    app.register_blueprint(ular_blueprint)
+    app.register_blueprint(ularq_blueprint)
+    return app.test_client()
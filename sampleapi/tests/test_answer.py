@@ -0,0 +1,53 @@
+#tests/test_answer.py
+# submitanswer: the answer, move and turn change apply once, however many submits race.
+import threading
+from sampleapi.benchmarks.benchutil import addliveroom
+from sampleapi.controllers import ularquestions
+
+def questionroom(ular, monkeypatch, code="ANSR"):
+    """Started room of three where p0 rolled onto the ladder at 3 and has to answer"""
+    addliveroom(code, players=3, topic="fizik", state="waiting")
+    assert ular.startroom(code)["status"] == "ok"
+    with monkeypatch.context() as m:
+        m.setattr(ular.random, "randint", lambda a, b: 3)
+        rolled = ular.rollturn(code, "p0")
+    assert rolled["questionid"] != ""
+    return code, ular.getquestion(rolled["questionid"])[0]["answer"]
+
+def test_concurrent_submits_apply_once(ular, client, monkeypatch):
+    code, answer = questionroom(ular, monkeypatch)
+    url = f"/api/ular/submitanswer?code={code}&player=p0&answer={answer}"
+    submits = 6
+    barrier = threading.Barrier(submits)
+    results = []
+    # every submit reads the room before any of them writes
+    read = ularquestions.roomdata
+    def roomdata(code=""):
+        data = read(code)
+        barrier.wait(timeout=10)
+        return data
+    monkeypatch.setattr(ularquestions, "roomdata", roomdata)
+
+    def submit():
+        c = client.application.test_client()
+        results.append(c.get(url).get_json())
+
+    threads = [threading.Thread(target=submit) for _ in range(submits)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [r["status"] for r in results].count("ok") == 1
+    assert all(r["message"] == "No question available!" for r in results if r["status"] != "ok")
+    room = ular.modelgetroom(code)
+    # one ladder climb and one turn change, not one per submit
+    assert room["turn"] == "p1"
+    assert room["questionid"] == ""
+    assert ular.playerdata(code, "p0")[0]["pos"] == ular.getendbystartladdersnake(3)
+
+def test_submit_out_of_turn(ular, client, monkeypatch):
+    code, answer = questionroom(ular, monkeypatch)
+    result = client.get(f"/api/ular/submitanswer?code={code}&player=p1&answer={answer}").get_json()
+    assert result == {"status": "error", "message": "It is not your turn!"}
+    assert ular.modelgetroom(code)["questionid"] != ""
@@ -0,0 +1,57 @@
+#tests/test_deck.py
+# Per-room question decks: no repeats until the deck is used up, kept off the room row.
+from sampleapi.benchmarks.benchutil import addliveroom
+
+def startedroom(ular, code="DECK", topic="fizik"):
+    addliveroom(code, players=2, topic=topic, state="waiting")
+    assert ular.startroom(code)["status"] == "ok"
+    return code
+
+def draw(ular, code, n):
+    """n draws, writing the deck position back like rollturn does"""
+    ids = []
+    for _ in range(n):
+        room = ular.modelgetroom(code)
+        question, deck = ular.drawroomquestion(room)
+        ular.af_getdb(ular.roomdb(code), "UPDATE room SET deckid = ?, deckpos = ? WHERE code = ?;",
+                      (deck["deckid"], deck["deckpos"], code))
+        ids.append(question[0]["id"])
+    return ids
+
+def test_no_repeats_until_the_deck_is_used_up(ular):
+    code = startedroom(ular)
+    first = draw(ular, code, 4)
+    assert sorted(first) == ["1", "2", "3", "4"]
+    # then the same questions in a new order, not opening with the last one
+    second = draw(ular, code, 4)
+    assert sorted(second) == ["1", "2", "3", "4"]
+    assert second[0] != first[-1]
+
+def test_deck_lives_off_the_room_row(ular):
+    code = startedroom(ular)
+    room = ular.modelgetroom(code)
+    assert "deck" not in room
+    stored = ular.af_getdb(ular.roomdb(code), "SELECT deckid, deck FROM roomdeck WHERE code = ?;", (code,))
+    assert stored[0]["deckid"] == room["deckid"]
+
+    # a worker that never saw the deal reads the same order from roomdeck
+    dealt = [card["id"] for card in ular.roomdeck(code, room["deckid"])]
+    ular.roomdecks.clear()
+    assert [card["id"] for card in ular.roomdeck(code, room["deckid"])] == dealt
+    assert draw(ular, code, 4) == dealt
+
+def test_deleted_questions_are_skipped(ular):
+    code = startedroom(ular)
+    dealt = [card["id"] for card in ular.roomdeck(code, ular.modelgetroom(code)["deckid"])]
+    ular.modeldeletequestion(dealt[1])
+    ular.roomdecks.clear()
+    assert draw(ular, code, 3) == [dealt[0]] + dealt[2:]
+
+def test_rolls_record_drawn_questions(ular, monkeypatch):
+    code = startedroom(ular)
+    # the first ladder/snake square is a question square
+    square = next(n for n in range(1, 7) if ular.getendbystartladdersnake(n) != 0)
+    monkeypatch.setattr(ular.random, "randint", lambda a, b: square)
+    result = ular.rollturn(code, "p0")
+    assert result["questionid"] != ""
+    assert ular.json.loads(ular.playerdata(code, "p0")[0]["questionget"]) == [result["questionid"]]
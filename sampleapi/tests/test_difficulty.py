@@ -0,0 +1,60 @@
+#tests/test_difficulty.py
+# Difficulty-aware decks: the level first, then the fallback policy fills the rest.
+import pytest
+from sampleapi.benchmarks.benchutil import addliveroom
+
+@pytest.fixture
+def kimia(ular):
+    """kimia topic with 3 easy, 2 medium and 4 hard questions"""
+    for level, n in ((1, 3), (2, 2), (3, 4)):
+        for i in range(n):
+            ular.modelcreatequestion(f"k{level}{i}", f"Kimia question {level} {i}?", "a", "b", "c", "d", "a1", "kimia", level)
+    return ular
+
+def levels(ular, ids):
+    return sorted(ular.af_getdb(ular.dbloc, f"SELECT difficulty FROM questions WHERE id IN ({','.join('?' * len(ids))});",
+                                tuple(ids)), key=lambda r: r["difficulty"])
+
+def test_levels_and_order(ular):
+    assert [ular.difficultylevel(v) for v in ("easy", " Hard ", "2", "4", "")] == [1, 3, 2, False, False]
+    assert ular.difficultyorder(1, "nearest") == [[1], [2], [3]]
+    assert ular.difficultyorder(2, "nearest") == [[2], [1, 3]]
+    assert ular.difficultyorder(1, "any") == [[1], [2, 3]]
+    assert ular.difficultyorder(3, "strict") == [[3]]
+
+def test_nearest_fills_from_the_closest_level(kimia):
+    ids, picked = kimia.modelselectquestions("kimia", 5, 1, "nearest")
+    assert len(set(ids)) == 5
+    assert [r["difficulty"] for r in levels(kimia, ids)] == [1, 1, 1, 2, 2]
+    assert (picked["atlevel"], picked["selected"]) == (3, 5)
+
+def test_any_and_strict(kimia):
+    ids, picked = kimia.modelselectquestions("kimia", 6, 1, "any")
+    assert len(set(ids)) == 6 and picked["atlevel"] == 3
+
+    ids, error = kimia.modelselectquestions("kimia", 5, 1, "strict")
+    assert ids is None
+    assert error == {"status": "error", "message": "Only 3 easy questions in kimia, the game needs 5"}
+    ids, picked = kimia.modelselectquestions("kimia", 4, 3, "strict")
+    assert [r["difficulty"] for r in levels(kimia, ids)] == [3, 3, 3, 3]
+
+def test_empty_topic(kimia):
+    ids, error = kimia.modelselectquestions("nothing", 3, 2, "strict")
+    assert ids is None and error["message"] == "No questions in nothing, the game needs 3"
+    # otherwise a topic without questions draws from every topic
+    ids, picked = kimia.modelselectquestions("nothing", 3, 2, "nearest")
+    assert len(ids) == 3 and picked["atlevel"] == 0
+
+def test_startroom_deals_the_selection_once(kimia):
+    addliveroom("DIFF", players=2, topic="kimia", state="waiting")
+    picked = kimia.startroom("DIFF", 4, 3, "strict")
+    assert picked["status"] == "ok" and picked["selected"] == 4
+    deck = kimia.roomdeck("DIFF", kimia.modelgetroom("DIFF")["deckid"])
+    assert sorted(card["id"] for card in deck) == ["k30", "k31", "k32", "k33"]
+    # a second start doesn't re-deal the game
+    assert kimia.startroom("DIFF", 4, 1) == {"status": "error", "message": "room already started"}
+    assert kimia.roomdeck("DIFF", kimia.modelgetroom("DIFF")["deckid"]) == deck
+
+    addliveroom("HARD", players=2, topic="kimia", state="waiting")
+    assert kimia.startroom("HARD", 5, 1, "strict")["status"] == "error"
+    assert kimia.modelgetroom("HARD")["state"] == "waiting"
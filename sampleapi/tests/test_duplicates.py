@@ -0,0 +1,61 @@
+#tests/test_duplicates.py
+# Duplicate questions: exact and near copies are found through the index, on import and in the report.
+from sampleapi.utils.dedup_helper import af_normalizetext, af_shingles, af_jaccard
+
+force = {"id": "1", "question": "What is the formula for force?",
+         "a1": "F=ma", "a2": "F=mv", "a3": "F=mgh", "a4": "F=1/2mv^2", "answer": "a1", "topic": "fizik"}
+
+def row(id="", question="", answers=("one", "two", "three", "four"), topic="kimia"):
+    return dict(zip(("id", "question", "a1", "a2", "a3", "a4"), (id, question) + tuple(answers)),
+                answer="a1", topic=topic)
+
+long = "Which gas do plants take in from the air to make glucose during photosynthesis in their leaves?"
+
+def test_normalize_and_similarity():
+    assert af_normalizetext("  Café, CAFÉ!  ") == "cafe cafe"
+    same = af_shingles(af_normalizetext(long))
+    near = af_shingles(af_normalizetext(long.replace("their leaves", "the leaves")))
+    assert af_jaccard(same, same) == 1.0
+    assert 0.7 <= af_jaccard(same, near) < 1.0
+    assert af_jaccard(same, af_shingles("something else entirely")) < 0.2
+
+def test_find_exact_and_near_duplicates(ular):
+    shuffled = dict(force, id="x1", question="what is the FORMULA for force", a1="F=mgh", a3="F=ma")
+    near = row("x2", long.replace("their leaves", "the leaves"))
+    fresh = row("x3", "How many legs does a spider have?")
+    ular.modelcreatequestion(**row("k1", long))
+    found = ular.modelfindduplicates([shuffled, near, fresh])
+    # case, punctuation and answer order don't matter
+    assert found["x1"] == [{"id": "1", "similarity": 1.0, "exact": True}]
+    assert found["x2"][0]["id"] == "k1" and not found["x2"][0]["exact"]
+    assert "x3" not in found
+    # an earlier row of the same batch counts too
+    assert ular.modelfindduplicates([fresh, dict(fresh, id="x4")])["x4"][0]["id"] == "x3"
+
+def test_import_flags_or_skips_duplicates(ular):
+    records = [(1, dict(force, id="c1")), (2, row("c2", "How many legs does a spider have?"))]
+    events = list(ular.modelimportquestions(records, dedup="skip"))
+    done = events[-1]
+    assert (done["inserted"], done["skipped"]) == (1, 1)
+    assert [e for e in events if e["type"] == "duplicate"][0]["action"] == "skipped"
+    assert ular.modelquestioncount("fizik") == 4
+
+    records = [(1, dict(force, id="c3"))]
+    events = list(ular.modelimportquestions(records, dedup="flag"))
+    assert events[-1]["inserted"] == 1
+    assert events[0]["type"] == "duplicate" and events[0]["action"] == "imported"
+
+def test_report_groups_and_caps_pairs(ular):
+    for n in range(4):
+        ular.modelcreatequestion(**dict(force, id=f"d{n}"))
+    report = ular.modelduplicatereport(pairlimit=2)
+    group = [g for g in report["groups"] if "1" in g["ids"]][0]
+    assert group["ids"] == ["1", "d0", "d1", "d2", "d3"]
+    assert group["paircount"] == 10
+    assert len(group["pairs"]) == 2
+
+    # deleting copies drops them from the index
+    for n in range(4):
+        ular.modeldeletequestion(f"d{n}")
+    report = ular.modelduplicatereport()
+    assert not [g for g in report["groups"] if "1" in g["ids"]]
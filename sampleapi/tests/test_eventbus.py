@@ -0,0 +1,98 @@
+#tests/test_eventbus.py
+# The events table bus across processes: subscriber processes follow one
+# channel while publisher processes write to it; each subscriber has to see
+# every event exactly once and in id order.
+import os
+import time
+import sqlite3
+import threading
+import multiprocessing
+from sampleapi.utils import event_helper
+from sampleapi.utils.db_helper import af_ensuredb, af_txstats
+
+subscribers = 3
+publishers = 3
+perpublisher = 40
+channel = "room:BUS"
+
+def subscribe(path, expected, ready, results):
+    event_helper.af_eventsinit(path)
+    event_helper.af_channel(channel)
+    ready.wait()
+    seen = []
+    cursor = 0
+    deadline = time.time() + 60
+    while len(seen) < expected and time.time() < deadline:
+        events, complete = event_helper.af_waitevents(channel, cursor, timeout=1)
+        for event in events:
+            seen.append((event["id"], event["data"]["pid"], event["data"]["n"]))
+            cursor = event["id"]
+    results.put(seen)
+
+def publish(path, start):
+    event_helper.af_eventsinit(path)
+    start.wait()
+    for n in range(perpublisher):
+        event_helper.af_publish(channel, "roll", {"pid": os.getpid(), "n": n})
+
+def test_events_reach_every_process_once_in_order(tmp_path):
+    path = str(tmp_path / "events.db")
+    sqlite3.connect(path).close()
+    event_helper.af_eventsinit(path)
+    expected = publishers * perpublisher
+
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(subscribers + 1)
+    start = ctx.Event()
+    results = ctx.Queue()
+    subs = [ctx.Process(target=subscribe, args=(path, expected, ready, results)) for _ in range(subscribers)]
+    pubs = [ctx.Process(target=publish, args=(path, start)) for _ in range(publishers)]
+    for p in subs:
+        p.start()
+    ready.wait(timeout=60)
+    for p in pubs:
+        p.start()
+    start.set()
+    for p in pubs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+
+    received = [results.get(timeout=90) for _ in subs]
+    for p in subs:
+        p.join(timeout=30)
+
+    stored = sqlite3.connect(path).execute("SELECT id FROM events WHERE channel = ? ORDER BY id;", (channel,)).fetchall()
+    assert len(stored) == expected
+    for seen in received:
+        ids = [id for id, pid, n in seen]
+        # delivery: every stored event, uniqueness: none twice, ordering: by id
+        assert ids == [id for (id,) in stored]
+        # and each publisher's events arrive in the order it sent them
+        bypid = {}
+        for id, pid, n in seen:
+            bypid.setdefault(pid, []).append(n)
+        assert sorted(bypid.values()) == [list(range(perpublisher))] * publishers
+
+def test_idle_wait_blocks_without_polling_the_table(tmp_path):
+    path = af_ensuredb(str(tmp_path / "idle.db"))
+    event_helper.af_eventsinit(path)
+    event_helper.af_publish(channel, "join", {})
+    event_helper.af_publish("room:OTHER", "join", {})
+    # like a fresh SSE client: the channel is new, its cursor is the channel's last event
+    watcher = event_helper.af_eventswatcher(path)
+    while watcher.lastid < 2:
+        time.sleep(0.01)
+    cursor = event_helper.af_lasteventid(channel)
+    assert cursor < event_helper.af_channel(channel).since
+
+    before = af_txstats()["queries"]
+    events, complete = event_helper.af_waitevents(channel, cursor, timeout=1)
+    assert (events, complete) == ([], True)
+    # one look at the table, then it sleeps on the buffer
+    assert af_txstats()["queries"] - before <= 3
+
+    publisher = threading.Timer(0.2, event_helper.af_publish, (channel, "roll", {"n": 1}))
+    publisher.start()
+    events, complete = event_helper.af_waitevents(channel, cursor, timeout=5)
+    publisher.join()
+    assert [e["data"] for e in events] == [{"n": 1}]
@@ -0,0 +1,40 @@
+#tests/test_profile.py
+# The sampler only wakes up while a profiled request is running.
+import time
+import types
+import pytest
+from flask import Flask
+from sampleapi.utils import profile_helper
+
+@pytest.fixture
+def profiler(monkeypatch):
+    """A fresh sampler whose sleeps are counted, and an app profiling every request with the token"""
+    sleeps = []
+    clock = types.SimpleNamespace(time=time.time, sleep=lambda s: (sleeps.append(s), time.sleep(s)))
+    monkeypatch.setattr(profile_helper, "time", clock)
+    monkeypatch.setattr(profile_helper, "af_profiletoken", "secret")
+    monkeypatch.setattr(profile_helper, "af_profilewindows", {})
+    monkeypatch.setattr(profile_helper, "af_profileactive", profile_helper.threading.Event())
+    monkeypatch.setattr(profile_helper, "af_profiler", None)
+    app = Flask(__name__)
+    app.before_request(profile_helper.af_profilerequeststart)
+    app.teardown_request(profile_helper.af_profilerequestend)
+
+    @app.route("/slow")
+    def slow():
+        time.sleep(0.2)
+        return "ok"
+    return app.test_client(), sleeps
+
+def test_sampler_sleeps_while_idle(profiler):
+    client, sleeps = profiler
+    assert client.get("/slow", headers={"X-Profile": "secret"}).data == b"ok"
+    assert profile_helper.af_profile(route="/slow")["samples"] > 0
+    assert not profile_helper.af_profileactive.is_set()
+
+    time.sleep(0.05)
+    idle = len(sleeps)
+    # a request that isn't profiled doesn't wake the sampler either
+    client.get("/slow")
+    time.sleep(0.2)
+    assert len(sleeps) <= idle + 1
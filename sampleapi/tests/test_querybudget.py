@@ -0,0 +1,29 @@
+#tests/test_querybudget.py
+# The game endpoints a client hits every turn stay within AF_DB_QUERYBUDGET.
+from sampleapi.utils import db_helper
+
+def playturns(ular, client, monkeypatch):
+    """Two players through a game: join, start, poll, roll onto a question, answer it"""
+    code = client.get("/api/ular/createroom?player=p0&topic=fizik").get_json()["code"]
+    client.get(f"/api/ular/joinroom?code={code}&player=p1")
+    client.get(f"/api/ular/startgame?code={code}")
+    client.get(f"/api/ular/state?code={code}")
+    # 3 is the foot of a ladder, so the roll brings up a question
+    monkeypatch.setattr(ular.random, "randint", lambda a, b: 3)
+    rolled = client.get(f"/api/ular/rolldice?code={code}&player=p0").get_json()
+    assert rolled["status"] == "ok" and rolled["question"]
+    client.get(f"/api/ular/state?code={code}&since=0&delta=1")
+    answer = ular.getquestion(ular.modelgetroom(code)["questionid"])[0]["answer"]
+    client.get(f"/api/ular/selectanswer?code={code}&player=p0&answer={answer}")
+    assert client.get(f"/api/ular/submitanswer?code={code}&player=p0&answer={answer}").get_json()["status"] == "ok"
+    client.get(f"/api/ular/rolldice?code={code}&player=p1")
+    client.get(f"/api/ular/state?code={code}")
+
+def test_game_endpoints_within_budget(ular, client, monkeypatch):
+    monkeypatch.setattr(db_helper, "af_routestatsdata", {})
+    playturns(ular, client, monkeypatch)
+    routes = db_helper.af_routestats()
+    for route in ("/api/ular/createroom", "/api/ular/joinroom", "/api/ular/startgame", "/api/ular/state",
+                  "/api/ular/rolldice", "/api/ular/selectanswer", "/api/ular/submitanswer"):
+        assert routes[route]["maxqueries"] <= db_helper.af_querybudget, route
+        assert routes[route]["overbudget"] == 0, route
@@ -0,0 +1,46 @@
+#tests/test_questionpage.py
+# Keyset pages of the admin question list, in (length(id), id) order so "9" comes before "10".
+
+def addquestions(ular, first, last, topic="fizik"):
+    for n in range(first, last + 1):
+        ular.modelcreatequestion(str(n), f"Sample question number {n} about {topic}?", "w", "x", "y", "z", "a1", topic)
+
+def pages(ular, topic="", limit=3):
+    """Every page from the start, following the cursors"""
+    result = []
+    after = None
+    while True:
+        rows, cursor = ular.modelgetquestionpage(topic, limit, after)
+        result.append([q["id"] for q in rows])
+        if cursor is None:
+            return result
+        after = ular.decodequestioncursor(cursor)
+
+def test_pages_follow_numeric_id_order(ular):
+    addquestions(ular, 9, 12)
+    got = pages(ular, limit=3)
+    # q9 -> q10 sits inside a page, q8 -> q9 and q11 -> q12 across page boundaries
+    assert got == [["1", "2", "3"], ["4", "5", "6"], ["7", "8", "9"], ["10", "11", "12"]]
+
+def test_page_boundary_at_the_length_change(ular):
+    addquestions(ular, 9, 11)
+    got = pages(ular, limit=3)
+    assert got == [["1", "2", "3"], ["4", "5", "6"], ["7", "8", "9"], ["10", "11"]]
+    # a cursor that ends a page on "9" goes straight on to the longer ids
+    rows, cursor = ular.modelgetquestionpage("", 9)
+    assert rows[-1]["id"] == "9"
+    assert [q["id"] for q in ular.modelgetquestionpage("", 9, ular.decodequestioncursor(cursor))[0]] == ["10", "11"]
+
+def test_topic_pages_and_edits_between_pages(ular):
+    addquestions(ular, 9, 12, topic="biologi")
+    first, cursor = ular.modelgetquestionpage("biologi", 4)
+    assert [q["id"] for q in first] == ["5", "6", "7", "8"]
+    # a question added before the cursor doesn't shift the next page
+    ular.modelcreatequestion("0", "Sample question inserted first?", "w", "x", "y", "z", "a1", "biologi")
+    rest, cursor = ular.modelgetquestionpage("biologi", 4, ular.decodequestioncursor(cursor))
+    assert [q["id"] for q in rest] == ["9", "10", "11", "12"]
+    assert cursor is None
+
+def test_bad_cursor(ular):
+    assert ular.decodequestioncursor("not a cursor") is None
+    assert ular.decodequestioncursor("") is None
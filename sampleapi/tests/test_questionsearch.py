@@ -0,0 +1,41 @@
+#tests/test_questionsearch.py
+# FTS5 question search: prefix words, topic filter, and the index following edits.
+
+def ids(rows):
+    return [q["id"] for q in rows]
+
+def test_prefix_words_all_match(ular):
+    # Newton is in 3's question and only in 4's answers
+    assert ids(ular.modelsearchquestions("newt")) == ["3", "4"]
+    assert ids(ular.modelsearchquestions("what unit energy")) == ["4"]
+    # every word has to match, and punctuation is not a query
+    assert ular.modelsearchquestions("newton cell") == []
+    assert ular.modelsearchquestions("?? !!") == []
+
+def test_topic_and_paging(ular):
+    assert set(ids(ular.modelsearchquestions("what", topic="biologi"))) == {"5", "6", "7", "8"}
+    everything = ids(ular.modelsearchquestions("what", limit=8))
+    assert len(everything) == 8
+    assert ids(ular.modelsearchquestions("what", limit=3, offset=3)) == everything[3:6]
+
+def test_question_text_ranks_over_answers(ular):
+    ular.modelcreatequestion("9", "Which gas do plants take in?", "Oxygen", "Nitrogen", "Carbon dioxide", "Helium", "a3", "biologi")
+    ular.modelcreatequestion("10", "Which one is a noble gas?", "Helium", "Oxygen", "Nitrogen", "Hydrogen", "a1", "fizik")
+    assert ids(ular.modelsearchquestions("helium")) == ["10", "9"]
+    assert "[Helium]" in ular.modelsearchquestions("helium")[0]["snippet"]
+
+def test_index_follows_update_and_delete(ular):
+    ular.modelupdatequestion("4", "What is the SI unit of power?", "Newton", "Watt", "Joule", "Pascal", "a2", "fizik")
+    assert ular.modelsearchquestions("energy") == []
+    assert ids(ular.modelsearchquestions("si power")) == ["4"]
+
+    ular.modeldeletequestion("4")
+    assert ular.modelsearchquestions("si power") == []
+    # the deleted row's answers go with it
+    assert ular.modelsearchquestions("pascal") == []
+    assert ids(ular.modelsearchquestions("newt")) == ["3"]
+
+    # a rebuild from the table gives the same answers
+    ular.modelrebuildquestionsearch()
+    assert ular.modelsearchquestions("si power") == []
+    assert ids(ular.modelsearchquestions("newt")) == ["3"]
@@ -0,0 +1,79 @@
+#tests/test_reaper.py
+# Room reaper: idle rooms end, ended rooms move to the archive and give their code back.
+import json
+import time
+import pytest
+from sampleapi.benchmarks.benchutil import makeulardb
+from sampleapi.utils.db_helper import af_getdb, af_transaction
+
+def newroom(ular, player="p0"):
+    code = ular.modelgenerateroomcode(4)
+    ular.adddataroom(code, player, "waiting", ular.maxbox, "fizik")
+    ular.adddataplayer(code, player, 0, "red")
+    return code
+
+def age(ular, code, seconds=100000):
+    # updated only follows version, so this doesn't touch it again
+    af_getdb(ular.roomdb(code), "UPDATE room SET updated = updated - ? WHERE code = ?;", (seconds, code))
+
+def state(ular, code):
+    return ular.modelgetroom(code)["state"]
+
+def freecodes(ular):
+    return [r["code"] for r in af_getdb(ular.dbloc, "SELECT code FROM freecodes WHERE scope = 'room';", ())]
+
+def test_idle_rooms_are_ended(ular):
+    idle = newroom(ular)
+    live = newroom(ular)
+    age(ular, idle)
+    assert ular.expireularrooms(time.time() - 3600) == 1
+    assert state(ular, idle) == "ended"
+    assert state(ular, live) == "waiting"
+
+def test_ended_rooms_are_archived_and_codes_recycled(ular):
+    code = newroom(ular)
+    ular.adddataplayer(code, "p1", 3, "blue")
+    ular.endgame(code)
+    age(ular, code)
+    assert ular.archiveularrooms(time.time() - 600) == 1
+
+    assert ular.modelgetroom(code) is None
+    assert af_getdb(ular.dbloc, "SELECT * FROM players WHERE code = ?;", (code,)) == []
+    archived = af_getdb(ular.af_archivedb, "SELECT * FROM room_archive WHERE code = ?;", (code,))
+    assert len(archived) == 1
+    assert [p["player"] for p in json.loads(archived[0]["players"])] == ["p0", "p1"]
+    assert freecodes(ular) == [code]
+    assert ular.modelgenerateroomcode(4) == code
+
+def test_reaper_pass_counters(ular):
+    ended = newroom(ular)
+    ular.endgame(ended)
+    age(ular, ended)
+    idle = newroom(ular)
+    age(ular, idle)
+    counters = ular.reapularrooms()
+    assert counters["reaped"] == 1
+    assert counters["archived"] == 1
+    # the idle room was only just ended, it is archived on a later pass
+    assert state(ular, idle) == "ended"
+
+def test_code_released_only_after_the_shard_commits(ular, tmp_path):
+    (tmp_path / "sharded").mkdir()
+    makeulardb(folder=str(tmp_path / "sharded"), shards=2)
+    code = newroom(ular)
+    while ular.roomdb(code) == ular.dbloc:
+        code = newroom(ular)
+    loc = ular.roomdb(code)
+    ular.endgame(code)
+    age(ular, code)
+
+    with pytest.raises(RuntimeError):
+        with af_transaction(loc):
+            assert ular.archiveularrooms(time.time() - 600, loc) == 1
+            assert code not in freecodes(ular)
+            raise RuntimeError("delete rolled back")
+    assert state(ular, code) == "ended"
+    assert code not in freecodes(ular)
+
+    assert ular.archiveularrooms(time.time() - 600, loc) == 1
+    assert code in freecodes(ular)
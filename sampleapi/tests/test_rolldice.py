@@ -0,0 +1,59 @@
+#tests/test_rolldice.py
+# rollturn: a whole roll in one guarded transaction, so a double tap rolls once.
+import threading
+from sampleapi.benchmarks.benchutil import addliveroom
+
+def startedroom(ular, code="ROLL"):
+    addliveroom(code, players=2, topic="fizik", state="waiting")
+    assert ular.startroom(code)["status"] == "ok"
+    return code
+
+def test_double_tap_rolls_once(ular):
+    code = startedroom(ular)
+    version = ular.modelgetroom(code)["version"]
+    taps = 8
+    barrier = threading.Barrier(taps)
+    results = []
+
+    def tap():
+        barrier.wait()
+        results.append(ular.rollturn(code, "p0"))
+
+    threads = [threading.Thread(target=tap) for _ in range(taps)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    rolled = [r for r in results if r["status"] == "ok"]
+    assert len(rolled) == 1
+    assert all(r["status"] == "error" for r in results if r is not rolled[0])
+    room = ular.modelgetroom(code)
+    assert room["version"] == version + 1
+    assert room["dice"] == rolled[0]["dice"]
+    assert ular.playerdata(code, "p0")[0]["pos"] == rolled[0]["pos"]
+
+def test_roll_guards(ular):
+    code = startedroom(ular)
+    assert ular.rollturn(code, "p1") == {"status": "error", "message": "It is not your turn!"}
+    assert ular.rollturn(code, "nobody") == {"status": "error", "message": "Please insert correct player"}
+
+    first = ular.rollturn(code, "p0")
+    assert first["status"] == "ok"
+    again = ular.rollturn(code, "p0")
+    if first["question"]:
+        # the question has to be answered before anyone rolls again
+        assert first["turn"] == "p0"
+        assert again["message"] == "Please answer question first!"
+    else:
+        assert first["turn"] == "p1"
+        assert again["message"] == "It is not your turn!"
+
+def test_roll_bounces_off_the_last_square(ular, monkeypatch):
+    code = startedroom(ular)
+    maxbox = ular.modelgetroom(code)["maxbox"]
+    ular.playerchangepos(code, "p0", maxbox - 1)
+    monkeypatch.setattr(ular.random, "randint", lambda a, b: 3)
+    result = ular.rollturn(code, "p0")
+    assert result["status"] == "ok"
+    assert result["pos"] == maxbox - 2
@@ -0,0 +1,64 @@
+#tests/test_roomcodes.py
+# Room code allocator: no code twice, released codes come back, longer codes when full.
+import threading
+import pytest
+from sampleapi.utils.db_helper import af_ensuredb
+from sampleapi.utils.roomcode_helper import (af_codechars, af_permutecode, af_codesinit, af_allocatecode,
+                                             af_releasecode, af_codestats)
+
+@pytest.fixture
+def db(tmp_path):
+    return af_ensuredb(str(tmp_path / "codes.db"))
+
+def test_permutation_is_a_bijection():
+    for length in (1, 2):
+        space = len(af_codechars) ** length
+        codes = {af_permutecode(n, length, 12345) for n in range(space)}
+        assert len(codes) == space
+        assert all(len(code) == length for code in codes)
+
+def test_codes_are_unique_and_grow_when_the_space_is_used(db):
+    af_codesinit(db, "t", 1)
+    codes = [af_allocatecode(db, "t", 1) for _ in range(len(af_codechars) + 10)]
+    assert len(set(codes)) == len(codes)
+    assert [len(code) for code in codes] == [1] * len(af_codechars) + [2] * 10
+    assert af_codestats(db, "t")["length"] == 2
+
+def test_concurrent_allocations_never_collide(db):
+    af_codesinit(db, "t", 2)
+    codes = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(50):
+            code = af_allocatecode(db, "t", 2)
+            with lock:
+                codes.append(code)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(codes) == 200
+    assert len(set(codes)) == 200
+
+def test_released_codes_are_recycled(db):
+    af_codesinit(db, "t", 4)
+    first = af_allocatecode(db, "t")
+    af_allocatecode(db, "t")
+    af_releasecode(db, "t", first)
+    assert af_codestats(db, "t")["free"] == 1
+    assert af_allocatecode(db, "t") == first
+    assert af_codestats(db, "t")["free"] == 0
+
+def test_existing_codes_are_skipped(db):
+    # reserve every length-1 code but two, only those two may be handed out
+    taken = [c for c in af_codechars if c not in "AZ"]
+    af_codesinit(db, "t", 1, existing=taken)
+    assert sorted(af_allocatecode(db, "t", 1) for _ in range(2)) == ["A", "Z"]
+    assert len(af_allocatecode(db, "t", 1)) == 2
+
+    # a reserved code released by its old room is free again
+    af_releasecode(db, "t", taken[0])
+    assert af_allocatecode(db, "t", 1) == taken[0]
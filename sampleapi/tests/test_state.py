@@ -0,0 +1,67 @@
+#tests/test_state.py
+# /state polling: ETag/304 and ?since= for unchanged rooms, ?delta=1 sends only what changed.
+from sampleapi.benchmarks.benchutil import addliveroom
+
+def startedroom(ular, code="STAT"):
+    addliveroom(code, players=2, topic="fizik", state="waiting")
+    assert ular.startroom(code)["status"] == "ok"
+    return code
+
+def test_etag_not_modified(ular, client):
+    code = startedroom(ular)
+    first = client.get(f"/api/ular/state?code={code}")
+    etag = first.headers["ETag"]
+    assert etag == f'"{code}-{first.get_json()["version"]}"'
+
+    again = client.get(f"/api/ular/state?code={code}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == etag
+
+    # a roll changes the version, so the same tag gets the full state again
+    assert ular.rollturn(code, "p0")["status"] == "ok"
+    moved = client.get(f"/api/ular/state?code={code}", headers={"If-None-Match": etag})
+    assert moved.status_code == 200
+    assert moved.headers["ETag"] != etag
+    assert moved.get_json()["version"] == first.get_json()["version"] + 1
+
+def test_since_not_modified(ular, client):
+    code = startedroom(ular)
+    version = ular.modelgetroom(code)["version"]
+    for since in (version, version + 5):
+        result = client.get(f"/api/ular/state?code={code}&since={since}").get_json()
+        assert result == {"status": "ok", "code": code, "version": version, "notmodified": True}
+
+    behind = client.get(f"/api/ular/state?code={code}&since={version - 1}").get_json()
+    assert "notmodified" not in behind
+    assert [p["player"] for p in behind["players"]] == ["p0", "p1"]
+
+def test_delta_leaves_out_an_unchanged_question(ular, client, monkeypatch):
+    code = startedroom(ular)
+    # 3 is the foot of a ladder, so the roll brings up a question
+    monkeypatch.setattr(ular.random, "randint", lambda a, b: 3)
+    rolled = ular.rollturn(code, "p0")
+    assert rolled["questionid"] != ""
+    qversion = ular.modelgetroom(code)["version"]
+    ular.roomselectanswer(code, "a")
+
+    # the roll (question, p0's move) is after since: both are sent
+    before = client.get(f"/api/ular/state?code={code}&since={qversion - 1}&delta=1").get_json()
+    assert before["delta"] is True
+    assert before["question"][0]["id"] == rolled["questionid"]
+    assert [p["player"] for p in before["players"]] == ["p0"]
+
+    # only the selected answer changed since: no question and no players
+    after = client.get(f"/api/ular/state?code={code}&since={qversion}&delta=1").get_json()
+    assert after["delta"] is True
+    assert after["since"] == qversion
+    assert "question" not in after
+    assert after["questionid"] == rolled["questionid"]
+    assert after["selectedanswer"] == "a"
+    assert after["players"] == []
+
+    # without delta=1 a since behind the room is a full snapshot
+    full = client.get(f"/api/ular/state?code={code}&since={qversion}").get_json()
+    assert "delta" not in full
+    assert full["question"][0]["id"] == rolled["questionid"]
+    assert len(full["players"]) == 2
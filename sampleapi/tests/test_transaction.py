@@ -0,0 +1,72 @@
+#tests/test_transaction.py
+# af_transaction: one commit for a group of writes, all or nothing.
+import sqlite3
+import pytest
+from sampleapi.utils.db_helper import af_ensuredb, af_getdb, af_getdbmany, af_transaction, af_oncommit, af_txstats
+
+@pytest.fixture
+def db(tmp_path):
+    path = af_ensuredb(str(tmp_path / "tx.db"))
+    af_getdb(path, "CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT);", ())
+    return path
+
+def rows(db):
+    return [r["id"] for r in af_getdb(db, "SELECT id FROM t ORDER BY id;", ())]
+
+def test_writes_commit_together(db):
+    before = af_txstats()["commits"]
+    with af_transaction(db):
+        af_getdb(db, "INSERT INTO t (id, v) VALUES (1, 'a');", ())
+        # nested blocks and model functions join the outer transaction
+        with af_transaction(db):
+            af_getdb(db, "INSERT INTO t (id, v) VALUES (2, 'b');", ())
+        af_getdbmany(db, "INSERT INTO t (id, v) VALUES (?, ?);", [(3, "c"), (4, "d")])
+    assert rows(db) == [1, 2, 3, 4]
+    assert af_txstats()["commits"] == before + 1
+
+def test_exception_rolls_back(db):
+    with pytest.raises(RuntimeError):
+        with af_transaction(db):
+            af_getdb(db, "INSERT INTO t (id, v) VALUES (1, 'a');", ())
+            raise RuntimeError("boom")
+    assert rows(db) == []
+
+def test_failing_statement_rolls_back(db):
+    # the error is raised, not returned, so the first insert doesn't commit
+    with pytest.raises(sqlite3.IntegrityError):
+        with af_transaction(db):
+            af_getdb(db, "INSERT INTO t (id, v) VALUES (1, 'a');", ())
+            af_getdb(db, "INSERT INTO t (id, v) VALUES (1, 'again');", ())
+    assert rows(db) == []
+
+    with pytest.raises(sqlite3.IntegrityError):
+        af_getdbmany(db, "INSERT INTO t (id, v) VALUES (?, ?);", [(5, "e"), (5, "e")])
+    assert rows(db) == []
+
+def test_error_string_outside_a_transaction(db):
+    assert af_getdb(db, "INSERT INTO missing (id) VALUES (1);", ()).startswith("An error occurred")
+    assert rows(db) == []
+
+def test_oncommit_runs_after_commit_only(db):
+    ran = []
+    with af_transaction(db):
+        af_getdb(db, "INSERT INTO t (id, v) VALUES (1, 'a');", ())
+        af_oncommit(db, lambda: ran.append(rows(db)))
+        assert ran == []
+    assert ran == [[1]]
+
+    with pytest.raises(RuntimeError):
+        with af_transaction(db):
+            af_oncommit(db, lambda: ran.append("rolled back"))
+            raise RuntimeError("boom")
+    assert ran == [[1]]
+
+def test_failed_write_in_an_endpoint_is_a_json_error(ular, client, monkeypatch):
+    from sampleapi.controllers import ular as controller
+    taken = client.get("/api/ular/createroom?player=a").get_json()["code"]
+    # the allocator handing out a taken code makes the room insert fail
+    monkeypatch.setattr(controller, "modelgenerateroomcode", lambda length=4: taken)
+    response = client.get("/api/ular/createroom?player=b")
+    assert response.status_code == 500
+    assert response.get_json()["status"] == "error"
+    assert [p["player"] for p in ular.modelgetcsvplayers(taken)] == ["a"]
@@ -2,7 +2,14 @@
 import os
 from flask import jsonify
 import sqlite3
-from flask import Flask, g
+import threading
+import queue
+import time
+import random
+import zlib
+from contextlib import contextmanager
+from flask import Flask, g, has_request_context, request, current_app
+from .metrics_helper import af_metricdefine, af_metricinc, af_metricobserve, af_commitbuckets
 
 """
 Example:
@@ -37,24 +44,570 @@ def af_connectdb(dbloc=""):
     conn.row_factory = sqlite3.Row  # Optional: Returns results as dictionaries
     return conn
 
+# Connection pool
+# Every af_getdb call used to open (and close) its own connection. The pool
+# keeps a few connections per database file open for the life of the worker
+# process, each set up once with WAL, a relaxed synchronous level and a busy
+# timeout so concurrent writers wait instead of failing straight away.
+#
+# AF_DB_POOLSIZE - max open connections per database file per worker (default 8)
+# AF_DB_SYNCHRONOUS - synchronous level for pooled connections (default NORMAL)
+# AF_DB_BUSYTIMEOUT - busy timeout in ms (default 5000)
+# AF_DB_POOLTIMEOUT - seconds to wait for a free connection (default 30)
+# AF_DB_BUSYRETRIES - extra attempts for BEGIN/COMMIT on SQLITE_BUSY (default 5)
+
+af_poolsize = int(os.environ.get("AF_DB_POOLSIZE", "8"))
+af_synchronous = os.environ.get("AF_DB_SYNCHRONOUS", "NORMAL")
+af_busytimeout = int(os.environ.get("AF_DB_BUSYTIMEOUT", "5000"))
+af_pooltimeout = float(os.environ.get("AF_DB_POOLTIMEOUT", "30"))
+af_busyretries = int(os.environ.get("AF_DB_BUSYRETRIES", "5"))
+
+class AfPool:
+    """Thread-safe pool of sqlite connections for one database file"""
+
+    def __init__(self, dbloc, size=af_poolsize):
+        self.dbloc = dbloc
+        self.size = max(1, int(size))
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "waittime": 0.0,
+            "connects": 0,
+            "discarded": 0
+        }
+
+    def connect(self):
+        # autocommit mode, multi-statement work goes through af_transaction
+        conn = sqlite3.connect(self.dbloc, timeout=af_busytimeout / 1000, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute(f"PRAGMA synchronous={af_synchronous};")
+        conn.execute(f"PRAGMA busy_timeout={af_busytimeout};")
+        return conn
+
+    def checkout(self):
+        conn = None
+        create = False
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                if self.opened < self.size:
+                    self.opened += 1
+                    create = True
+        if create:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+            with self.lock:
+                self.stats["connects"] += 1
+        elif conn is None:
+            waitstart = time.perf_counter()
+            try:
+                conn = self.idle.get(timeout=af_pooltimeout)
+            except queue.Empty:
+                raise sqlite3.OperationalError(f"no free connection for '{self.dbloc}' after {af_pooltimeout}s")
+            with self.lock:
+                self.stats["waits"] += 1
+                self.stats["waittime"] += time.perf_counter() - waitstart
+        with self.lock:
+            self.stats["checkouts"] += 1
+        return conn
+
+    def checkin(self, conn, broken=False):
+        if broken:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            with self.lock:
+                self.opened -= 1
+                self.stats["discarded"] += 1
+            return
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+    def getstats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["size"] = self.size
+            stats["open"] = self.opened
+        stats["idle"] = self.idle.qsize()
+        stats["inuse"] = stats["open"] - stats["idle"]
+        return stats
+
+af_pools = {}
+af_poolslock = threading.Lock()
+af_poolspid = os.getpid()
+
+def af_getpool(dbloc=""):
+    global af_pools, af_poolspid
+    if af_poolspid != os.getpid():
+        # forked worker: inherited connections belong to the parent, start fresh
+        with af_poolslock:
+            af_pools = {}
+            af_poolspid = os.getpid()
+    pool = af_pools.get(dbloc)
+    if pool is None:
+        if not os.path.isfile(dbloc):
+            raise FileNotFoundError(f"The database file at '{dbloc}' does not exist.")
+        with af_poolslock:
+            pool = af_pools.get(dbloc)
+            if pool is None:
+                pool = AfPool(dbloc)
+                af_pools[dbloc] = pool
+    return pool
+
+def af_poolstats(dbloc=None):
+    if dbloc is not None:
+        pool = af_pools.get(dbloc)
+        return pool.getstats() if pool else {}
+    return {loc: pool.getstats() for loc, pool in list(af_pools.items())}
+
+def af_closepools():
+    with af_poolslock:
+        for pool in af_pools.values():
+            pool.close()
+        af_pools.clear()
+
+# Transactions
+# af_transaction groups several af_getdb calls into one BEGIN IMMEDIATE ...
+# COMMIT. While it is open, every af_getdb on the same dbloc from the same
+# thread joins it, so model functions don't need to know whether they run on
+# their own or as part of a bigger unit (e.g. a whole dice roll). Nested
+# af_transaction blocks join the outermost one; only the outermost commits.
+# Inside one, a failing af_getdb/af_getdbmany raises its sqlite3.Error instead
+# of returning the error string, so the block rolls back rather than
+# committing the writes that went through before it.
+#
+#   with af_transaction(dbloc):
+#       af_getdb(dbloc, "UPDATE players SET pos = ? WHERE ...", (...))
+#       af_getdb(dbloc, "UPDATE room SET turn = ? WHERE ...", (...))
+
+af_txlocal = threading.local()
+af_txstatslock = threading.Lock()
+af_txstatsdata = {
+    "queries": 0,
+    "transactions": 0,
+    "commits": 0,
+    "autocommits": 0,
+    "rollbacks": 0,
+    "busyretries": 0,
+    "busyfailures": 0,
+    "requests": 0,
+    "requestcommits": 0,
+    "maxrequestcommits": 0
+}
+
+# commit latency and busy counts also go to /metrics, summed over workers
+af_metricdefine("af_db_commit_seconds", "histogram", "SQLite commit latency (COMMIT or autocommit write)", af_commitbuckets)
+af_metricdefine("af_db_busy_retries_total", "counter", "BEGIN/COMMIT/write attempts retried on SQLITE_BUSY")
+af_metricdefine("af_db_busy_failures_total", "counter", "Statements that stayed busy after every retry")
+
+def af_txcount(key, n=1):
+    with af_txstatslock:
+        af_txstatsdata[key] += n
+
+def af_isbusy(e):
+    code = getattr(e, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+def af_retrybusy(fn):
+    """Run fn, retrying with bounded exponential backoff while sqlite reports busy"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not af_isbusy(e) or attempt >= af_busyretries:
+                if af_isbusy(e):
+                    af_txcount("busyfailures")
+                    af_metricinc("af_db_busy_failures_total")
+                raise
+            af_txcount("busyretries")
+            af_metricinc("af_db_busy_retries_total")
+            delay = min(0.5, 0.01 * (2 ** attempt))
+            time.sleep(delay / 2 + random.random() * delay / 2)
+            attempt += 1
+
+def af_countcommit(key="commits"):
+    af_txcount(key)
+    if has_request_context():
+        g.af_commits = g.get("af_commits", 0) + 1
+
+def af_currenttx(dbloc):
+    txs = getattr(af_txlocal, "txs", None)
+    if not txs:
+        return None
+    return txs.get(dbloc)
+
+@contextmanager
+def af_transaction(dbloc="static/db/habit/mydb.db"):
+    tx = af_currenttx(dbloc)
+    if tx is not None:
+        # join the transaction already open on this thread
+        tx["depth"] += 1
+        try:
+            yield tx["conn"]
+        finally:
+            tx["depth"] -= 1
+        return
+
+    pool = af_getpool(dbloc)
+    conn = pool.checkout()
+    try:
+        af_retrybusy(lambda: conn.execute("BEGIN IMMEDIATE;"))
+    except Exception:
+        pool.checkin(conn)
+        raise
+
+    if not hasattr(af_txlocal, "txs"):
+        af_txlocal.txs = {}
+    tx = {"conn": conn, "depth": 1}
+    af_txlocal.txs[dbloc] = tx
+    af_txcount("transactions")
+    broken = False
+    try:
+        yield conn
+        committing = time.perf_counter()
+        af_retrybusy(lambda: conn.execute("COMMIT;"))
+        af_metricobserve("af_db_commit_seconds", time.perf_counter() - committing)
+        af_countcommit()
+    except BaseException:
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+        except sqlite3.Error:
+            broken = True
+        af_txcount("rollbacks")
+        raise
+    finally:
+        del af_txlocal.txs[dbloc]
+        pool.checkin(conn, broken)
+
+    for fn in tx.get("oncommit", []):
+        try:
+            fn()
+        except Exception as e:
+            print(f"Error in af_oncommit callback: {e}")
+
+def af_oncommit(dbloc="static/db/habit/mydb.db", fn=None):
+    """Run fn once the open transaction on dbloc commits (right away if there is none)"""
+    tx = af_currenttx(dbloc)
+    if tx is None:
+        fn()
+    else:
+        tx.setdefault("oncommit", []).append(fn)
+
+def af_txstats():
+    with af_txstatslock:
+        stats = dict(af_txstatsdata)
+    stats["commitsperrequest"] = stats["requestcommits"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
+
+# Per-request query accounting
+# Every af_getdb inside a Flask request adds to g.af_queries: queries, rows
+# fetched, bytes fetched (text/blob length, 8 per number) and time spent.
+# af_dbrequestend folds those into a per-route summary (af_routestats), logs
+# requests over the query budget, and flags the same SELECT run again and
+# again in one request - the usual sign of an N+1 loop.
+#
+# AF_DB_QUERYBUDGET - queries per request before it is logged (default 16, 0 = off);
+#   the heaviest game request, a submitanswer that climbs a ladder, runs 13
+#   (15 if that ends the game), so only requests past the hot path are flagged
+# AF_DB_NPLUSONE - runs of one SELECT per request that count as N+1 (default 3)
+# AF_DB_QUERYHEADERS - X-DB-* response headers: "debug" (when app.debug, default), "1" or "0"
+
+af_querybudget = int(os.environ.get("AF_DB_QUERYBUDGET", "16"))
+af_nplusone = int(os.environ.get("AF_DB_NPLUSONE", "3"))
+af_queryheaders = os.environ.get("AF_DB_QUERYHEADERS", "debug")
+
+af_routestatslock = threading.Lock()
+af_routestatsdata = {}
+
+def af_rowbytes(rows):
+    total = 0
+    for row in rows:
+        for value in row:
+            total += len(value) if isinstance(value, (str, bytes)) else 8
+    return total
+
+def af_querycount(query, rows, nbytes, elapsed, isselect=True):
+    """Add one af_getdb call to the current request's figures"""
+    q = g.get("af_queries")
+    if q is None:
+        q = g.af_queries = {"queries": 0, "rows": 0, "bytes": 0, "ms": 0.0, "statements": {}}
+    q["queries"] += 1
+    q["rows"] += rows
+    q["bytes"] += nbytes
+    q["ms"] += elapsed * 1000
+    if isselect:
+        # only reads count towards N+1, a roll writing three events is fine
+        statement = " ".join(query.split())
+        q["statements"][statement] = q["statements"].get(statement, 0) + 1
+
+def af_requestqueries():
+    """This request's query figures so far (zeros outside a request)"""
+    q = g.get("af_queries") if has_request_context() else None
+    return q or {"queries": 0, "rows": 0, "bytes": 0, "ms": 0.0, "statements": {}}
+
+def af_routestats():
+    with af_routestatslock:
+        routes = {route: dict(s) for route, s in af_routestatsdata.items()}
+    for s in routes.values():
+        n = s["requests"] or 1
+        s["queriesperrequest"] = round(s["queries"] / n, 2)
+        s["rowsperrequest"] = round(s["rows"] / n, 2)
+        s["msperrequest"] = round(s["ms"] / n, 3)
+        s["ms"] = round(s["ms"], 3)
+        s["nplusone"] = dict(s["nplusone"])
+    return routes
+
+def af_dbrequestend(response):
+    """after_request hook: fold this request's commits and queries into the stats"""
+    commits = g.pop("af_commits", 0)
+    with af_txstatslock:
+        af_txstatsdata["requests"] += 1
+        af_txstatsdata["requestcommits"] += commits
+        if commits > af_txstatsdata["maxrequestcommits"]:
+            af_txstatsdata["maxrequestcommits"] = commits
+
+    q = g.pop("af_queries", None) or af_requestqueries()
+    route = request.url_rule.rule if request.url_rule is not None else "(unmatched)"
+    repeated = {st: n for st, n in q["statements"].items() if n >= af_nplusone > 0}
+    overbudget = af_querybudget > 0 and q["queries"] > af_querybudget
+    with af_routestatslock:
+        s = af_routestatsdata.get(route)
+        if s is None:
+            s = af_routestatsdata[route] = {"requests": 0, "queries": 0, "rows": 0, "bytes": 0, "ms": 0.0,
+                                            "maxqueries": 0, "overbudget": 0, "nplusone": {}}
+        s["requests"] += 1
+        s["queries"] += q["queries"]
+        s["rows"] += q["rows"]
+        s["bytes"] += q["bytes"]
+        s["ms"] += q["ms"]
+        s["maxqueries"] = max(s["maxqueries"], q["queries"])
+        s["overbudget"] += 1 if overbudget else 0
+        for st, n in repeated.items():
+            s["nplusone"][st] = max(s["nplusone"].get(st, 0), n)
+
+    if overbudget or repeated:
+        detail = ", ".join(f"{n}x {st[:80]}" for st, n in sorted(repeated.items(), key=lambda x: -x[1]))
+        print(f"⚠️ {request.method} {route}: {q['queries']} queries, {q['rows']} rows, {q['ms']:.1f}ms"
+              + (f" (budget {af_querybudget})" if overbudget else "")
+              + (f" repeated: {detail}" if detail else ""))
+
+    if af_queryheaders == "1" or (af_queryheaders == "debug" and current_app.debug):
+        response.headers["X-DB-Queries"] = str(q["queries"])
+        response.headers["X-DB-Rows"] = str(q["rows"])
+        response.headers["X-DB-Bytes"] = str(q["bytes"])
+        response.headers["X-DB-Time-Ms"] = f"{q['ms']:.3f}"
+        response.headers["X-DB-Commits"] = str(commits)
+    return response
+
 def af_getdb(dbloc="static/db/habit/mydb.db", query="SELECT * FROM users;", params=("ikan",)):
-    conn = af_connectdb(dbloc)
+    af_txcount("queries")
+    tx = af_currenttx(dbloc)
+    if tx is not None:
+        conn = tx["conn"]
+        pool = None
+    else:
+        pool = af_getpool(dbloc)
+        conn = pool.checkout()
+    broken = False
     cursor = conn.cursor()
+    inrequest = has_request_context()
+    start = time.perf_counter()
     try:
-        cursor.execute(query, params)
-        conn.commit()
-        if query.strip().upper().startswith("SELECT") or query.strip().upper().startswith("PRAGMA"):
+        isselect = query.strip().upper().startswith("SELECT") or query.strip().upper().startswith("PRAGMA")
+        if pool is not None and not isselect:
+            af_retrybusy(lambda: cursor.execute(query, params))
+            af_metricobserve("af_db_commit_seconds", time.perf_counter() - start)
+            af_countcommit("autocommits")
+        else:
+            cursor.execute(query, params)
+        if isselect:
             dbdata = cursor.fetchall()
             results = [dict(row) for row in dbdata] if dbdata else []
+            if inrequest:
+                af_querycount(query, len(dbdata), af_rowbytes(dbdata), time.perf_counter() - start)
             return results
-        else:
-            conn.commit()  # Commit only if it's not a SELECT query
-            return f"Query executed successfully. Rows affected: {cursor.rowcount}"
+        if inrequest:
+            af_querycount(query, 0, 0, time.perf_counter() - start, False)
+        return f"Query executed successfully. Rows affected: {cursor.rowcount}"
     except sqlite3.Error as e:
         #todo - telegram message here?
+        if pool is None:
+            # part of an af_transaction: let it roll back
+            raise
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
         return f"An error occurred: {e.args[0]}"
     finally:
-        conn.close()
+        cursor.close()
+        if pool is not None:
+            pool.checkin(conn, broken)
+
+def af_getdbmany(dbloc="static/db/habit/mydb.db", query="", rows=()):
+    """executemany for one write statement over many param tuples, always in a transaction (errors raise)"""
+    tx = af_currenttx(dbloc)
+    if tx is None:
+        # pooled connections autocommit, which would be one commit per row
+        with af_transaction(dbloc):
+            return af_getdbmany(dbloc, query, rows)
+    af_txcount("queries")
+    cursor = tx["conn"].cursor()
+    start = time.perf_counter()
+    try:
+        cursor.executemany(query, rows)
+        if has_request_context():
+            af_querycount(query, 0, 0, time.perf_counter() - start, False)
+        return f"Query executed successfully. Rows affected: {cursor.rowcount}"
+    finally:
+        cursor.close()
+
+def af_iterdb(dbloc="static/db/habit/mydb.db", query="SELECT * FROM users;", params=(), batch=1000):
+    """Yield the rows of a SELECT as dicts, batch rows at a time, without loading them all.
+
+    Holds one pooled connection (or the open transaction's) until the loop ends;
+    a failing query is printed and yields nothing.
+    """
+    af_txcount("queries")
+    tx = af_currenttx(dbloc)
+    if tx is not None:
+        conn = tx["conn"]
+        pool = None
+    else:
+        pool = af_getpool(dbloc)
+        conn = pool.checkout()
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute(query, params)
+        except sqlite3.Error as e:
+            print(f"An error occurred: {e.args[0]}")
+            return
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cursor.close()
+        if pool is not None:
+            pool.checkin(conn)
+
+def af_rowcount(result=""):
+    """Rows affected from an af_getdb write result, -1 if it failed"""
+    if isinstance(result, str) and "Rows affected: " in result:
+        return int(result.rsplit("Rows affected: ", 1)[1])
+    return -1
+
+# Sharding
+# Rows that belong to one key (e.g. a room code) can live in one of several
+# database files so writes to different keys don't queue on a single writer
+# lock. Shard 0 is dbloc itself, so with one shard nothing moves; shard i is
+# dbloc with "_shard{i}" before the extension. crc32 keeps the key -> shard
+# mapping the same in every process.
+#
+#   af_shardloc("static/db/ular.db", "ABCD", 4) -> "static/db/ular_shard3.db"
+#   af_fanout("static/db/ular.db", 4, "SELECT COUNT(*) AS n FROM room;", ())
+
+def af_shardlocs(dbloc="", shards=1):
+    root, ext = os.path.splitext(dbloc)
+    return [dbloc] + [f"{root}_shard{i}{ext}" for i in range(1, max(1, int(shards)))]
+
+def af_shardloc(dbloc="", key="", shards=1):
+    if shards <= 1:
+        return dbloc
+    i = zlib.crc32(str(key).encode()) % shards
+    if i == 0:
+        return dbloc
+    root, ext = os.path.splitext(dbloc)
+    return f"{root}_shard{i}{ext}"
+
+def af_ensuredb(dbloc=""):
+    """Create an empty database file at dbloc if there is none"""
+    if not os.path.isfile(dbloc):
+        folder = os.path.dirname(dbloc)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        sqlite3.connect(dbloc).close()
+    return dbloc
+
+def af_fanout(dbloc="", shards=1, query="", params=()):
+    """Run a SELECT on every shard and concatenate the rows (failed shards are skipped)"""
+    results = []
+    for loc in af_shardlocs(dbloc, shards):
+        data = af_getdb(loc, query, params)
+        if isinstance(data, str):
+            print(f"Error on shard {loc}: {data}")
+            continue
+        results.extend(data)
+    return results
+
+# Space reclaim
+# Pages freed by deletes only go back to the OS with auto_vacuum. Switching an
+# existing file over needs one full VACUUM, after that af_incrementalvacuum
+# hands back free pages a few at a time without locking the file for long.
+
+def af_autovacuum(dbloc=""):
+    """Make sure dbloc uses auto_vacuum=INCREMENTAL (VACUUMs once to switch).
+
+    Returns True when it ran the VACUUM, which may renumber implicit rowids.
+    """
+    pool = af_getpool(dbloc)
+    conn = pool.checkout()
+    try:
+        if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            conn.execute("VACUUM;")
+            print(f"✅ {dbloc} switched to incremental auto_vacuum")
+            return True
+    except sqlite3.Error as e:
+        print(f"Error enabling auto_vacuum on {dbloc}: {e}")
+    finally:
+        pool.checkin(conn)
+    return False
+
+def af_incrementalvacuum(dbloc="", pages=0):
+    """Give up to pages free pages (0 = all) back to the OS, returns bytes reclaimed"""
+    pool = af_getpool(dbloc)
+    conn = pool.checkout()
+    try:
+        pagesize = conn.execute("PRAGMA page_size;").fetchone()[0]
+        before = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        # executescript steps the pragma to the end, execute() frees a single page
+        af_retrybusy(lambda: conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});"))
+        after = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        return max(0, before - after) * pagesize
+    except sqlite3.Error as e:
+        print(f"Error vacuuming {dbloc}: {e}")
+        return 0
+    finally:
+        pool.checkin(conn)
 
 def af_getdb2(dblog, query, params):
     # Connect to the SQLite database and execute the query
@@ -0,0 +1,88 @@
+#utils/dedup_helper.py
+import re
+import zlib
+import hashlib
+import unicodedata
+
+"""
+Near-duplicate text detection without comparing against every row.
+
+Text is normalized (case, accents, punctuation, spacing) and cut into
+character shingles. af_contenthash catches exact duplicates after
+normalization. For near duplicates each text gets a one-permutation MinHash
+signature of af_minhashbins values, grouped into af_lshbands bands; two texts
+share at least one band key with high probability when their shingle sets
+overlap a lot (Jaccard 0.8 -> ~99.7%, 0.5 -> ~66%, 0.3 -> ~20%). Store the
+band keys in an indexed table, look candidates up by key, and confirm them
+with af_jaccard on the actual shingles.
+
+Example:
+
+keys = af_lshkeys(af_shingles(text))         # 8 integers to store/look up
+af_jaccard(af_shingles(a), af_shingles(b))   # 0.0 .. 1.0
+"""
+
+af_shinglesize = 5
+af_minhashbins = 24
+af_lshbands = 8
+
+def af_normalizetext(text=""):
+    """Lowercase, accents dropped, punctuation to spaces, single spaces"""
+    text = str(text or "")
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def af_contenthash(parts=()):
+    """Hash of the normalized parts; parts in the same order give the same hash"""
+    joined = "\x1f".join(af_normalizetext(p) for p in parts)
+    return hashlib.sha1(joined.encode()).hexdigest()
+
+def af_shingles(text="", size=af_shinglesize):
+    """Set of crc32s of the character shingles of already normalized text"""
+    if len(text) <= size:
+        return {zlib.crc32(text.encode())} if text else set()
+    return {zlib.crc32(text[i:i + size].encode()) for i in range(len(text) - size + 1)}
+
+def af_minhash(shingles=set(), bins=af_minhashbins):
+    """One-permutation MinHash: the smallest hash in each of bins buckets, empty bins borrow the next one"""
+    signature = [None] * bins
+    for h in shingles:
+        b = h % bins
+        v = h // bins
+        if signature[b] is None or v < signature[b]:
+            signature[b] = v
+    if all(v is None for v in signature):
+        return signature
+    for i in range(bins):
+        j = i
+        while signature[j % bins] is None:
+            j += 1
+        if j != i:
+            # densify: rotate the next filled bin in, offset so it can't pose as this one
+            signature[i] = signature[j % bins] + (j - i) * (1 << 32)
+    return signature
+
+def af_lshkeys(shingles=set(), bands=af_lshbands, bins=af_minhashbins):
+    """Band keys (signed 63-bit ints, ready for an INTEGER column) of a shingle set"""
+    signature = af_minhash(shingles, bins)
+    if signature[0] is None:
+        return []
+    rows = bins // bands
+    keys = []
+    for band in range(bands):
+        chunk = ",".join(str(v) for v in signature[band * rows:(band + 1) * rows])
+        digest = hashlib.blake2b(f"{band}:{chunk}".encode(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+def af_jaccard(a=set(), b=set(), atleast=0.0):
+    """Jaccard similarity; 0.0 straight away when the sizes alone keep it under atleast"""
+    if not a and not b:
+        return 1.0
+    small, big = sorted((len(a), len(b)))
+    if small < atleast * big:
+        return 0.0
+    common = len(a & b)
+    return common / (small + big - common)
@@ -0,0 +1,322 @@
+#utils/event_helper.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from .db_helper import af_getdb, af_oncommit
+
+"""
+Cross-process pub/sub for room events, used by the SSE endpoint.
+
+Events are rows in an append-only `events` table, written inside the
+caller's transaction (so an event exists exactly when its game write
+committed). Every worker process runs one watcher thread on its own
+connection that polls PRAGMA data_version; when another connection has
+committed it reads the new rows and fans them out to local waiters. Event ids
+are the table's rowids, so a client can resume with Last-Event-ID on any
+worker.
+
+With sharded game data, af_eventsroute(fn) sends each channel's events to
+the database its rows live in (fn(channel) -> dbloc); every database added
+with af_eventsinit gets its own watcher and its own id sequence, and a channel
+always maps to the same database, so Last-Event-ID stays meaningful.
+
+Each channel (e.g. "room:ABCD") keeps the last AF_EVENTS_BUFFER events in
+memory; older resumes are served from the table. Waiters block on a
+Condition, so an idle SSE connection costs a sleeping thread/greenlet and no
+database work. Run gunicorn with gevent or gthread workers so idle streams
+don't each hold a whole worker.
+
+AF_EVENTS_BUFFER - events kept in memory per channel (default 200)
+AF_EVENTS_POLL - data_version poll interval in seconds (default 0.02)
+AF_EVENTS_KEEP - rows kept in the events table (default 100000)
+
+Example:
+
+af_eventsinit("static/db/ular.db")
+af_publish("room:ABCD", "roll", {"player": "ali", "dice": 4})
+events, complete = af_waitevents("room:ABCD", lastid=0, timeout=15)
+"""
+
+af_eventsbuffer = int(os.environ.get("AF_EVENTS_BUFFER", "200"))
+af_eventspoll = float(os.environ.get("AF_EVENTS_POLL", "0.02"))
+af_eventskeep = int(os.environ.get("AF_EVENTS_KEEP", "100000"))
+af_eventsidle = 300
+
+af_eventsdb = None  # default database, for channels without a route
+af_eventsdbs = set()
+af_eventsrouter = None
+
+def af_eventsinit(dbloc="", default=True):
+    """Create the events table in dbloc and publish/subscribe through it.
+
+    default=False adds dbloc next to the default one (for af_eventsroute)
+    """
+    global af_eventsdb, af_eventsrouter
+    af_getdb(dbloc, """CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel TEXT,
+        type TEXT,
+        data TEXT,
+        created REAL
+    );""", ())
+    af_getdb(dbloc, "CREATE INDEX IF NOT EXISTS idx_events_channel ON events (channel, id);", ())
+    if default:
+        af_eventsdbs.clear()
+        af_eventsrouter = None
+        af_eventsdb = dbloc
+    af_eventsdbs.add(dbloc)
+
+def af_eventsroute(fn=None):
+    """Pick the events database per channel with fn(channel) -> dbloc"""
+    global af_eventsrouter
+    af_eventsrouter = fn
+
+def af_eventsdbfor(name=""):
+    router = af_eventsrouter
+    if router is None or name is None:
+        return af_eventsdb
+    return router(name)
+
+class AfChannel:
+    """Bounded buffer of one channel's events plus a condition to wait on"""
+
+    def __init__(self, dbloc=None, since=0, size=af_eventsbuffer):
+        self.dbloc = dbloc
+        self.events = []
+        self.size = size
+        self.cond = threading.Condition()
+        self.since = since  # every event newer than this reaches the buffer
+        self.evicted = 0  # id of the newest event dropped from the buffer
+        self.waiters = 0
+        self.lastused = time.time()
+
+    def append(self, event):
+        with self.cond:
+            self.events.append(event)
+            if len(self.events) > self.size:
+                self.evicted = self.events.pop(0)["id"]
+            self.cond.notify_all()
+
+af_channels = {}
+af_channelslock = threading.Lock()
+
+af_latencybuckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+af_eventstatslock = threading.Lock()
+af_eventstatsdata = {
+    "published": 0,
+    "delivered": 0,
+    "latencysum": 0.0,
+    "latencymax": 0.0,
+    "buckets": [0] * (len(af_latencybuckets) + 1)
+}
+
+def af_eventcount(key, n=1):
+    with af_eventstatslock:
+        af_eventstatsdata[key] += n
+
+def af_recordlatency(latency=0.0):
+    with af_eventstatslock:
+        af_eventstatsdata["delivered"] += 1
+        af_eventstatsdata["latencysum"] += latency
+        af_eventstatsdata["latencymax"] = max(af_eventstatsdata["latencymax"], latency)
+        for i, bound in enumerate(af_latencybuckets):
+            if latency <= bound:
+                af_eventstatsdata["buckets"][i] += 1
+                break
+        else:
+            af_eventstatsdata["buckets"][-1] += 1
+
+class AfEventWatcher(threading.Thread):
+    """Per-process thread that turns new events rows into local notifications"""
+
+    def __init__(self, dbloc):
+        super().__init__(daemon=True, name="af-event-watcher")
+        self.dbloc = dbloc
+        self.conn = sqlite3.connect(dbloc, check_same_thread=False, isolation_level=None, timeout=5)
+        self.conn.execute("PRAGMA busy_timeout=5000;")
+        self.wake = threading.Event()
+        self.stopped = False
+        self.dataversion = None
+        self.lastid = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM events;").fetchone()[0]
+        self.lasthousekeeping = time.time()
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(af_eventspoll)
+            self.wake.clear()
+            try:
+                self.poll()
+                if time.time() - self.lasthousekeeping > 60:
+                    self.housekeeping()
+            except sqlite3.Error as e:
+                print(f"Error watching events: {e}")
+                time.sleep(1)
+        self.conn.close()
+
+    def poll(self):
+        dataversion = self.conn.execute("PRAGMA data_version;").fetchone()[0]
+        if dataversion == self.dataversion:
+            return
+        self.dataversion = dataversion
+        while True:
+            rows = self.conn.execute(
+                "SELECT id, channel, type, data, created FROM events WHERE id > ? ORDER BY id LIMIT 1000;",
+                (self.lastid,)).fetchall()
+            if rows == []:
+                return
+            now = time.time()
+            with af_channelslock:
+                for id, name, type, data, created in rows:
+                    channel = af_channels.get(name)
+                    if channel is not None and channel.dbloc == self.dbloc:
+                        channel.append(af_eventrow(id, type, data, created))
+                        af_recordlatency(now - created)
+                self.lastid = rows[-1][0]
+            if len(rows) < 1000:
+                return
+
+    def housekeeping(self):
+        self.lasthousekeeping = time.time()
+        with af_channelslock:
+            for name in list(af_channels):
+                channel = af_channels[name]
+                if channel.dbloc == self.dbloc and channel.waiters == 0 and self.lasthousekeeping - channel.lastused > af_eventsidle:
+                    del af_channels[name]
+        self.conn.execute("DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?;", (af_eventskeep,))
+
+af_watchers = {}
+af_watcherlock = threading.Lock()
+
+def af_eventswatcher(dbloc=None):
+    """This process's watcher for dbloc (default database if None), started on first use"""
+    dbloc = dbloc or af_eventsdb
+    watcher = af_watchers.get(dbloc)
+    if watcher is None or not watcher.is_alive():
+        with af_watcherlock:
+            watcher = af_watchers.get(dbloc)
+            if watcher is None or not watcher.is_alive():
+                # forked, or first use: buffers of a dead watcher can't be trusted
+                with af_channelslock:
+                    for name in [n for n, c in af_channels.items() if c.dbloc == dbloc]:
+                        del af_channels[name]
+                for loc in [loc for loc in af_watchers if loc not in af_eventsdbs]:
+                    af_watchers.pop(loc).stopped = True
+                watcher = AfEventWatcher(dbloc)
+                watcher.start()
+                af_watchers[dbloc] = watcher
+    return watcher
+
+def af_eventrow(id=0, type="", data="", created=0.0):
+    return {"id": id, "type": type, "data": json.loads(data) if data else {}, "time": created}
+
+def af_channel(name=""):
+    dbloc = af_eventsdbfor(name)
+    watcher = af_eventswatcher(dbloc)
+    channel = af_channels.get(name)
+    if channel is None or channel.dbloc != dbloc:
+        with af_channelslock:
+            channel = af_channels.get(name)
+            if channel is None or channel.dbloc != dbloc:
+                channel = AfChannel(dbloc, since=watcher.lastid)
+                af_channels[name] = channel
+    return channel
+
+def af_publish(name="", type="message", data=None):
+    """Append an event; it joins the open transaction on the channel's db, if any"""
+    if af_eventsdb is None:
+        print(f"Events not initialized, dropping {type} on {name}")
+        return
+    dbloc = af_eventsdbfor(name)
+    query = "INSERT INTO events (channel, type, data, created) VALUES (?,?,?,?);"
+    params = (name, type, json.dumps(data if data is not None else {}), time.time())
+    af_getdb(dbloc, query, params)
+    af_eventcount("published")
+    watcher = af_watchers.get(dbloc)
+    if watcher is not None:
+        # wake our own watcher as soon as it is visible instead of waiting a poll
+        af_oncommit(dbloc, watcher.wake.set)
+
+def af_lasteventid(name=None):
+    """Newest event id, on a channel or overall"""
+    if name is None:
+        data = af_getdb(af_eventsdb, "SELECT COALESCE(MAX(id), 0) AS id FROM events;", ())
+    else:
+        data = af_getdb(af_eventsdbfor(name), "SELECT COALESCE(MAX(id), 0) AS id FROM events WHERE channel = ?;", (name,))
+    if isinstance(data, str) or data == []:
+        return 0
+    return data[0]["id"]
+
+def af_eventsfromdb(name="", lastid=0, limit=af_eventsbuffer):
+    """Events newer than lastid straight from the table, and whether nothing was pruned/lost"""
+    dbloc = af_eventsdbfor(name)
+    bounds = af_getdb(dbloc, "SELECT COALESCE(MIN(id), 0) AS mn, COALESCE(MAX(id), 0) AS mx FROM events;", ())
+    if isinstance(bounds, str) or bounds == []:
+        return [], False
+    if lastid > bounds[0]["mx"] or (bounds[0]["mn"] > 0 and lastid < bounds[0]["mn"] - 1):
+        return [], False
+    rows = af_getdb(dbloc, "SELECT id, type, data, created FROM events WHERE channel = ? AND id > ? ORDER BY id LIMIT ?;", (name, lastid, limit))
+    if isinstance(rows, str):
+        return [], False
+    return [af_eventrow(r["id"], r["type"], r["data"], r["created"]) for r in rows], True
+
+def af_waitevents(name="", lastid=0, timeout=15):
+    """Events on a channel newer than lastid, waiting up to timeout for one.
+
+    Returns (events, complete); complete is False when lastid can't be resumed
+    from (pruned, or from another database) and the client has to resync.
+    """
+    channel = af_channel(name)
+    watcher = af_eventswatcher(channel.dbloc)
+    deadline = time.time() + timeout
+    while True:
+        with channel.cond:
+            channel.waiters += 1
+            try:
+                if channel.since <= lastid <= watcher.lastid and channel.evicted <= lastid:
+                    events = [e for e in channel.events if e["id"] > lastid]
+                    remaining = deadline - time.time()
+                    if events or remaining <= 0:
+                        return events, True
+                    channel.cond.wait(remaining)
+                    continue
+            finally:
+                channel.waiters -= 1
+                channel.lastused = time.time()
+
+        # not covered by the buffer: older than it, or ahead of our watcher
+        events, complete = af_eventsfromdb(name, lastid)
+        if events or not complete:
+            return events, complete
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return [], True
+        if lastid < channel.since:
+            # the table has nothing newer for this channel, and everything up
+            # to channel.since was committed before that read: wait on the
+            # buffer from there instead of polling the table
+            lastid = channel.since
+            continue
+        # lastid is ahead of this worker's watcher, give it a moment to catch up
+        watcher.wake.set()
+        with channel.cond:
+            channel.cond.wait(min(remaining, 0.05))
+
+def af_eventstats():
+    with af_eventstatslock:
+        stats = dict(af_eventstatsdata)
+        stats["buckets"] = dict(zip([str(b) for b in af_latencybuckets] + ["+Inf"], af_eventstatsdata["buckets"]))
+    stats["latencyavg"] = stats["latencysum"] / stats["delivered"] if stats["delivered"] else 0.0
+    stats["channels"] = len(af_channels)
+    stats["waiters"] = sum(c.waiters for c in list(af_channels.values()))
+    watcher = af_watchers.get(af_eventsdb)
+    stats["lastid"] = watcher.lastid if watcher is not None else 0
+    stats["watchers"] = {loc: w.lastid for loc, w in list(af_watchers.items()) if w.is_alive()}
+    return stats
+
+def af_ssemessage(event=None, comment=""):
+    """Format one Server-Sent Events frame"""
+    if event is None:
+        return f": {comment}\n\n"
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
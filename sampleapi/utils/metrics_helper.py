@@ -0,0 +1,281 @@
+#utils/metrics_helper.py
+import os
+import glob
+import mmap
+import time
+import struct
+import threading
+from flask import g, request
+
+"""
+Prometheus counters and histograms that add up across worker processes.
+
+Every worker process writes its own counters into its own mmap'd file in
+AF_METRICS_DIR (metrics_<pid>.db), so an update is one uncontended lock and
+an 8 byte write, and no process ever waits on another. A scrape reads every
+file in the folder and sums them, so /metrics on any worker shows the whole
+server. Files of workers that exited are kept so counters never go
+backwards; empty the folder when the server is (re)deployed.
+
+Gauges (rooms by state, players online, ...) are not stored: each one is a
+function registered with af_metricgauge and called at scrape time.
+
+AF_METRICS_DIR - folder for the counter files, "" keeps counters in memory
+                 only (per process) (default static/db/metrics)
+
+Example:
+
+af_metricdefine("ular_rolls_total", "counter", "Dice rolls")
+af_metricinc("ular_rolls_total", {"game": "ular"})
+af_metricobserve("af_db_commit_seconds", 0.0012)
+af_metricgauge("ular_rooms", "Rooms by state", lambda: {(("state", "playing"),): 3}, "ular")
+text = af_metricstext()
+"""
+
+af_metricsdir = os.environ.get("AF_METRICS_DIR", "static/db/metrics")
+
+af_latencybuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+af_commitbuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+af_metrictypes = {}
+af_metricgauges = {}
+
+def af_metricdefine(name="", kind="counter", help="", buckets=af_latencybuckets):
+    af_metrictypes[name] = {"kind": kind, "help": help, "buckets": tuple(buckets)}
+
+def af_metricgauge(name="", help="", fn=None, source=""):
+    """Register fn() -> {labels: value} to be read at scrape time; labels is a tuple of (key, value).
+    Several sources (e.g. one per game) can feed the same gauge."""
+    gauge = af_metricgauges.setdefault(name, {"help": help, "fns": {}})
+    gauge["fns"][source] = fn
+
+# Counter file
+# Records are [4 byte key length][key, padded to 8][8 byte double]; the first
+# 8 bytes hold how much of the file is used, written after a new record so a
+# reader never sees half of one.
+
+class AfMetricFile:
+    """One process's counters in an mmap'd file (or a dict when path is None)"""
+
+    initialsize = 64 * 1024
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.values = {}
+        if path is None:
+            return
+        self.file = open(path, "a+b")
+        if os.path.getsize(path) < self.initialsize:
+            self.file.truncate(self.initialsize)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.used = struct.unpack_from("q", self.mm, 0)[0] or 8
+        for key, value, offset in af_metricrecords(self.mm, self.used):
+            self.offsets[key] = offset
+
+    def slot(self, key):
+        encoded = key.encode()
+        padded = len(encoded) + (-(4 + len(encoded)) % 8)
+        size = 4 + padded + 8
+        if self.used + size > len(self.mm):
+            newsize = max(len(self.mm) * 2, self.used + size)
+            self.file.truncate(newsize)
+            self.mm.close()
+            self.mm = mmap.mmap(self.file.fileno(), newsize)
+        offset = self.used
+        struct.pack_into(f"i{padded}sd", self.mm, offset, len(encoded), encoded, 0.0)
+        self.used += size
+        struct.pack_into("q", self.mm, 0, self.used)
+        self.offsets[key] = offset + 4 + padded
+        return self.offsets[key]
+
+    def add(self, key, n=1.0):
+        with self.lock:
+            if self.path is None:
+                self.values[key] = self.values.get(key, 0.0) + n
+                return
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self.slot(key)
+            value = struct.unpack_from("d", self.mm, offset)[0]
+            struct.pack_into("d", self.mm, offset, value + n)
+
+    def items(self):
+        with self.lock:
+            if self.path is None:
+                return list(self.values.items())
+            return [(key, value) for key, value, offset in af_metricrecords(self.mm, self.used)]
+
+def af_metricrecords(buf, used):
+    offset = 8
+    while offset + 4 <= used:
+        length = struct.unpack_from("i", buf, offset)[0]
+        padded = length + (-(4 + length) % 8)
+        key = bytes(buf[offset + 4:offset + 4 + length]).decode()
+        valueoffset = offset + 4 + padded
+        yield key, struct.unpack_from("d", buf, valueoffset)[0], valueoffset
+        offset = valueoffset + 8
+
+af_metricfile = None
+af_metricfilelock = threading.Lock()
+
+def af_metricsfile():
+    """This process's counter file, opened again after a fork"""
+    global af_metricfile
+    mf = af_metricfile
+    if mf is None or mf.pid != os.getpid():
+        with af_metricfilelock:
+            mf = af_metricfile
+            if mf is None or mf.pid != os.getpid():
+                path = None
+                if af_metricsdir:
+                    os.makedirs(af_metricsdir, exist_ok=True)
+                    path = os.path.join(af_metricsdir, f"metrics_{os.getpid()}.db")
+                try:
+                    mf = AfMetricFile(path)
+                except OSError as e:
+                    print(f"⚠️ Metrics file {path} unavailable, counting in memory: {e}")
+                    mf = AfMetricFile(None)
+                mf.pid = os.getpid()
+                af_metricfile = mf
+    return mf
+
+# Recording
+
+af_metrickeys = {}
+
+def af_metrickey(name="", labels=None):
+    """name{k="v",...} with labels sorted, the key a sample is stored under"""
+    if not labels:
+        return name
+    cachekey = (name, tuple(sorted(labels.items())))
+    key = af_metrickeys.get(cachekey)
+    if key is None:
+        inner = ",".join(f'{k}="{af_metricescape(v)}"' for k, v in cachekey[1])
+        key = af_metrickeys[cachekey] = f"{name}{{{inner}}}"
+    return key
+
+def af_metricescape(value=""):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def af_metricinc(name="", labels=None, n=1.0):
+    af_metricsfile().add(af_metrickey(name, labels), n)
+
+af_histogramkeys = {}
+
+def af_metricobserve(name="", value=0.0, labels=None):
+    """Add one observation to histogram name (buckets are stored cumulative)"""
+    cachekey = (name, tuple(sorted((labels or {}).items())))
+    keys = af_histogramkeys.get(cachekey)
+    if keys is None:
+        labels = dict(labels or {})
+        buckets = [(le, af_metrickey(f"{name}_bucket", dict(labels, le=repr(le))))
+                   for le in af_metrictypes.get(name, {}).get("buckets", af_latencybuckets)]
+        buckets.append((float("inf"), af_metrickey(f"{name}_bucket", dict(labels, le="+Inf"))))
+        keys = af_histogramkeys[cachekey] = (buckets, af_metrickey(f"{name}_sum", labels), af_metrickey(f"{name}_count", labels))
+    buckets, sumkey, countkey = keys
+    mf = af_metricsfile()
+    for le, key in buckets:
+        if value <= le:
+            mf.add(key, 1.0)
+    mf.add(sumkey, value)
+    mf.add(countkey, 1.0)
+
+# Request latency
+# af_metricsrequeststart/af_metricsrequestend are before/after_request hooks
+# timing every request into af_http_request_duration_seconds by route.
+
+af_metricdefine("af_http_request_duration_seconds", "histogram", "Request latency by route")
+af_metricdefine("af_http_responses_total", "counter", "Responses by route and status code")
+
+def af_metricsrequeststart():
+    g.af_requeststart = time.perf_counter()
+
+def af_metricsrequestend(response):
+    start = g.pop("af_requeststart", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "(unmatched)"
+        labels = {"blueprint": request.blueprint or "", "route": route, "method": request.method}
+        af_metricobserve("af_http_request_duration_seconds", time.perf_counter() - start, labels)
+        af_metricinc("af_http_responses_total", {"route": route, "status": str(response.status_code)})
+    return response
+
+# Scrape
+
+def af_metricsum():
+    """Every process's counters added up, {key: value}"""
+    totals = {}
+    mine = af_metricsfile()
+    for key, value in mine.items():
+        totals[key] = totals.get(key, 0.0) + value
+    if not af_metricsdir:
+        return totals
+    for path in glob.glob(os.path.join(af_metricsdir, "metrics_*.db")):
+        if path == mine.path:
+            continue
+        try:
+            with open(path, "rb") as f:
+                buf = f.read()
+        except OSError:
+            continue
+        if len(buf) < 8:
+            continue
+        used = min(struct.unpack_from("q", buf, 0)[0], len(buf))
+        for key, value, offset in af_metricrecords(buf, used):
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+def af_metricbase(key=""):
+    name = key.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and af_metrictypes.get(name[:-len(suffix)], {}).get("kind") == "histogram":
+            return name[:-len(suffix)]
+    return name
+
+def af_metricnumber(value=0.0):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def af_metricstext():
+    """All counters, histograms and gauges in Prometheus text format"""
+    families = {}
+    for key, value in af_metricsum().items():
+        families.setdefault(af_metricbase(key), []).append((key, value))
+    lines = []
+    for name in sorted(families):
+        meta = af_metrictypes.get(name, {"kind": "untyped", "help": ""})
+        lines.append(f"# HELP {name} {meta['help']}")
+        lines.append(f"# TYPE {name} {meta['kind']}")
+        samples = families[name]
+        if meta["kind"] == "histogram":
+            samples.sort(key=af_histogramorder)
+        else:
+            samples.sort()
+        lines += [f"{key} {af_metricnumber(value)}" for key, value in samples]
+    for name, gauge in sorted(af_metricgauges.items()):
+        values = {}
+        for source, fn in list(gauge["fns"].items()):
+            try:
+                values.update(fn() or {})
+            except Exception as e:
+                print(f"❌ Metric gauge {name} ({source}) failed: {e}")
+        lines.append(f"# HELP {name} {gauge['help']}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{af_metrickey(name, dict(labels))} {af_metricnumber(value)}")
+    return "\n".join(lines) + "\n"
+
+def af_histogramorder(sample):
+    """Per label set: buckets by le, then _sum, then _count"""
+    key = sample[0]
+    name, _, rest = key.partition("{")
+    labels = [part for part in rest.rstrip("}").split(",") if part and not part.startswith("le=")]
+    le = float("inf")
+    part = 2
+    if name.endswith("_bucket"):
+        part = 0
+        value = rest.split('le="', 1)[1].split('"', 1)[0]
+        le = float("inf") if value == "+Inf" else float(value)
+    elif name.endswith("_sum"):
+        part = 1
+    return (labels, part, le)
@@ -0,0 +1,250 @@
+#utils/profile_helper.py
+import os
+import sys
+import hmac
+import time
+import zlib
+import random
+import threading
+from html import escape
+from flask import g, request
+
+"""
+Sampling profiler for live requests.
+
+A profiled request registers its thread; one daemon thread per worker
+process then looks at that thread's Python stack every AF_PROFILE_INTERVAL ms
+(sys._current_frames, no tracing, so the request runs at full speed) and
+counts each stack under the request's route. While no request is being
+profiled it sleeps on an Event instead of waking up every interval. Counts
+are kept per time window of AF_PROFILE_WINDOW seconds; af_profile() returns a
+window as collapsed stacks ("frame;frame;frame count", the input of
+flamegraph.pl/speedscope) or af_flamegraph() draws it as an SVG.
+
+Which requests are profiled:
+- routes listed in AF_PROFILE_ROUTES, a sample of AF_PROFILE_RATE of them
+- any request with header X-Profile: <AF_PROFILE_TOKEN> (off while the token is empty)
+
+AF_PROFILE_ROUTES - comma separated route rules, e.g. /api/ular/rolldice,/api/ular/state (default none)
+AF_PROFILE_RATE - share of requests to those routes that are profiled (default 0.05)
+AF_PROFILE_INTERVAL - ms between samples (default 5)
+AF_PROFILE_WINDOW - seconds per aggregation window (default 60)
+AF_PROFILE_KEEP - windows kept in memory (default 10)
+AF_PROFILE_TOKEN - admin token for the X-Profile header and the profile endpoint (default none:
+                   no header profiling, and the endpoint refuses every request)
+
+Example:
+
+app.before_request(af_profilerequeststart)
+app.teardown_request(af_profilerequestend)
+af_profile(route="/api/ular/rolldice", window="last")  # {"samples": ..., "collapsed": "..."}
+"""
+
+af_profileroutes = {r.strip() for r in os.environ.get("AF_PROFILE_ROUTES", "").split(",") if r.strip()}
+af_profilerate = float(os.environ.get("AF_PROFILE_RATE", "0.05"))
+af_profileinterval = float(os.environ.get("AF_PROFILE_INTERVAL", "5")) / 1000
+af_profilewindow = float(os.environ.get("AF_PROFILE_WINDOW", "60"))
+af_profilekeep = int(os.environ.get("AF_PROFILE_KEEP", "10"))
+af_profiletoken = os.environ.get("AF_PROFILE_TOKEN", "")
+
+af_profilelock = threading.Lock()
+af_profilethreads = {}  # thread ident -> route being profiled
+af_profileactive = threading.Event()  # set while af_profilethreads is not empty
+af_profilewindows = {}  # window start -> {"requests": {route: n}, "stacks": {(route, stack): n}}
+
+def af_profiletokenok(token=""):
+    """Is token the configured AF_PROFILE_TOKEN (never, when none is set); constant-time compare"""
+    if not af_profiletoken or not token:
+        return False
+    return hmac.compare_digest(token.encode(), af_profiletoken.encode())
+
+def af_profilewanted():
+    """Should the current request be profiled"""
+    if af_profiletokenok(request.headers.get("X-Profile", "")):
+        return True
+    if request.url_rule is None or request.url_rule.rule not in af_profileroutes:
+        return False
+    return random.random() < af_profilerate
+
+def af_profilerequeststart():
+    if not af_profileroutes and not af_profiletoken:
+        return
+    if not af_profilewanted():
+        return
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    with af_profilelock:
+        af_profilethreads[threading.get_ident()] = route
+        af_profileactive.set()
+        window = af_profilebucket(time.time())
+        window["requests"][route] = window["requests"].get(route, 0) + 1
+    g.af_profiling = True
+    af_profilerstart()
+
+def af_profilerequestend(exception=None):
+    if g.pop("af_profiling", False):
+        with af_profilelock:
+            af_profilethreads.pop(threading.get_ident(), None)
+            if not af_profilethreads:
+                af_profileactive.clear()
+
+def af_profilebucket(now):
+    """The window now falls in (created if new, oldest dropped); call with af_profilelock held"""
+    start = now - now % af_profilewindow
+    window = af_profilewindows.get(start)
+    if window is None:
+        window = af_profilewindows[start] = {"requests": {}, "stacks": {}}
+        for old in sorted(af_profilewindows)[:-af_profilekeep]:
+            del af_profilewindows[old]
+    return window
+
+# Sampler
+
+def af_profileframe(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def af_profilestack(frame):
+    """Root-first collapsed stack, cut to start at Flask's wsgi_app"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame.f_code.co_name == "wsgi_app":
+            break
+        frame = frame.f_back
+    return ";".join(af_profileframe(f) for f in reversed(frames))
+
+class AfProfiler(threading.Thread):
+    """Per-process thread sampling the stacks of threads with a profiled request"""
+
+    def __init__(self, interval=af_profileinterval):
+        super().__init__(daemon=True, name="af-profiler")
+        self.interval = interval
+        self.pid = os.getpid()
+        self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        while True:
+            # no profiled request in this process: sleep until one registers
+            af_profileactive.wait()
+            time.sleep(self.interval)
+            with af_profilelock:
+                threads = dict(af_profilethreads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            stacks = [(route, af_profilestack(frames[ident])) for ident, route in threads.items()
+                      if ident != me and ident in frames]
+            del frames
+            with af_profilelock:
+                window = af_profilebucket(time.time())
+                for key in stacks:
+                    window["stacks"][key] = window["stacks"].get(key, 0) + 1
+                self.samples += len(stacks)
+
+af_profiler = None
+af_profilerlock = threading.Lock()
+
+def af_profilerstart():
+    """Start (or restart after a fork) this process's sampler thread; cheap when running"""
+    global af_profiler
+    profiler = af_profiler
+    if profiler is None or profiler.pid != os.getpid() or not profiler.is_alive():
+        with af_profilerlock:
+            profiler = af_profiler
+            if profiler is None or profiler.pid != os.getpid() or not profiler.is_alive():
+                profiler = AfProfiler()
+                profiler.start()
+                af_profiler = profiler
+    return profiler
+
+# Output
+
+def af_profile(route=None, window="last"):
+    """One window's samples as collapsed stacks.
+
+    route - only this route, None for all (stacks are then prefixed with the route)
+    window - "last" (newest window with samples), "all" (every kept window) or a window start time
+    """
+    with af_profilelock:
+        starts = sorted(af_profilewindows)
+        if window == "all":
+            chosen = starts
+        elif window == "last":
+            chosen = [s for s in starts if any(route is None or r == route for r, stack in af_profilewindows[s]["stacks"])][-1:]
+        else:
+            chosen = [s for s in starts if s == float(window)]
+        stacks = {}
+        requests = {}
+        for start in chosen:
+            for (r, stack), n in af_profilewindows[start]["stacks"].items():
+                if route is not None and r != route:
+                    continue
+                key = stack if route is not None else f"{r};{stack}"
+                stacks[key] = stacks.get(key, 0) + n
+            for r, n in af_profilewindows[start]["requests"].items():
+                if route is None or r == route:
+                    requests[r] = requests.get(r, 0) + n
+    return {
+        "windows": chosen,
+        "windowseconds": af_profilewindow,
+        "intervalms": af_profileinterval * 1000,
+        "requests": requests,
+        "samples": sum(stacks.values()),
+        "collapsed": "\n".join(f"{stack} {n}" for stack, n in sorted(stacks.items(), key=lambda x: -x[1]))
+    }
+
+def af_profilestats():
+    with af_profilelock:
+        windows = {start: {"requests": sum(w["requests"].values()), "samples": sum(w["stacks"].values())}
+                   for start, w in sorted(af_profilewindows.items())}
+        active = len(af_profilethreads)
+    return {
+        "routes": sorted(af_profileroutes),
+        "rate": af_profilerate,
+        "header": bool(af_profiletoken),
+        "active": active,
+        "windows": windows
+    }
+
+def af_flamegraph(collapsed="", title="profile", width=1200):
+    """Collapsed stacks -> flamegraph SVG (root at the bottom, width = share of samples)"""
+    root = {"n": 0, "children": {}}
+    for line in collapsed.splitlines():
+        stack, _, n = line.rpartition(" ")
+        if not stack or not n.isdigit():
+            continue
+        node = root
+        node["n"] += int(n)
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"n": 0, "children": {}})
+            node["n"] += int(n)
+
+    rowheight = 16
+    rects = []
+    depth = [0]
+
+    def layout(node, x, level, name):
+        w = node["n"] / root["n"] * width if root["n"] else 0
+        if w < 0.3:
+            return
+        depth[0] = max(depth[0], level)
+        rects.append((x, level, w, name, node["n"]))
+        for child, sub in sorted(node["children"].items()):
+            layout(sub, x, level + 1, child)
+            x += sub["n"] / root["n"] * width
+
+    layout(root, 0, 0, "all")
+    height = (depth[0] + 1) * rowheight + 30
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+             f'<text x="4" y="14">{escape(title)} ({root["n"]} samples)</text>']
+    for x, level, w, name, n in rects:
+        y = height - (level + 1) * rowheight
+        hue = 20 + zlib.crc32(name.encode()) % 40
+        label = escape(name[:int(w / 7)]) if w > 21 else ""
+        pct = n / root["n"] * 100
+        parts.append(f'<g><title>{escape(name)}: {n} samples ({pct:.1f}%)</title>'
+                     f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{rowheight - 1}" fill="hsl({hue},80%,60%)"/>'
+                     f'<text x="{x + 3:.1f}" y="{y + 12}">{label}</text></g>')
+    parts.append("</svg>")
+    return "\n".join(parts)
@@ -0,0 +1,118 @@
+#utils/reaper_helper.py
+import os
+import time
+import threading
+from .db_helper import af_ensuredb
+
+"""
+Background housekeeping for finished and abandoned games.
+
+Each game module registers a reap function with af_reaperadd; one daemon
+thread per worker process calls them every AF_REAPER_INTERVAL seconds. A reap
+function does one bounded pass (expire idle rooms, move finished ones to the
+archive database, vacuum) and returns counters, which are summed into
+af_reaperstats(). Passes in several workers at once are safe: every step is
+guarded by the row it read, archive rows are keyed so a repeat is a no-op.
+
+AF_REAPER_INTERVAL - seconds between passes, 0 turns the thread off (default 60)
+AF_ROOM_TTL - seconds without a move before a room is ended (default 3600)
+AF_ARCHIVE_AFTER - seconds an ended room stays in the hot tables (default 600)
+AF_REAP_BATCH - rooms per archive batch (default 500)
+AF_VACUUM_PAGES - free pages given back per pass, 0 = all (default 2000)
+AF_ARCHIVE_DB - archive database file (default static/db/archive.db)
+
+Example:
+
+af_reaperadd("ular", reapularrooms)
+af_reaperstart()
+af_reaperstats()  # {"passes": 3, "counters": {"ular.archived": 120, ...}}
+"""
+
+af_reaperinterval = float(os.environ.get("AF_REAPER_INTERVAL", "60"))
+af_roomttl = float(os.environ.get("AF_ROOM_TTL", "3600"))
+af_archiveafter = float(os.environ.get("AF_ARCHIVE_AFTER", "600"))
+af_reapbatch = int(os.environ.get("AF_REAP_BATCH", "500"))
+af_vacuumpages = int(os.environ.get("AF_VACUUM_PAGES", "2000"))
+af_archivedb = os.environ.get("AF_ARCHIVE_DB", "static/db/archive.db")
+
+af_reapertasks = {}
+af_reaperstatslock = threading.Lock()
+af_reaperstatsdata = {
+    "passes": 0,
+    "errors": 0,
+    "lastpass": 0.0,
+    "lastduration": 0.0,
+    "counters": {}
+}
+
+def af_reaperadd(name="", fn=None):
+    """Register fn() -> {counter: n} to run on every reaper pass"""
+    af_reapertasks[name] = fn
+
+def af_archiveinit():
+    """Create the archive database file if needed and return its path"""
+    return af_ensuredb(af_archivedb)
+
+def af_reaperpass():
+    """Run every registered task once, now, on the calling thread"""
+    start = time.time()
+    for name, fn in list(af_reapertasks.items()):
+        try:
+            counters = fn() or {}
+        except Exception as e:
+            print(f"❌ Reaper task {name} failed: {e}")
+            with af_reaperstatslock:
+                af_reaperstatsdata["errors"] += 1
+            continue
+        with af_reaperstatslock:
+            for key, n in counters.items():
+                key = f"{name}.{key}"
+                af_reaperstatsdata["counters"][key] = af_reaperstatsdata["counters"].get(key, 0) + n
+    with af_reaperstatslock:
+        af_reaperstatsdata["passes"] += 1
+        af_reaperstatsdata["lastpass"] = start
+        af_reaperstatsdata["lastduration"] = time.time() - start
+
+class AfReaper(threading.Thread):
+    """Per-process thread running af_reaperpass every af_reaperinterval seconds"""
+
+    def __init__(self, interval=af_reaperinterval):
+        super().__init__(daemon=True, name="af-reaper")
+        self.interval = interval
+        self.pid = os.getpid()
+        self.wake = threading.Event()
+        self.stopped = False
+
+    def run(self):
+        while not self.stopped:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.stopped:
+                af_reaperpass()
+
+af_reaper = None
+af_reaperlock = threading.Lock()
+
+def af_reaperstart():
+    """Start (or restart after a fork) this process's reaper thread; cheap when running"""
+    global af_reaper
+    if af_reaperinterval <= 0:
+        return None
+    reaper = af_reaper
+    if reaper is None or reaper.pid != os.getpid() or not reaper.is_alive():
+        with af_reaperlock:
+            reaper = af_reaper
+            if reaper is None or reaper.pid != os.getpid() or not reaper.is_alive():
+                reaper = AfReaper()
+                reaper.start()
+                af_reaper = reaper
+    return reaper
+
+def af_reaperstats():
+    with af_reaperstatslock:
+        stats = dict(af_reaperstatsdata)
+        stats["counters"] = dict(af_reaperstatsdata["counters"])
+    stats["tasks"] = list(af_reapertasks)
+    stats["interval"] = af_reaperinterval
+    stats["running"] = af_reaper is not None and af_reaper.is_alive() and af_reaper.pid == os.getpid()
+    return stats
@@ -0,0 +1,147 @@
+#utils/roomcode_helper.py
+import hashlib
+import random
+import string
+import threading
+from .db_helper import af_getdb, af_transaction, af_rowcount
+
+"""
+Collision-free short codes (room codes) without a retry loop.
+
+Each scope keeps a counter in the `roomcodes` table. Code n is the counter
+pushed through a keyed Feistel permutation of [0, 36^length) and written in
+base 36, so consecutive rooms get unrelated looking codes but no code is
+handed out twice. When the counter has used the whole space the scope moves
+on to codes one character longer.
+
+Released codes (rooms that were deleted) go to `freecodes` and are handed out
+again before the counter moves. Codes that already existed before the
+allocator took over are kept in `reservedcodes` and skipped once when the
+permutation reaches them.
+
+Example:
+
+af_codesinit("static/db/ular.db", "room", length=4, existing=["AB12"])
+code = af_allocatecode("static/db/ular.db", "room")
+af_releasecode("static/db/ular.db", "room", code)
+"""
+
+af_codechars = string.ascii_uppercase + string.digits
+af_feistelrounds = 4
+
+af_codesready = set()
+af_codeslock = threading.Lock()
+
+def af_codesinit(dbloc="", scope="room", length=4, existing=None):
+    """Create the allocator tables in dbloc and start scope if it is new.
+
+    existing - codes already in use (a list, or a function returning one),
+               only read the first time scope is seen
+    """
+    af_getdb(dbloc, """CREATE TABLE IF NOT EXISTS roomcodes (
+        scope TEXT PRIMARY KEY,
+        length INTEGER,
+        counter INTEGER,
+        key INTEGER
+    );""", ())
+    af_getdb(dbloc, """CREATE TABLE IF NOT EXISTS freecodes (
+        scope TEXT,
+        code TEXT,
+        PRIMARY KEY (scope, code)
+    ) WITHOUT ROWID;""", ())
+    af_getdb(dbloc, """CREATE TABLE IF NOT EXISTS reservedcodes (
+        scope TEXT,
+        code TEXT,
+        PRIMARY KEY (scope, code)
+    ) WITHOUT ROWID;""", ())
+    with af_transaction(dbloc):
+        query = "INSERT OR IGNORE INTO roomcodes (scope, length, counter, key) VALUES (?,?,?,?);"
+        result = af_getdb(dbloc, query, (scope, length, 0, random.getrandbits(62)))
+        if af_rowcount(result) == 1 and existing:
+            if callable(existing):
+                existing = existing()
+            codes = {str(code).upper() for code in existing if code}
+            for code in codes:
+                af_getdb(dbloc, "INSERT OR IGNORE INTO reservedcodes (scope, code) VALUES (?,?);", (scope, code))
+            if codes:
+                print(f"✅ Reserved {len(codes)} existing {scope} codes")
+    with af_codeslock:
+        af_codesready.add(dbloc)
+
+def af_feistel(value=0, bits=2, key=0):
+    """Keyed permutation of [0, 2^bits), bits even"""
+    half = bits // 2
+    mask = (1 << half) - 1
+    left, right = value >> half, value & mask
+    for r in range(af_feistelrounds):
+        digest = hashlib.blake2b(f"{key}:{r}:{right}".encode(), digest_size=8).digest()
+        left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+    return (left << half) | right
+
+def af_permutecode(counter=0, length=4, key=0):
+    """The counter-th code of the given length (a bijection on 0..36^length-1)"""
+    space = len(af_codechars) ** length
+    bits = (space - 1).bit_length()
+    bits += bits % 2
+    value = af_feistel(counter, bits, key)
+    # cycle walking: the Feistel domain is at most 4x the code space
+    while value >= space:
+        value = af_feistel(value, bits, key)
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, len(af_codechars))
+        chars.append(af_codechars[digit])
+    return "".join(reversed(chars))
+
+def af_allocatecode(dbloc="", scope="room", length=4):
+    """A code nobody in scope holds; joins the open transaction on dbloc, if any"""
+    if dbloc not in af_codesready:
+        af_codesinit(dbloc, scope, length)
+    with af_transaction(dbloc):
+        data = af_getdb(dbloc, "SELECT code FROM freecodes WHERE scope = ? LIMIT 1;", (scope,))
+        if isinstance(data, list) and data != []:
+            code = data[0]["code"]
+            af_getdb(dbloc, "DELETE FROM freecodes WHERE scope = ? AND code = ?;", (scope, code))
+            return code
+
+        data = af_getdb(dbloc, "SELECT length, counter, key FROM roomcodes WHERE scope = ?;", (scope,))
+        if isinstance(data, str) or data == []:
+            af_codesinit(dbloc, scope, length)
+            data = af_getdb(dbloc, "SELECT length, counter, key FROM roomcodes WHERE scope = ?;", (scope,))
+        codelength, counter, key = data[0]["length"], data[0]["counter"], data[0]["key"]
+        while True:
+            if counter >= len(af_codechars) ** codelength:
+                print(f"⚠️ {scope} codes of length {codelength} used up, moving to {codelength + 1}")
+                codelength += 1
+                counter = 0
+            code = af_permutecode(counter, codelength, key + codelength)
+            counter += 1
+            # pre-allocator codes are each met at most once
+            result = af_getdb(dbloc, "DELETE FROM reservedcodes WHERE scope = ? AND code = ?;", (scope, code))
+            if af_rowcount(result) != 1:
+                break
+        af_getdb(dbloc, "UPDATE roomcodes SET length = ?, counter = ? WHERE scope = ?;", (codelength, counter, scope))
+    return code
+
+def af_releasecode(dbloc="", scope="room", code=""):
+    """Give a code back once whatever held it is gone"""
+    with af_transaction(dbloc):
+        result = af_getdb(dbloc, "DELETE FROM reservedcodes WHERE scope = ? AND code = ?;", (scope, code))
+        if af_rowcount(result) != 1:
+            af_getdb(dbloc, "INSERT OR IGNORE INTO freecodes (scope, code) VALUES (?,?);", (scope, code))
+
+def af_codestats(dbloc="", scope="room"):
+    data = af_getdb(dbloc, "SELECT length, counter FROM roomcodes WHERE scope = ?;", (scope,))
+    if isinstance(data, str) or data == []:
+        return {}
+    free = af_getdb(dbloc, "SELECT COUNT(*) AS n FROM freecodes WHERE scope = ?;", (scope,))
+    reserved = af_getdb(dbloc, "SELECT COUNT(*) AS n FROM reservedcodes WHERE scope = ?;", (scope,))
+    space = len(af_codechars) ** data[0]["length"]
+    return {
+        "length": data[0]["length"],
+        "allocated": data[0]["counter"],
+        "space": space,
+        "used": round(data[0]["counter"] / space, 4),
+        "free": free[0]["n"] if isinstance(free, list) else 0,
+        "reserved": reserved[0]["n"] if isinstance(reserved, list) else 0
+    }